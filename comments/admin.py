@@ -6,6 +6,6 @@ from comments.models import Comment
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
     """Регистрация модели Comment в админке"""
-    list_display = ('id', 'text', 'user', 'theme', 'lesson',)
-    list_filter = ('user', 'theme', 'lesson',)
+    list_display = ('id', 'text', 'user', 'target_type', 'target_id',)
+    list_filter = ('user', 'target_type',)
     search_fields = ('text',)
@@ -0,0 +1,201 @@
+import asyncio
+import json
+import threading
+from abc import ABC, abstractmethod
+from functools import lru_cache
+
+from django.core.handlers.asgi import ASGIRequest
+from django.template.loader import render_to_string
+from django.utils.module_loading import import_string
+
+from comments.models import Comment
+from config import settings
+
+# сообщения, которые ждут отправки одному подписчику; при переполнении
+# новые сообщения подписчику не доставляются (клиент получит их
+# при переподключении по заголовку Last-Event-ID)
+SUBSCRIBER_QUEUE_SIZE = 100
+# интервал (в секундах) пустых сообщений, которые не дают
+# прокси-серверу закрыть неактивное соединение
+KEEPALIVE_INTERVAL = 15
+# сколько пропущенных комментариев досылается при переподключении
+REPLAY_LIMIT = 100
+# время (в секундах), после которого лента закрывается: браузер
+# переподключается через интервал из поля retry и получает пропущенное
+# по заголовку Last-Event-ID, а соединение не остаётся открытым навсегда
+STREAM_LIFETIME = 5 * 60
+
+
+class BaseBroker(ABC):
+    """
+    Интерфейс брокера событий комментариев.
+    Брокер выбирается настройкой COMMENT_EVENTS_BACKEND: LocalBroker
+    доставляет сообщения только внутри процесса, брокер для нескольких
+    процессов сервера (например, через Redis pub/sub) реализует
+    эти же два метода.
+    """
+
+    @abstractmethod
+    def publish(self, channel, message):
+        """
+        Отправляет сообщение всем подписчикам канала
+        (вызывается из синхронного кода).
+        :arg
+        channel -- название канала
+        message -- словарь, сериализуемый в JSON
+        """
+
+    @abstractmethod
+    def subscribe(self, channel):
+        """
+        Асинхронный контекстный менеджер подписки на канал:
+        возвращает asyncio.Queue, в которую поступают сообщения канала,
+        при выходе подписка отменяется
+        """
+
+
+class LocalBroker(BaseBroker):
+    """
+    Брокер внутри одного процесса: у каждого подписчика своя очередь
+    в его цикле событий, publish() может вызываться из любого потока
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_deliver, queue, message)
+            except RuntimeError:
+                # цикл событий подписчика уже закрыт
+                pass
+
+    def subscribe(self, channel):
+        return LocalSubscription(self, channel)
+
+    def _add(self, channel, subscriber):
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(subscriber)
+
+    def _remove(self, channel, subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, [])
+            if subscriber in subscribers:
+                subscribers.remove(subscriber)
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+
+class LocalSubscription:
+    """
+    Подписка LocalBroker на канал. Контекстный менеджер написан
+    классом, а не генератором: при закрытии ленты (GeneratorExit,
+    в том числе при завершении цикла событий) подписка отменяется
+    в __aexit__ и не зависит от того, закрыт ли уже другой генератор.
+    """
+
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.subscriber = None
+
+    async def __aenter__(self):
+        self.subscriber = (asyncio.get_running_loop(),
+                           asyncio.Queue(SUBSCRIBER_QUEUE_SIZE))
+        self.broker._add(self.channel, self.subscriber)
+        return self.subscriber[1]
+
+    async def __aexit__(self, *exc_info):
+        self.broker._remove(self.channel, self.subscriber)
+        return False
+
+
+def _deliver(queue, message):
+    try:
+        queue.put_nowait(message)
+    except asyncio.QueueFull:
+        pass
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """Брокер событий из настройки COMMENT_EVENTS_BACKEND"""
+    return import_string(settings.COMMENT_EVENTS_BACKEND)()
+
+
+def comment_stream_available(request):
+    """
+    Лента новых комментариев доступна, только если сайт работает
+    через ASGI (config.asgi): под WSGI открытая лента занимала бы
+    поток сервера на всё время соединения
+    """
+    return isinstance(request, ASGIRequest)
+
+
+def comment_channel(target, pk):
+    """
+    Название канала новых комментариев к материалу.
+    :arg
+    target -- вид материала ('lesson', 'theme' или 'test')
+    pk -- id материала
+    """
+    return f'comments:{target}:{pk}'
+
+
+def comment_message(comment):
+    """
+    Сообщение о новом комментарии: id и html фрагмент, который
+    добавляется в ленту комментариев (автор должен быть загружен)
+    """
+    return {'id': comment.pk, 'html': render_to_string(
+        'comments/comment_items.html', {'comments': [comment]})}
+
+
+def publish_comment(comment):
+    """Отправляет новый комментарий подписчикам ленты материала"""
+    get_broker().publish(
+        comment_channel(comment.target_type, comment.target_id),
+        comment_message(comment))
+
+
+def format_event(message):
+    """Сообщение в формате text/event-stream"""
+    return (f'id: {message["id"]}\nevent: comment\n'
+            f'data: {json.dumps(message, ensure_ascii=False)}\n\n')
+
+
+async def comment_events(target, pk, last_event_id=None):
+    """
+    Асинхронный генератор ленты новых комментариев к материалу
+    в формате server-sent events. Подписка оформляется до того,
+    как досылаются комментарии, пропущенные после last_event_id,
+    поэтому комментарий может прийти дважды (клиент пропускает
+    уже показанные), но не теряется. Через STREAM_LIFETIME секунд
+    лента заканчивается, и браузер переподключается.
+    :arg
+    target -- вид материала ('lesson', 'theme' или 'test')
+    pk -- id материала
+    last_event_id -- id последнего полученного клиентом комментария
+    """
+    async with get_broker().subscribe(comment_channel(target, pk)) as queue:
+        yield f'retry: {KEEPALIVE_INTERVAL * 1000}\n\n'
+        if last_event_id:
+            missed = Comment.objects.filter(
+                target_type=target, target_id=pk, pk__gt=last_event_id
+            ).select_related('user').order_by('pk')[:REPLAY_LIMIT]
+            async for comment in missed:
+                yield format_event(comment_message(comment))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STREAM_LIFETIME
+        while loop.time() < deadline:
+            try:
+                message = await asyncio.wait_for(queue.get(), min(
+                    KEEPALIVE_INTERVAL, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            yield format_event(message)
@@ -1,15 +1,27 @@
 import django_filters
 
 from comments.models import Comment
+from comments.search import search_comments, target_title_matches
 
 
 class CommentFilter(django_filters.FilterSet):
     """Фильтр комментариев"""
     text = django_filters.CharFilter(lookup_expr='icontains')
-    theme__title = django_filters.CharFilter(lookup_expr='icontains')
-    lesson__title = django_filters.CharFilter(lookup_expr='icontains')
-    test__title = django_filters.CharFilter(lookup_expr='icontains')
+    theme__title = django_filters.CharFilter(method='filter_target_title')
+    lesson__title = django_filters.CharFilter(method='filter_target_title')
+    test__title = django_filters.CharFilter(method='filter_target_title')
+    search = django_filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Comment
-        fields = ['text', 'theme', 'lesson']
+        fields = ['text', 'target_type']
+
+    def filter_target_title(self, queryset, name, value):
+        """Поиск по названию темы/урока/теста ('theme__title' и т.п.)"""
+        target_type = name.split('__')[0]
+        return queryset.filter(
+            target_title_matches(value, 'icontains', [target_type]))
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по тексту комментария и названиям"""
+        return search_comments(queryset, value)
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management import BaseCommand
+
+from comments.services import import_comments, IMPORT_BATCH_SIZE
+from materials.counters import recount
+
+
+class Command(BaseCommand):
+    """
+    Загружает комментарии из файла JSON Lines (одна строка -
+    один комментарий, формат - см. comments.services.parse_comment).
+    Строки с ошибками и ссылками на несуществующих пользователей
+    и материалы пропускаются. После загрузки пересчитываются
+    счётчики комментариев.
+    """
+    help = 'Загружает комментарии из файла JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='путь к файлу .jsonl')
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='количество комментариев в одном запросе INSERT')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        with open(options['path'], encoding='utf-8') as lines:
+            imported, skipped = import_comments(
+                lines, options['batch_size'])
+        recount()
+        seconds = time.perf_counter() - start
+        rate = imported / seconds * 60 if seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено комментариев: {imported}, пропущено строк: '
+            f'{skipped}, время: {seconds:.1f} с ({rate:.0f} в минуту)'))
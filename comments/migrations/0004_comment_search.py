@@ -0,0 +1,48 @@
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_SQL = [
+    'ALTER TABLE comments_comment ADD COLUMN search_vector tsvector '
+    'GENERATED ALWAYS AS '
+    "(to_tsvector('russian', coalesce(text, ''))) STORED",
+    'CREATE INDEX comment_search_vector_idx '
+    'ON comments_comment USING GIN (search_vector)',
+    'CREATE INDEX theme_title_trgm_idx '
+    'ON materials_theme USING GIN (title gin_trgm_ops)',
+    'CREATE INDEX lesson_title_trgm_idx '
+    'ON materials_lesson USING GIN (title gin_trgm_ops)',
+    'CREATE INDEX test_title_trgm_idx '
+    'ON materials_testpaper USING GIN (title gin_trgm_ops)',
+]
+
+REVERSE_SQL = [
+    'DROP INDEX IF EXISTS test_title_trgm_idx',
+    'DROP INDEX IF EXISTS lesson_title_trgm_idx',
+    'DROP INDEX IF EXISTS theme_title_trgm_idx',
+    'ALTER TABLE comments_comment DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run_postgres_sql(statements):
+    """Выполняет SQL только в PostgreSQL (в других СУБД поиск
+    выполняется без полнотекстового индекса)"""
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0003_access_indexes'),
+        ('materials', '0016_access_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.RunPython(run_postgres_sql(SEARCH_SQL),
+                             run_postgres_sql(REVERSE_SQL)),
+    ]
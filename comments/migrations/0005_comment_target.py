@@ -0,0 +1,22 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0004_comment_search'),
+        ('materials', '0018_content_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='target_type',
+            field=models.CharField(choices=[('lesson', 'урок'), ('theme', 'тема'), ('test', 'тест')], max_length=10, null=True, verbose_name='вид материала'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='target_id',
+            field=models.PositiveBigIntegerField(null=True, verbose_name='id материала'),
+        ),
+    ]
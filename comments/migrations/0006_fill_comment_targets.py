@@ -0,0 +1,35 @@
+from django.db import migrations
+from django.db.models import F
+
+TARGET_FIELDS = ('lesson', 'theme', 'test')
+
+
+def fill_targets(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    for field in TARGET_FIELDS:
+        Comment.objects.filter(**{f'{field}__isnull': False}).update(
+            target_type=field, target_id=F(f'{field}_id'))
+    # комментарии без материала не отображаются ни на одной странице
+    Comment.objects.filter(target_type__isnull=True).delete()
+
+
+def restore_targets(apps, schema_editor):
+    Comment = apps.get_model('comments', 'Comment')
+    for field in TARGET_FIELDS:
+        Comment.objects.filter(target_type=field).update(
+            **{f'{field}_id': F('target_id')})
+
+
+# данные переносятся в отдельной транзакции: в PostgreSQL изменение
+# таблицы в одной транзакции с обновлением строк, у которых есть
+# отложенные проверки внешних ключей, завершается ошибкой
+# "pending trigger events"
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0005_comment_target'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_targets, restore_targets),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0006_fill_comment_targets'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_lesson_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_theme_date_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='comment',
+            name='comment_test_date_idx',
+        ),
+        migrations.RemoveField(
+            model_name='comment',
+            name='lesson',
+        ),
+        migrations.RemoveField(
+            model_name='comment',
+            name='test',
+        ),
+        migrations.RemoveField(
+            model_name='comment',
+            name='theme',
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='target_type',
+            field=models.CharField(choices=[('lesson', 'урок'), ('theme', 'тема'), ('test', 'тест')], max_length=10, verbose_name='вид материала'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='target_id',
+            field=models.PositiveBigIntegerField(verbose_name='id материала'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['target_type', 'target_id', 'date'], name='comment_target_date_idx'),
+        ),
+    ]
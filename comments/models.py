@@ -1,41 +1,84 @@
-from django.db import models
+from django.db import models, transaction
+from django.urls import reverse
 
 from constants import nullable
 from materials.models import Theme, Lesson, TestPaper
 from users.models import User
 
 
+# материалы, к которым оставляются комментарии: {вид материала: модель}
+COMMENT_TARGETS = {'lesson': Lesson, 'theme': Theme, 'test': TestPaper}
+COMMENT_TARGET_TYPES = {model: target_type
+                        for target_type, model in COMMENT_TARGETS.items()}
+
+
 class Comment(models.Model):
     """Комментарий. Представляет собой вопрос по уроку/тесту,
     предложения по улучшению контента и пр.
-    'theme', 'lesson','test' - взаимоисключающие поля,
-    указывают, где был оставлен комментарий."""
+    Материал, к которому оставлен комментарий, задаётся видом
+    (target_type) и id (target_id) - новые виды материалов
+    не требуют новых столбцов, а выборка комментариев к любому
+    материалу использует один индекс.
+    В PostgreSQL таблица также содержит вычисляемый столбец
+    search_vector для полнотекстового поиска (см. comments.search)."""
+    LESSON = 'lesson'
+    THEME = 'theme'
+    TEST = 'test'
+    TARGET_TYPES = [
+        (LESSON, 'урок'),
+        (THEME, 'тема'),
+        (TEST, 'тест'),
+    ]
+    # "комментарий к ..."
+    TARGET_DATIVE = {LESSON: 'уроку', THEME: 'теме', TEST: 'тесту'}
+    TARGET_URL_NAMES = {LESSON: 'material:lesson_detail',
+                        THEME: 'comments:theme_comments',
+                        TEST: 'comments:test_comments'}
+
     text = models.TextField(verbose_name='текст комментария')
     user = models.ForeignKey(
         User, on_delete=models.CASCADE, **nullable,
         verbose_name='пользователь')
-    theme = models.ForeignKey(
-        Theme, **nullable, on_delete=models.CASCADE, verbose_name='тема')
-    lesson = models.ForeignKey(
-        Lesson, **nullable, on_delete=models.CASCADE,
-        verbose_name='урок')
-    test = models.ForeignKey(
-        TestPaper, **nullable, on_delete=models.CASCADE,
-        verbose_name='тест')
+    target_type = models.CharField(
+        max_length=10, choices=TARGET_TYPES, verbose_name='вид материала')
+    target_id = models.PositiveBigIntegerField(verbose_name='id материала')
     date = models.DateTimeField(**nullable, verbose_name='дата и время')
 
+    @property
+    def target(self):
+        """Материал комментария (загружается при первом обращении,
+        для списка комментариев - см. comments.services.load_targets)"""
+        if not hasattr(self, '_target'):
+            self._target = COMMENT_TARGETS[self.target_type].objects.filter(
+                pk=self.target_id).first()
+        return self._target
+
+    @target.setter
+    def target(self, obj):
+        if type(obj) not in COMMENT_TARGET_TYPES:
+            raise ValueError(f'Нельзя комментировать {obj!r}')
+        self.target_type = COMMENT_TARGET_TYPES[type(obj)]
+        self.target_id = obj.pk
+        self._target = obj
+
+    def get_target_url(self):
+        return reverse(self.TARGET_URL_NAMES[self.target_type],
+                       args=[self.target_id])
+
     def __str__(self):
-        if self.lesson:
-            key_word = 'уроку'
-            key_object = self.lesson
-        elif self.theme:
-            key_word = 'теме'
-            key_object = self.theme
-        else:
-            key_word = 'тесту'
-            key_object = 'test'
-        return f'Комментарий {self.user} к {key_word} {key_object}'
+        return (f'Комментарий {self.user} к '
+                f'{self.TARGET_DATIVE[self.target_type]} {self.target}')
+
+    def save(self, *args, **kwargs):
+        # счётчик комментариев материала обновляется сигналом
+        # в той же транзакции (см. materials.counters)
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = 'комментарий'
         verbose_name_plural = 'комментарии'
+        indexes = [
+            models.Index(fields=['target_type', 'target_id', 'date'],
+                         name='comment_target_date_idx'),
+        ]
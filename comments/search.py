@@ -0,0 +1,92 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, \
+    SearchVectorField, TrigramWordSimilarity
+from django.db import connection
+from django.db.models import Q, Value, FloatField, Case, When, OuterRef, \
+    Subquery
+from django.db.models.functions import Cast
+from django.db.models.expressions import RawSQL
+
+from comments.models import COMMENT_TARGETS
+
+SEARCH_CONFIG = 'russian'
+
+
+def search_vector():
+    """
+    Столбец comments_comment.search_vector (tsvector), который
+    PostgreSQL вычисляет из текста комментария при каждой записи
+    (создаётся миграцией comments 0004 только в PostgreSQL)
+    """
+    return RawSQL('"comments_comment"."search_vector"', [],
+                  output_field=SearchVectorField())
+
+
+def target_title_matches(query, lookup, target_types=COMMENT_TARGETS):
+    """
+    Условие для комментариев к материалам, название которых
+    соответствует запросу.
+    :arg
+    query -- строка запроса
+    lookup -- способ сравнения названия (например, 'icontains'
+    или 'trigram_word_similar' - похожие названия, допускают опечатки)
+    target_types -- виды материалов
+    """
+    condition = Q()
+    for target_type in target_types:
+        condition |= Q(target_type=target_type, target_id__in=COMMENT_TARGETS[
+            target_type].objects.filter(
+                **{f'title__{lookup}': query}).values('id'))
+    return condition
+
+
+def target_title_similarity(query, target_types=COMMENT_TARGETS):
+    """
+    Сходство названия материала комментария с запросом
+    (word_similarity из pg_trgm, double precision).
+    :arg
+    query -- строка запроса
+    target_types -- виды материалов
+    """
+    return Case(*(
+        When(target_type=target_type, then=Subquery(
+            COMMENT_TARGETS[target_type].objects.filter(
+                pk=OuterRef('target_id')).annotate(similarity=Cast(
+                    TrigramWordSimilarity(query, 'title'), FloatField())
+            ).values('similarity')[:1]))
+        for target_type in target_types),
+        default=Value(0.0), output_field=FloatField())
+
+
+def search_comments(queryset, query):
+    """
+    Полнотекстовый поиск комментариев.
+    В PostgreSQL ищет по столбцу search_vector (GIN индекс)
+    с учётом морфологии русского языка, ранг - ts_rank. Если по тексту
+    ничего не найдено, ищутся комментарии к темам, урокам и тестам
+    с похожими названиями (допускаются опечатки), ранг - сходство
+    названия с запросом.
+    В остальных СУБД так же ищется подстрока сначала в тексте,
+    затем в названиях, с одинаковым рангом.
+    :arg
+    queryset -- выборка комментариев
+    query -- строка запроса
+    :return
+    queryset с аннотацией rank
+    """
+    if connection.vendor != 'postgresql':
+        found = queryset.filter(text__icontains=query)
+        if not found.exists():
+            found = queryset.filter(target_title_matches(query, 'icontains'))
+        return found.annotate(rank=Value(0.0, output_field=FloatField()))
+    search_query = SearchQuery(
+        query, config=SEARCH_CONFIG, search_type='websearch')
+    found = queryset.alias(vector=search_vector()).filter(
+        vector=search_query).annotate(rank=Cast(
+            # ts_rank возвращает real: в double precision значение ранга
+            # без потерь проходит через курсор страницы
+            SearchRank(search_vector(), search_query), FloatField()))
+    if found.exists():
+        return found
+    return queryset.filter(
+        target_title_matches(query, 'trigram_word_similar')
+    ).annotate(rank=target_title_similarity(query))
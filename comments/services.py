@@ -0,0 +1,196 @@
+import json
+from datetime import datetime
+
+import pytz
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from comments.models import Comment, COMMENT_TARGETS
+from config.settings import TIME_ZONE
+from materials.pagination import KeysetPaginationMixin
+from users.models import User
+
+COMMENT_PAGE_SIZE = 20
+IMPORT_BATCH_SIZE = 5000
+
+
+class CommentThreadPaginator(KeysetPaginationMixin):
+    """
+    Постраничный вывод комментариев к уроку/теме/тесту:
+    сначала новые, порядок (date, id), автор загружается
+    в том же запросе
+    """
+    model = Comment
+    keyset_field = 'date'
+    list_select_related = ('user',)
+    list_only = ('text', 'date', 'user', 'user__first_name',
+                 'user__last_name')
+
+
+def get_comment_page(target, pk, cursor=None):
+    """
+    Возвращает одну страницу комментариев к материалу.
+    :arg
+    target -- вид материала ('lesson', 'theme' или 'test')
+    pk -- id материала
+    cursor -- курсор страницы (None - первая страница)
+    :return
+    comments -- список комментариев страницы
+    next_cursor -- курсор следующей страницы или None
+    """
+    return CommentThreadPaginator().get_keyset_page(
+        Comment.objects.filter(target_type=target, target_id=pk), cursor,
+        COMMENT_PAGE_SIZE)
+
+
+def get_comment_thread(target, pk, cursor=None, stream=False):
+    """
+    Контекст шаблона comments/comment_thread.html: первая (или
+    указанная курсором) страница комментариев к материалу, адрес,
+    по которому подгружаются следующие страницы, и адрес ленты
+    новых комментариев.
+    :arg
+    target -- вид материала ('lesson', 'theme' или 'test')
+    pk -- id материала
+    cursor -- курсор страницы
+    stream -- подключать ли ленту новых комментариев
+    (см. comments.events.comment_stream_available)
+    """
+    comments, next_cursor = get_comment_page(target, pk, cursor)
+    context = {'comments': comments,
+               'next_comment_cursor': next_cursor,
+               'comment_page_url': reverse(
+                   f'comments:{target}_comment_page', args=[pk])}
+    if stream:
+        context['comment_stream_url'] = reverse(
+            f'comments:{target}_comment_stream', args=[pk])
+    return context
+
+
+def load_targets(comments):
+    """
+    Загружает материалы списка комментариев: по одному запросу
+    на каждый вид материала, встречающийся в списке
+    (вместо запроса на каждый комментарий)
+    """
+    ids = {}
+    for comment in comments:
+        ids.setdefault(comment.target_type, set()).add(comment.target_id)
+    targets = {
+        target_type: COMMENT_TARGETS[target_type].objects.only(
+            'title').in_bulk(target_ids)
+        for target_type, target_ids in ids.items()}
+    for comment in comments:
+        comment._target = targets[comment.target_type].get(comment.target_id)
+    return comments
+
+
+def create_comment(form, user, target, pk):
+    """
+    Создаёт комментарий к материалу одним запросом INSERT:
+    автор, материал (по id, без загрузки из базы данных)
+    и дата заполняются до сохранения.
+    :arg
+    form -- валидная форма CommentForm
+    user -- экземпляр класса User
+    target -- вид материала ('lesson', 'theme' или 'test')
+    pk -- id материала
+    :return
+    экземпляр класса Comment
+    """
+    comment = form.save(commit=False)
+    comment.user = user
+    comment.target_type = target
+    comment.target_id = pk
+    comment.date = datetime.now(pytz.timezone(TIME_ZONE))
+    comment.save()
+    return comment
+
+
+def load_known_ids():
+    """
+    Возвращает множества id пользователей и материалов для проверки
+    импортируемых комментариев без запроса на каждую строку
+    """
+    known_ids = {'user': set(User.objects.values_list('pk', flat=True))}
+    for field, model in COMMENT_TARGETS.items():
+        known_ids[field] = set(model.objects.values_list('pk', flat=True))
+    return known_ids
+
+
+def parse_comment(line, known_ids):
+    """
+    Создаёт (не сохраняя) комментарий из строки JSON вида
+    {"text": "...", "user": 1, "lesson": 2, "date": "2023-09-01T10:00:00"}
+    (вместо "lesson" - "theme" или "test", "date" - необязательно,
+    дата без часового пояса считается датой в TIME_ZONE).
+    :return
+    экземпляр класса Comment или None, если строка неверна
+    либо пользователь или материал не существуют
+    """
+    try:
+        data = json.loads(line)
+        text = data['text']
+        user_id = data.get('user')
+        targets = [(field, data[field]) for field in COMMENT_TARGETS
+                   if data.get(field) is not None]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return None
+    if not isinstance(text, str) or not text or len(targets) != 1:
+        return None
+    field, target_id = targets[0]
+    if target_id not in known_ids[field] or (
+            user_id is not None and user_id not in known_ids['user']):
+        return None
+    date = None
+    if data.get('date'):
+        try:
+            date = parse_datetime(data['date'])
+        except (ValueError, TypeError):
+            return None
+        if date is None:
+            return None
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date, pytz.timezone(TIME_ZONE))
+    return Comment(text=text, user_id=user_id, date=date,
+                   target_type=field, target_id=target_id)
+
+
+def import_comments(lines, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Загружает комментарии из строк JSON (см. parse_comment)
+    пакетами через bulk_create, каждый пакет - в своей транзакции.
+    Сигналы при этом не отправляются, поэтому после загрузки
+    счётчики комментариев нужно пересчитать (materials.counters.recount).
+    :arg
+    lines -- итерируемый объект со строками JSON
+    batch_size -- количество комментариев в одном запросе INSERT
+    :return
+    imported -- количество загруженных комментариев
+    skipped -- количество пропущенных строк
+    """
+    known_ids = load_known_ids()
+    imported = skipped = 0
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        comment = parse_comment(line, known_ids)
+        if comment is None:
+            skipped += 1
+            continue
+        batch.append(comment)
+        if len(batch) >= batch_size:
+            imported += _save_batch(batch)
+            batch = []
+    if batch:
+        imported += _save_batch(batch)
+    return imported, skipped
+
+
+def _save_batch(batch):
+    with transaction.atomic():
+        Comment.objects.bulk_create(batch)
+    return len(batch)
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from comments.events import publish_comment
+from comments.models import Comment
+
+
+@receiver(post_save, sender=Comment)
+def publish_created_comment(sender, instance, created, **kwargs):
+    """
+    Отправляет новый комментарий в ленту материала
+    после фиксации транзакции
+    """
+    if created:
+        transaction.on_commit(lambda: publish_comment(instance))
@@ -0,0 +1,355 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from unittest import skipUnless, mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from comments import events as comment_events
+from comments.events import LocalBroker, publish_comment
+from comments.models import Comment
+from comments.search import search_comments
+from materials.models import Subject, Theme, Lesson, TestPaper
+from materials.query_budget import QueryRecorder
+from users.models import User
+
+
+class CommentSearchTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.client.force_login(user=self.user)
+        subject = Subject.objects.create(name='test_subject')
+        self.theme = Theme.objects.create(
+            title='Квадратные уравнения', subject=subject, owner=self.user)
+        self.lesson = Lesson.objects.create(
+            title='Дроби', theme=self.theme, owner=self.user)
+        self.first = Comment.objects.create(
+            text='Не понимаю, как решать уравнения', user=self.user,
+            target=self.lesson)
+        self.second = Comment.objects.create(
+            text='Спасибо за урок', user=self.user, target=self.theme)
+        Comment.objects.create(
+            text='Отличный урок', user=self.user, target=self.lesson)
+
+    def test_search_view(self):
+        response = self.client.get('/comments/my-comments/?search=урок')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context_data['object_list']), 2)
+
+        # названия материалов проверяются, только если по тексту
+        # ничего не найдено
+        response = self.client.get(
+            '/comments/my-comments/?search=Квадратные')
+        self.assertEqual(list(response.context_data['object_list']),
+                         [self.second])
+        response = self.client.get('/comments/my-comments/?search=Дроби')
+        self.assertEqual(len(response.context_data['object_list']), 2)
+
+    def test_search_pages(self):
+        # одинаковый текст - одинаковый ранг у всех комментариев
+        for number in range(45):
+            Comment.objects.create(
+                text='урок', user=self.user, target=self.lesson)
+        found, query = [], 'search=урок'
+        while query:
+            response = self.client.get(f'/comments/my-comments/?{query}')
+            found += response.context_data['object_list']
+            query = response.context_data.get('next_page_query')
+        self.assertEqual(len(found), 47)
+        self.assertEqual(len(set(found)), 47)
+
+    @skipUnless(connection.vendor == 'postgresql',
+                'полнотекстовый поиск доступен только в PostgreSQL')
+    def test_full_text_search(self):
+        # морфология: "уравнение" находит "уравнения" в тексте,
+        # название темы "Квадратные уравнения" не проверяется
+        found = search_comments(Comment.objects.all(), 'уравнение')
+        self.assertEqual(list(found), [self.first])
+        # опечатка в названии урока, если по тексту ничего не найдено
+        # (латиница: триграммы кириллицы зависят от локали базы данных)
+        lesson = Lesson.objects.create(
+            title='Programming basics', theme=self.theme, owner=self.user)
+        comment = Comment.objects.create(
+            text='Спасибо', user=self.user, target=lesson)
+        found = list(search_comments(Comment.objects.all(), 'Programing'))
+        self.assertEqual(found, [comment])
+        self.assertGreater(found[0].rank, 0)
+        ranked = search_comments(
+            Comment.objects.all(), 'урок').order_by('-rank')
+        self.assertTrue(all(comment.rank > 0 for comment in ranked))
+
+
+class CommentThreadTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True, last_name='Иванов')
+        self.client.force_login(user=self.user)
+        subject = Subject.objects.create(name='test_subject')
+        self.theme = Theme.objects.create(
+            title='test_theme', subject=subject, owner=self.user,
+            is_published=True)
+        self.lesson = Lesson.objects.create(
+            title='test_lesson', theme=self.theme, owner=self.user,
+            is_published=True)
+        now = timezone.now()
+        Comment.objects.bulk_create(
+            Comment(text=f'comment {number}', user=self.user,
+                    target=self.lesson, date=now + timedelta(minutes=number))
+            for number in range(25))
+
+    def test_thread_pages(self):
+        response = self.client.get(f'/lessons/{self.lesson.pk}')
+        comments = response.context_data['comments']
+        self.assertEqual(len(comments), 20)
+        self.assertEqual(comments[0].text, 'comment 24')
+        self.assertContains(response, 'Иванов')
+        cursor = response.context_data['next_comment_cursor']
+
+        response = self.client.get(
+            f'/comments/lesson/{self.lesson.pk}/page', {'cursor': cursor})
+        data = response.json()
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(data['html'].count('<hr>'), 5)
+        self.assertIn('comment 0', data['html'])
+        self.assertNotIn('comment 5', data['html'])
+
+    def test_thread_permissions(self):
+        other = User.objects.create(email='other@mail.ru', is_active=True)
+        self.client.force_login(user=other)
+        self.assertEqual(self.client.get(
+            f'/comments/lesson/{self.lesson.pk}/page').status_code, 200)
+        self.lesson.is_published = False
+        self.lesson.save()
+        self.assertEqual(self.client.get(
+            f'/comments/lesson/{self.lesson.pk}/page').status_code, 403)
+
+
+class CommentCreateTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.client.force_login(user=self.user)
+        subject = Subject.objects.create(name='test_subject')
+        self.theme = Theme.objects.create(
+            title='test_theme', subject=subject, owner=self.user,
+            is_published=True)
+        self.lesson = Lesson.objects.create(
+            title='test_lesson', theme=self.theme, owner=self.user,
+            is_published=True)
+        self.test = TestPaper.objects.create(
+            title='test_test', theme=self.theme, owner=self.user,
+            is_published=True)
+
+    def test_single_insert(self):
+        with QueryRecorder() as recorder:
+            response = self.client.post(
+                f'/comments/{self.theme.pk}', data={'text': 'Вопрос'})
+        self.assertRedirects(response, f'/comments/{self.theme.pk}')
+        writes = [sql for sql in recorder.fingerprints
+                  if 'comments_comment' in sql]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].startswith('INSERT'))
+        comment = Comment.objects.get()
+        self.assertEqual((comment.user, comment.target),
+                         (self.user, self.theme))
+        self.assertIsNotNone(comment.date)
+
+        response = self.client.post(
+            f'/lessons/{self.lesson.pk}', data={'text': 'Вопрос'})
+        self.assertEqual(response.status_code, 302)
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.comment_count, 1)
+
+    def test_import(self):
+        lines = [
+            {'text': 'первый', 'user': self.user.pk, 'lesson': self.lesson.pk,
+             'date': '2023-09-01T10:00:00'},
+            {'text': 'второй', 'test': self.test.pk},
+            {'text': 'два материала', 'lesson': self.lesson.pk,
+             'theme': self.theme.pk},
+            {'text': 'нет урока', 'lesson': 0},
+            {'text': 'нет пользователя', 'user': 0, 'theme': self.theme.pk},
+            {'text': 'неверная дата', 'theme': self.theme.pk,
+             'date': 'вчера'},
+        ]
+        with tempfile.NamedTemporaryFile(
+                'w', suffix='.jsonl', encoding='utf-8') as file:
+            file.write('\n'.join(json.dumps(line) for line in lines))
+            file.write('\nне json\n')
+            file.flush()
+            call_command('import_comments', file.name, '--batch-size=1',
+                         stdout=open(os.devnull, 'w'))
+        self.assertEqual(Comment.objects.count(), 2)
+        comment = Comment.objects.get(target_type='lesson')
+        self.assertEqual(comment.date.year, 2023)
+        self.lesson.refresh_from_db()
+        self.assertEqual(self.lesson.comment_count, 1)
+
+
+class CommentTargetTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.client.force_login(user=self.user)
+        subject = Subject.objects.create(name='test_subject')
+        self.theme = Theme.objects.create(
+            title='test_theme', subject=subject, owner=self.user,
+            is_published=True)
+        self.lesson = Lesson.objects.create(
+            title='test_lesson', theme=self.theme, owner=self.user,
+            is_published=True)
+        self.comment = Comment.objects.create(
+            text='comment', user=self.user, target=self.lesson)
+        Comment.objects.create(
+            text='comment', user=self.user, target=self.theme)
+
+    def test_target(self):
+        comment = Comment.objects.get(pk=self.comment.pk)
+        self.assertEqual((comment.target_type, comment.target_id),
+                         ('lesson', self.lesson.pk))
+        self.assertEqual(comment.target, self.lesson)
+        self.assertEqual(comment.get_target_url(),
+                         f'/lessons/{self.lesson.pk}')
+        with self.assertRaises(ValueError):
+            comment.target = self.user
+
+        response = self.client.get('/comments/my-comments/')
+        self.assertContains(response, 'Урок: "test_lesson"')
+        self.assertContains(response, 'Тема: "test_theme"')
+        response = self.client.get(
+            '/comments/my-comments/?lesson__title=lesson')
+        self.assertEqual(list(response.context_data['object_list']),
+                         [self.comment])
+
+    def test_target_deleted(self):
+        self.theme.delete()
+        self.assertFalse(Comment.objects.exists())
+
+    def test_unpublished_target(self):
+        other = User.objects.create(email='other@mail.ru', is_active=True)
+        self.client.force_login(user=other)
+        self.theme.is_published = False
+        self.theme.save()
+        response = self.client.post(
+            f'/comments/{self.theme.pk}', data={'text': 'Вопрос'})
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post('/comments/0', data={'text': 'Вопрос'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CommentStreamTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True, last_name='Иванов')
+        subject = Subject.objects.create(name='test_subject')
+        self.theme = Theme.objects.create(
+            title='test_theme', subject=subject, owner=self.user,
+            is_published=True)
+        self.lesson = Lesson.objects.create(
+            title='test_lesson', theme=self.theme, owner=self.user,
+            is_published=True)
+        self.first = Comment.objects.create(
+            text='первый', user=self.user, target=self.lesson)
+        self.second = Comment.objects.create(
+            text='второй', user=self.user, target=self.lesson)
+
+    def test_local_broker(self):
+        broker = LocalBroker()
+
+        async def receive():
+            async with broker.subscribe('channel') as queue:
+                # публикация из другого потока
+                thread = threading.Thread(
+                    target=broker.publish, args=('channel', {'id': 1}))
+                thread.start()
+                thread.join()
+                broker.publish('other', {'id': 2})
+                return await asyncio.wait_for(queue.get(), 1)
+
+        self.assertEqual(asyncio.run(receive()), {'id': 1})
+        self.assertEqual(broker._subscribers, {})
+
+    def test_publish_on_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            comment = Comment.objects.create(
+                text='новый', user=self.user, target=self.lesson)
+            comment.save()
+        self.assertEqual(len(callbacks), 1)
+
+    async def test_stream(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            f'/comments/lesson/{self.lesson.pk}/stream',
+            headers={'Last-Event-ID': str(self.first.pk)})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = aiter(response.streaming_content)
+        try:
+            self.assertTrue((await anext(events)).startswith(b'retry'))
+            # пропущенный комментарий досылается из базы данных
+            replayed = (await anext(events)).decode()
+            self.assertTrue(replayed.startswith(f'id: {self.second.pk}'))
+            self.assertIn('второй', replayed)
+
+            comment = Comment(pk=self.second.pk + 1, text='новый',
+                              user=self.user, target=self.lesson)
+            publish_comment(comment)
+            event = (await asyncio.wait_for(anext(events), 1)).decode()
+            self.assertIn('event: comment', event)
+            data = json.loads(event.split('data: ', 1)[1])
+            self.assertEqual(data['id'], comment.pk)
+            self.assertIn('Иванов', data['html'])
+        finally:
+            await events.aclose()
+
+    async def test_stream_close(self):
+        events = comment_events.comment_events('lesson', self.lesson.pk)
+        await anext(events)
+        channel = comment_events.comment_channel('lesson', self.lesson.pk)
+        self.assertIn(channel, comment_events.get_broker()._subscribers)
+        # закрытие ленты (GeneratorExit) отменяет подписку
+        await events.aclose()
+        self.assertNotIn(channel, comment_events.get_broker()._subscribers)
+
+    async def test_stream_lifetime(self):
+        with mock.patch.object(comment_events, 'STREAM_LIFETIME', 0.1):
+            chunks = [chunk async for chunk in comment_events.comment_events(
+                'lesson', self.lesson.pk)]
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith('retry'))
+        self.assertEqual(chunks[1], ': keepalive\n\n')
+        self.assertEqual(comment_events.get_broker()._subscribers, {})
+
+    def test_stream_under_wsgi(self):
+        # тестовый клиент Django работает как WSGI сервер
+        self.client.force_login(user=self.user)
+        response = self.client.get(
+            f'/comments/lesson/{self.lesson.pk}/stream')
+        self.assertEqual(response.status_code, 204)
+        response = self.client.get(f'/lessons/{self.lesson.pk}')
+        self.assertNotContains(response, 'EventSource')
+
+    async def test_stream_permissions(self):
+        url = f'/comments/lesson/{self.lesson.pk}/stream'
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 302)
+        other = await User.objects.acreate(
+            email='other@mail.ru', is_active=True)
+        await self.async_client.aforce_login(other)
+        self.lesson.is_published = False
+        await self.lesson.asave()
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 403)
+        response = await self.async_client.get('/comments/lesson/0/stream')
+        self.assertEqual(response.status_code, 404)
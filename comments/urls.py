@@ -2,13 +2,26 @@ from django.urls import path
 
 from comments.apps import CommentsConfig
 from comments.views import ThemeCommentView, MyCommentListView, \
-    CommentUpdateView, CommentDeleteView, TestCommentView
+    CommentUpdateView, CommentDeleteView, TestCommentView, comment_page, \
+    comment_stream
 
 app_name = CommentsConfig.name
 
 urlpatterns = [
     path('<int:pk>', ThemeCommentView.as_view(), name='theme_comments'),
     path('test/<int:pk>', TestCommentView.as_view(), name='test_comments'),
+    path('lesson/<int:pk>/page', comment_page, {'target': 'lesson'},
+         name='lesson_comment_page'),
+    path('theme/<int:pk>/page', comment_page, {'target': 'theme'},
+         name='theme_comment_page'),
+    path('test/<int:pk>/page', comment_page, {'target': 'test'},
+         name='test_comment_page'),
+    path('lesson/<int:pk>/stream', comment_stream, {'target': 'lesson'},
+         name='lesson_comment_stream'),
+    path('theme/<int:pk>/stream', comment_stream, {'target': 'theme'},
+         name='theme_comment_stream'),
+    path('test/<int:pk>/stream', comment_stream, {'target': 'test'},
+         name='test_comment_stream'),
     path('my-comments/', MyCommentListView.as_view(), name='my_comments'),
     path('update/<int:pk>', CommentUpdateView.as_view(),
          name='comments_update'),
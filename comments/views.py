@@ -1,84 +1,163 @@
-from datetime import datetime
-
-import pytz
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.http import JsonResponse, HttpResponseRedirect, Http404, \
+    StreamingHttpResponse, HttpResponse
+from django.shortcuts import get_object_or_404
+from django.template.loader import render_to_string
 from django.urls import reverse, reverse_lazy
 from django.views.generic import CreateView, UpdateView, ListView, DeleteView
 
+from comments.events import comment_events, comment_stream_available
 from comments.filters import CommentFilter
 from comments.forms import CommentForm
-from comments.models import Comment
-from config.settings import TIME_ZONE
+from comments.models import Comment, COMMENT_TARGETS
+from comments.services import get_comment_page, get_comment_thread, \
+    create_comment, load_targets
 from materials.models import Theme, TestPaper
+from materials.pagination import KeysetPaginationMixin
+from materials.permissions import ObjectPermissionMixin
+from materials.services import check_published
 
 
-class ThemeCommentView(LoginRequiredMixin, CreateView):
+class ThemeCommentView(LoginRequiredMixin, ObjectPermissionMixin,
+                       CreateView):
+    """
+    Комментарии к теме и форма для нового комментария
+    (тема загружается один раз - при проверке прав доступа)
+    """
     model = Comment
     form_class = CommentForm
     template_name = 'comments/comment_theme.html'
+    permission = 'view'
+
+    def get_permission_queryset(self):
+        return Theme.objects.all()
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['object_list'] = Comment.objects.filter(
-            theme=self.kwargs['pk'])
-        context['theme'] = Theme.objects.filter(pk=self.kwargs['pk']).first()
+        context.update(get_comment_thread(
+            Comment.THEME, self.kwargs['pk'], self.request.GET.get('cursor'),
+            stream=comment_stream_available(self.request)))
+        context['theme'] = self.get_permission_object()
         return context
 
     def form_valid(self, form):
-        if form.is_valid():
-            comment = form.save()
-            comment.user = self.request.user
-            comment.theme = Theme.objects.filter(pk=self.kwargs['pk']).first()
-            comment.date = datetime.now(pytz.timezone(TIME_ZONE))
-            comment.save()
-        return super().form_valid(form)
+        self.object = create_comment(
+            form, self.request.user, Comment.THEME, self.kwargs['pk'])
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse('comments:theme_comments', args=[self.kwargs.get('pk')])
 
 
-class TestCommentView(LoginRequiredMixin, CreateView):
+class TestCommentView(LoginRequiredMixin, ObjectPermissionMixin, CreateView):
+    """
+    Комментарии к тесту и форма для нового комментария
+    (тест загружается один раз - при проверке прав доступа)
+    """
     model = Comment
     form_class = CommentForm
     template_name = 'comments/comment_test.html'
+    permission = 'view'
+
+    def get_permission_queryset(self):
+        return TestPaper.objects.all()
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['object_list'] = Comment.objects.filter(test=self.kwargs['pk'])
-        context['test'] = TestPaper.objects.filter(
-            pk=self.kwargs['pk']).first()
+        context.update(get_comment_thread(
+            Comment.TEST, self.kwargs['pk'], self.request.GET.get('cursor'),
+            stream=comment_stream_available(self.request)))
+        context['test'] = self.get_permission_object()
         return context
 
     def form_valid(self, form):
-        if form.is_valid():
-            comment = form.save()
-            comment.user = self.request.user
-            comment.test = TestPaper.objects.filter(
-                pk=self.kwargs['pk']).first()
-            comment.date = datetime.now(pytz.timezone(TIME_ZONE))
-            comment.save()
-        return super().form_valid(form)
+        self.object = create_comment(
+            form, self.request.user, Comment.TEST, self.kwargs['pk'])
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse('comments:test_comments', args=[self.kwargs.get('pk')])
 
 
-class CommentUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+@login_required
+def comment_page(request, pk, target):
+    """
+    Возвращает следующую страницу комментариев к уроку/теме/тесту
+    в формате JSON: html фрагмент и курсор следующей страницы
+    """
+    model = COMMENT_TARGETS[target]
+    check_published(get_object_or_404(
+        model.objects.only('owner', 'is_published'), pk=pk), request.user)
+    comments, next_cursor = get_comment_page(
+        target, pk, request.GET.get('cursor'))
+    return JsonResponse({
+        'html': render_to_string(
+            'comments/comment_items.html', {'comments': comments}),
+        'next_cursor': next_cursor,
+    })
+
+
+async def comment_stream(request, pk, target):
+    """
+    Лента новых комментариев к уроку/теме/тесту в формате
+    server-sent events (text/event-stream). Соединение остаётся
+    открытым, поэтому представление асинхронное и не занимает поток
+    сервера: сайт должен работать через ASGI (config.asgi).
+    Под WSGI лента не открывается: ответ 204 браузер считает
+    сигналом больше не переподключаться.
+    После переподключения браузер передаёт заголовок Last-Event-ID,
+    и пропущенные комментарии досылаются из базы данных.
+    """
+    if not comment_stream_available(request):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    if not user.is_authenticated:
+        return redirect_to_login(request.get_full_path())
+    model = COMMENT_TARGETS[target]
+    obj = await model.objects.only('owner', 'is_published').filter(
+        pk=pk).afirst()
+    if obj is None:
+        raise Http404
+    check_published(obj, user)
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    response = StreamingHttpResponse(
+        comment_events(target, pk, int(last_event_id)
+                       if last_event_id.isdigit() else None),
+        content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+class CommentUpdateView(LoginRequiredMixin, ObjectPermissionMixin,
+                        UpdateView):
     model = Comment
     form_class = CommentForm
     success_url = reverse_lazy('comments:my_comments')
+    owner_attr = 'user_id'
 
-    def test_func(self):
-        is_owner = Comment.objects.filter(
-            pk=self.kwargs['pk']).last().user == self.request.user
-        return is_owner
 
-
-class MyCommentListView(LoginRequiredMixin, ListView):
+class MyCommentListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     model = Comment
+    keyset_field = 'date'
+    list_only = ('text', 'date', 'target_type', 'target_id')
+
+    def get_keyset_field(self):
+        # результаты полнотекстового поиска упорядочиваются по рангу
+        if self.request.GET.get('search'):
+            return 'rank'
+        return super().get_keyset_field()
+
+    def get_queryset(self):
+        qs = Comment.objects.filter(user=self.request.user)
+        return CommentFilter(self.request.GET, queryset=qs).qs
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
+        load_targets(context['object_list'])
         search_object = self.request.GET.get('query_object')
         if search_object == 'text':
             context['search_help'] = 'Поиск_по_тексту_комментария'
@@ -88,33 +167,27 @@ class MyCommentListView(LoginRequiredMixin, ListView):
             context['search_help'] = 'Поиск_по_названию_урока'
         elif search_object == 'test__title':
             context['search_help'] = 'Поиск_по_названию_теста'
+        elif search_object == 'search':
+            context['search_help'] = 'Поиск_по_тексту_и_названиям'
         else:
             context['search_help'] = 'Сначала_выберите_способ_поиска'
         context['search_object'] = search_object
-        qs = Comment.objects.filter(user=self.request.user)
-        filtered_comments = CommentFilter(self.request.GET, queryset=qs).qs
-        context['object_list'] = filtered_comments
         return context
 
 
-class CommentDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class CommentDeleteView(LoginRequiredMixin, ObjectPermissionMixin,
+                        DeleteView):
     model = Comment
     success_url = reverse_lazy('comments:my_comments')
     template_name = 'materials/confirm_delete.html'
-
-    def test_func(self):
-        is_owner = Comment.objects.filter(
-            pk=self.kwargs['pk']).last().user == self.request.user
-        return is_owner
+    owner_attr = 'user_id'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        if self.object.theme:
-            key_phrase = f'теме "{self.object.theme.title}"'
-        elif self.object.test:
-            key_phrase = f'тесту "{self.object.test.title}"'
-        else:
-            key_phrase = f'уроку "{self.object.lesson.title}"'
-        context['text'] = f'Хотите удалить ваш комментарий к {key_phrase}?'
+        comment = self.object
+        context['text'] = (
+            f'Хотите удалить ваш комментарий к '
+            f'{comment.TARGET_DATIVE[comment.target_type]} '
+            f'"{comment.target.title}"?')
         context['cancel_url'] = 'comments:my_comments'
         return context
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'django_filters',
     'corsheaders',
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'materials.query_budget.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -94,6 +96,28 @@ DATABASES = {
     }
 }
 
+# Общий для всех процессов кэш (снимок каталога, ключи ответов тестов,
+# пользователи и их права, использованные ссылки подтверждения почты).
+# По умолчанию - локальный кэш процесса: для нескольких процессов
+# сервера нужен общий кэш (например, Redis или Memcached), иначе
+# manage.py check --deploy выдаёт предупреждение users.W001.
+# Повторный переход по ссылке подтверждения почты отклоняется
+# без запроса к базе данных только с общим кэшем
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND') or
+        'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': os.getenv('CACHE_LOCATION') or '',
+    }
+}
+
+
+# Брокер событий ленты новых комментариев (comments.events).
+# По умолчанию - брокер внутри процесса, для нескольких процессов
+# сервера нужен общий брокер с тем же интерфейсом
+COMMENT_EVENTS_BACKEND = os.getenv('COMMENT_EVENTS_BACKEND') or \
+    'comments.events.LocalBroker'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -139,12 +163,19 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, "static")]
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Максимальный объём кэша текста .docx файлов уроков (в байтах)
+LESSON_TEXT_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Количество блоков (абзацев, списков, таблиц) на одной странице урока
+LESSON_PAGE_SIZE = 50
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
+# пользователь и его права берутся из кэша (CACHES)
+AUTHENTICATION_BACKENDS = ['users.backends.CachedModelBackend']
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = '/user/login-fail'
@@ -155,6 +186,10 @@ EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 EMAIL_USE_SSL = os.getenv('EMAIL_USE_SSL')
 
+# Количество повторов одного SQL запроса за запрос к сайту,
+# после которого в лог пишется предупреждение о проблеме N+1
+QUERY_N_PLUS_ONE_THRESHOLD = 10
+
 CORS_ALLOWED_ORIGINS = [
     'http://localhost:8000',
 ]
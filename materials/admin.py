@@ -1,7 +1,9 @@
 from django.contrib import admin
 
 from materials.models import Subject, Theme, Lesson, TestPaper, \
-    Question, Answer, Result
+    Question, Answer, Result, LessonRendition, ResultAnswer, \
+    CatalogueCounters, SearchDocument
+from materials.services import delete_results
 
 
 @admin.register(Subject)
@@ -27,6 +29,12 @@ class LessonAdmin(admin.ModelAdmin):
     search_fields = ('title',)
 
 
+@admin.register(LessonRendition)
+class LessonRenditionAdmin(admin.ModelAdmin):
+    """Регистрация модели LessonRendition в админке"""
+    list_display = ('id', 'lesson', 'source', 'converted_at',)
+
+
 @admin.register(TestPaper)
 class TestPaperAdmin(admin.ModelAdmin):
     """Регистрация модели TestPaper в админке"""
@@ -53,3 +61,30 @@ class AnswerAdmin(admin.ModelAdmin):
 class ResultAdmin(admin.ModelAdmin):
     """Регистрация модели Result в админке"""
     list_display = ('id', 'test', 'user',)
+
+    def delete_model(self, request, obj):
+        delete_results(Result.objects.filter(pk=obj.pk))
+
+    def delete_queryset(self, request, queryset):
+        delete_results(queryset)
+
+
+@admin.register(ResultAnswer)
+class ResultAnswerAdmin(admin.ModelAdmin):
+    """Регистрация модели ResultAnswer в админке"""
+    list_display = ('id', 'result', 'question', 'answer', 'is_correct',)
+    list_filter = ('is_correct',)
+
+
+@admin.register(CatalogueCounters)
+class CatalogueCountersAdmin(admin.ModelAdmin):
+    """Регистрация модели CatalogueCounters в админке"""
+    list_display = ('id', 'subjects', 'themes', 'lessons', 'tests',)
+
+
+@admin.register(SearchDocument)
+class SearchDocumentAdmin(admin.ModelAdmin):
+    """Регистрация модели SearchDocument в админке"""
+    list_display = ('id', 'kind', 'object_id', 'title', 'is_published',)
+    list_filter = ('kind', 'is_published',)
+    search_fields = ('title',)
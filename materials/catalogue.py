@@ -0,0 +1,143 @@
+import time
+
+from django.core.cache import cache
+
+from materials.models import Subject, Theme, Lesson, TestPaper
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+CATALOGUE_TIMEOUT = 60 * 60 * 24
+
+
+def _new_version():
+    # начальная версия зависит от времени, чтобы после потери ключа версии
+    # не был прочитан снимок, сохранённый под прежним номером
+    return time.time_ns()
+
+
+def get_catalogue_version():
+    """Возвращает текущую версию снимка каталога"""
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOGUE_VERSION_KEY, _new_version(), None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def bump_catalogue_version():
+    """Делает устаревшим сохранённый снимок каталога"""
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOGUE_VERSION_KEY, _new_version(), None)
+
+
+def build_catalogue():
+    """
+    Строит дерево каталога (предмет -> тема -> урок/тест)
+    четырьмя плоскими запросами к базе данных.
+    Узлы хранятся в словарях по id, у каждого узла-родителя
+    есть список id дочерних узлов в порядке создания.
+    В снимок попадают и неопубликованные материалы
+    (с признаком is_published), отбор выполняют представления.
+    Узлы тем содержат счётчики опубликованных уроков и тестов:
+    они изменяются вместе с материалами, при этом версия снимка
+    увеличивается.
+    :return
+    catalogue -- словарь с ключами 'subjects', 'themes', 'lessons', 'tests'
+    """
+    subjects = {subject['id']: {**subject, 'themes': []}
+                for subject in Subject.objects.order_by('pk').values(
+                    'id', 'name', 'description')}
+    themes = {}
+    for theme in Theme.objects.order_by('pk').values(
+            'id', 'title', 'description', 'is_published',
+            'owner_id', 'subject_id', 'lesson_count', 'test_count'):
+        themes[theme['id']] = {**theme, 'lessons': [], 'tests': []}
+        subjects[theme['subject_id']]['themes'].append(theme['id'])
+    children = {'lessons': Lesson, 'tests': TestPaper}
+    catalogue = {'subjects': subjects, 'themes': themes}
+    for key, model in children.items():
+        catalogue[key] = {}
+        for item in model.objects.order_by('pk').values(
+                'id', 'title', 'is_published', 'owner_id', 'theme_id'):
+            catalogue[key][item['id']] = item
+            themes[item['theme_id']][key].append(item['id'])
+    return catalogue
+
+
+def get_catalogue():
+    """
+    Возвращает снимок каталога из кэша, при необходимости
+    строя его заново. Версия снимка увеличивается при создании,
+    изменении (в т.ч. публикации) и удалении предметов, тем,
+    уроков и тестов.
+    """
+    cache_key = f'catalogue:tree:{get_catalogue_version()}'
+    catalogue = cache.get(cache_key)
+    if catalogue is None:
+        catalogue = build_catalogue()
+        cache.set(cache_key, catalogue, CATALOGUE_TIMEOUT)
+    return catalogue
+
+
+def get_catalogue_node(key, pk):
+    """
+    Возвращает снимок каталога и узел с указанным id.
+    Снимок здесь не сбрасывается: версию увеличивают только сигналы
+    изменения материалов, поэтому запросы несуществующих id
+    не заставляют строить каталог заново.
+    :arg
+    key -- вид узла ('subjects', 'themes', 'lessons', 'tests')
+    pk -- id узла
+    :return
+    catalogue -- снимок каталога
+    node -- словарь узла или None, если материала не существует
+    """
+    catalogue = get_catalogue()
+    return catalogue, catalogue[key].get(pk)
+
+
+def visible_children(catalogue, parent, key, user):
+    """
+    Возвращает дочерние узлы каталога, видимые пользователю
+    (только опубликованные - для обычного пользователя,
+    все - для персонала).
+    :arg
+    catalogue -- снимок каталога
+    parent -- узел предмета или темы
+    key -- вид дочерних узлов ('themes', 'lessons', 'tests')
+    user -- экземпляр класса User
+    :return
+    список словарей
+    """
+    nodes = (catalogue[key][pk] for pk in parent[key])
+    if user.is_staff:
+        return list(nodes)
+    return [node for node in nodes if node['is_published']]
+
+
+def catalogue_tree(user):
+    """
+    Возвращает вложенное дерево каталога, видимое пользователю,
+    для выдачи в формате JSON.
+    :arg
+    user -- экземпляр класса User
+    :return
+    список словарей предметов
+    """
+    catalogue = get_catalogue()
+    tree = []
+    for subject in catalogue['subjects'].values():
+        themes = []
+        for theme in visible_children(catalogue, subject, 'themes', user):
+            themes.append({
+                'id': theme['id'], 'title': theme['title'],
+                'is_published': theme['is_published'],
+                **{key: [{'id': node['id'], 'title': node['title'],
+                          'is_published': node['is_published']}
+                         for node in visible_children(
+                             catalogue, theme, key, user)]
+                   for key in ('lessons', 'tests')}})
+        tree.append({'id': subject['id'], 'name': subject['name'],
+                     'themes': themes})
+    return tree
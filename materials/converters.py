@@ -0,0 +1,168 @@
+from html import escape
+from zipfile import BadZipFile
+
+import docx
+from docx.opc.exceptions import OpcError
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from lxml.etree import XMLSyntaxError
+
+
+class ConversionError(Exception):
+    """Файл урока не является корректным .docx документом"""
+
+
+def _runs_to_html(paragraph):
+    """Переводит фрагменты абзаца в html с учётом жирного и курсива"""
+    parts = []
+    for run in paragraph.runs:
+        if not run.text:
+            continue
+        text = escape(run.text).replace('\n', '<br>')
+        if run.italic:
+            text = f'<em>{text}</em>'
+        if run.bold:
+            text = f'<strong>{text}</strong>'
+        parts.append(text)
+    return ''.join(parts)
+
+
+def _heading_level(paragraph):
+    """Возвращает уровень заголовка абзаца или None"""
+    style_name = paragraph.style.name if paragraph.style else ''
+    if style_name == 'Title':
+        return 1
+    if style_name.startswith('Heading '):
+        level = style_name.split(' ')[-1]
+        if level.isdigit():
+            return min(int(level), 6)
+    return None
+
+
+def _list_tag(paragraph):
+    """Возвращает тег списка ('ul'/'ol') для элемента списка или None"""
+    style_name = paragraph.style.name if paragraph.style else ''
+    p_pr = paragraph._p.pPr
+    if style_name.startswith('List Number'):
+        return 'ol'
+    if style_name.startswith('List') or (
+            p_pr is not None and p_pr.numPr is not None):
+        return 'ul'
+    return None
+
+
+def _table_to_html(table):
+    """Переводит таблицу документа в html и простой текст"""
+    html_rows = []
+    text_rows = []
+    for row in table.rows:
+        html_cells = []
+        text_cells = []
+        for cell in row.cells:
+            html_cells.append('<td>' + '<br>'.join(
+                _runs_to_html(paragraph)
+                for paragraph in cell.paragraphs) + '</td>')
+            text_cells.append(cell.text)
+        html_rows.append('<tr>' + ''.join(html_cells) + '</tr>')
+        text_rows.append('\t'.join(text_cells))
+    html = '<table class="table table-bordered">' + ''.join(
+        html_rows) + '</table>'
+    return html, '\n'.join(text_rows)
+
+
+def docx_to_blocks(path):
+    """
+    Разбирает .docx файл и переводит его в последовательность
+    html-блоков верхнего уровня (абзацы, заголовки, списки, таблицы).
+    :arg
+    path -- путь к .docx файлу
+    :return
+    blocks -- список html-строк, по одной на блок
+    text -- простой текст документа
+    """
+    document = docx.Document(path)
+    blocks = []
+    text = []
+    list_tag = None
+    list_items = []
+
+    def close_list():
+        if list_items:
+            blocks.append(f'<{list_tag}>' + ''.join(list_items) +
+                          f'</{list_tag}>')
+            list_items.clear()
+
+    for element in document.element.body.iterchildren():
+        if element.tag.endswith('}tbl'):
+            close_list()
+            list_tag = None
+            table_html, table_text = _table_to_html(
+                Table(element, document))
+            blocks.append(table_html)
+            text.append(table_text)
+            continue
+        if not element.tag.endswith('}p'):
+            continue
+        paragraph = Paragraph(element, document)
+        text.append(paragraph.text)
+        tag = _list_tag(paragraph)
+        if tag:
+            if tag != list_tag:
+                close_list()
+                list_tag = tag
+            list_items.append(f'<li>{_runs_to_html(paragraph)}</li>')
+            continue
+        close_list()
+        list_tag = None
+        content = _runs_to_html(paragraph)
+        if not content:
+            continue
+        level = _heading_level(paragraph)
+        if level:
+            blocks.append(f'<h{level}>{content}</h{level}>')
+        else:
+            blocks.append(f'<p class="lead">{content}</p>')
+    close_list()
+    return blocks, '\n'.join(text)
+
+
+def page_offsets(blocks, page_size):
+    """
+    Строит индекс страниц: смещения (в символах) начала каждой страницы
+    в html, собранном из блоков через перевод строки.
+    Последний элемент - длина всего html.
+    :arg
+    blocks -- список html-блоков
+    page_size -- количество блоков на странице
+    :return
+    offsets -- список смещений
+    """
+    offsets = []
+    position = 0
+    for number, block in enumerate(blocks):
+        if number % page_size == 0:
+            offsets.append(position)
+        position += len(block) + 1
+    offsets.append(max(position - 1, 0))
+    return offsets
+
+
+def convert_docx(path, page_size):
+    """
+    Переводит .docx файл в html и простой текст
+    и строит индекс страниц для постраничного показа.
+    :arg
+    path -- путь к .docx файлу
+    page_size -- количество блоков на странице
+    :return
+    словарь с ключами 'html', 'text' и 'page_offsets'
+    :raise
+    ConversionError -- файл не удалось прочитать
+    """
+    try:
+        blocks, text = docx_to_blocks(path)
+    except (OpcError, BadZipFile, KeyError, ValueError,
+            XMLSyntaxError) as error:
+        raise ConversionError(f'{type(error).__name__}: {error}') from error
+    return {'html': '\n'.join(blocks), 'text': text,
+            'page_offsets': page_offsets(blocks, page_size)}
@@ -0,0 +1,158 @@
+from django.db import transaction
+from django.db.models import F, Count, Subquery, OuterRef
+from django.db.models.functions import Coalesce
+
+from comments.models import Comment, COMMENT_TARGETS
+from materials.catalogue import bump_catalogue_version
+from materials.models import Subject, Theme, Lesson, TestPaper
+
+# поля, от которых зависит учёт объекта в счётчиках
+COUNTED_FIELDS = {
+    Theme: ('subject', 'is_published'),
+    Lesson: ('theme', 'is_published'),
+    TestPaper: ('theme', 'is_published'),
+    Comment: ('target_type', 'target_id'),
+}
+# счётчики темы и предмета для опубликованных уроков и тестов
+MATERIAL_COUNTERS = {Lesson: 'lesson_count', TestPaper: 'test_count'}
+
+
+def _add(queryset, delta, **fields):
+    """
+    Изменяет счётчики выбранных записей одним запросом UPDATE.
+    :arg
+    queryset -- выборка записей
+    delta -- 1 или -1
+    fields -- {счётчик: величина изменения (число или выражение)}
+    """
+    queryset.update(**{field: F(field) + value * delta
+                       for field, value in fields.items()})
+
+
+def counted_state(instance):
+    """
+    Возвращает часть состояния объекта, от которой зависят счётчики:
+    тема - id предмета, если тема опубликована,
+    урок/тест - id темы, если материал опубликован,
+    комментарий - (вид материала, id материала).
+    None - объект не учитывается в счётчиках.
+    """
+    if isinstance(instance, Comment):
+        return instance.target_type, instance.target_id
+    parent_id = instance.subject_id if isinstance(instance, Theme) \
+        else instance.theme_id
+    return parent_id if instance.is_published else None
+
+
+def load_counted_state(model, pk):
+    """
+    Состояние counted_state() объекта, сохранённого в базе данных.
+    Строка блокируется до конца транзакции сохранения (см.
+    CounterFieldsMixin.save и Comment.save), поэтому одновременное
+    сохранение того же объекта не учтёт один переход дважды.
+    """
+    instance = model.objects.select_for_update().filter(
+        pk=pk).only(*COUNTED_FIELDS[model]).first()
+    return counted_state(instance) if instance else None
+
+
+def change_material_count(model, theme_id, delta):
+    """
+    Учитывает (delta=1) или исключает (delta=-1) опубликованный урок/тест
+    в счётчиках темы и, если тема опубликована, её предмета
+    """
+    field = MATERIAL_COUNTERS[model]
+    _add(Theme.objects.filter(pk=theme_id), delta, **{field: 1})
+    _add(Subject.objects.filter(theme__pk=theme_id, theme__is_published=True),
+         delta, **{field: 1})
+
+
+def change_theme_count(theme_id, subject_id, delta, with_materials=True):
+    """
+    Учитывает или исключает опубликованную тему в счётчиках предмета.
+    with_materials -- вместе с темой перенести опубликованные уроки
+    и тесты темы (при удалении темы они исключаются сигналами
+    удаления самих уроков и тестов)
+    """
+    fields = {'theme_count': 1}
+    if with_materials:
+        theme = Theme.objects.filter(pk=theme_id)
+        fields['lesson_count'] = Subquery(theme.values('lesson_count'))
+        fields['test_count'] = Subquery(theme.values('test_count'))
+    _add(Subject.objects.filter(pk=subject_id), delta, **fields)
+
+
+def change_comment_count(target, delta):
+    """
+    Изменяет счётчик комментариев материала.
+    :arg
+    target -- (вид материала, id материала) из counted_state()
+    """
+    target_type, pk = target
+    _add(COMMENT_TARGETS[target_type].objects.filter(pk=pk), delta,
+         comment_count=1)
+
+
+def move_counted(instance, old, new, deleted=False):
+    """
+    Изменяет счётчики при переходе объекта из состояния old
+    в состояние new (см. counted_state(), None - объект не учитывается)
+    """
+    if old == new:
+        return
+    for state, delta in ((old, -1), (new, 1)):
+        if state is None:
+            continue
+        if isinstance(instance, Comment):
+            change_comment_count(state, delta)
+        elif isinstance(instance, Theme):
+            change_theme_count(instance.pk, state, delta,
+                               with_materials=not deleted)
+        else:
+            change_material_count(type(instance), state, delta)
+
+
+def _count_of(model, field, **condition):
+    """
+    Подзапрос с количеством записей model, ссылающихся
+    через field на обновляемую запись
+    """
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}, **condition)
+        .order_by().values(field).annotate(count=Count('pk'))
+        .values('count')), 0)
+
+
+def recount():
+    """
+    Пересчитывает все счётчики по данным таблиц (после загрузки данных
+    в обход сигналов или для проверки). Каждая таблица обновляется
+    одним запросом.
+    :return
+    словарь {модель: количество обновлённых записей}
+    """
+    with transaction.atomic():
+        updated = {
+            Subject: Subject.objects.update(
+                theme_count=_count_of(Theme, 'subject', is_published=True),
+                lesson_count=_count_of(
+                    Lesson, 'theme__subject', is_published=True,
+                    theme__is_published=True),
+                test_count=_count_of(
+                    TestPaper, 'theme__subject', is_published=True,
+                    theme__is_published=True)),
+            Theme: Theme.objects.update(
+                lesson_count=_count_of(Lesson, 'theme', is_published=True),
+                test_count=_count_of(TestPaper, 'theme', is_published=True),
+                comment_count=_count_of(
+                    Comment, 'target_id', target_type=Comment.THEME)),
+            Lesson: Lesson.objects.update(
+                comment_count=_count_of(
+                    Comment, 'target_id', target_type=Comment.LESSON)),
+            TestPaper: TestPaper.objects.update(
+                comment_count=_count_of(
+                    Comment, 'target_id', target_type=Comment.TEST)),
+        }
+    # счётчики тем входят в снимок каталога
+    bump_catalogue_version()
+    return updated
@@ -0,0 +1,94 @@
+import os
+import threading
+from collections import OrderedDict
+
+import docx
+from django.core.files.storage import default_storage
+
+from config import settings
+
+
+class DocxTextCache:
+    """
+    Ограниченный по объёму LRU-кэш текста, извлечённого из .docx файлов уроков.
+    Ключ записи - (путь к файлу, размер, время изменения), поэтому
+    перезаписанный на диске файл не отдаётся из кэша в устаревшем виде.
+    При превышении max_bytes вытесняются давно не запрашивавшиеся записи.
+    Счётчики hits/misses позволяют подобрать размер кэша.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_paragraphs(self, path):
+        """
+        Возвращает список абзацев документа, при необходимости
+        разбирая файл и помещая результат в кэш.
+        :arg
+        path -- абсолютный путь к .docx файлу
+        :return
+        paragraphs -- список строк (текст абзацев)
+        """
+        stat = os.stat(path)
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        paragraphs = [paragraph.text
+                      for paragraph in docx.Document(path).paragraphs]
+        size = sum(len(text.encode()) for text in paragraphs)
+
+        with self._lock:
+            self._discard(path)
+            if size <= self.max_bytes:
+                self._entries[key] = (paragraphs, size)
+                self.total_bytes += size
+                while self.total_bytes > self.max_bytes:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.total_bytes -= evicted
+        return paragraphs
+
+    def invalidate(self, path):
+        """Удаляет из кэша все записи для указанного файла"""
+        with self._lock:
+            self._discard(path)
+
+    def clear(self):
+        """Полностью очищает кэш и обнуляет счётчики"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Возвращает текущее состояние кэша в виде словаря"""
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'entries': len(self._entries),
+                    'bytes': self.total_bytes,
+                    'max_bytes': self.max_bytes}
+
+    def _discard(self, path):
+        for key in [key for key in self._entries if key[0] == path]:
+            _, size = self._entries.pop(key)
+            self.total_bytes -= size
+
+
+lesson_text_cache = DocxTextCache(settings.LESSON_TEXT_CACHE_MAX_BYTES)
+
+
+def lesson_file_path(file):
+    """Возвращает абсолютный путь к файлу урока в MEDIA_ROOT"""
+    return default_storage.path(str(file))
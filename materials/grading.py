@@ -0,0 +1,116 @@
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+
+from materials.models import Answer
+
+ANSWER_KEY_TIMEOUT = 60 * 60 * 24
+
+
+class AnswerKey:
+    """
+    Скомпилированный ключ ответов теста.
+    Хранит отсортированные id ответов и параллельные им массивы
+    с id вопроса и признаком верного ответа, что позволяет проверять
+    ответы пользователя без обращения к базе данных.
+    """
+
+    def __init__(self, rows):
+        """
+        :arg
+        rows -- последовательность кортежей (id ответа, id вопроса, верный)
+        """
+        rows = sorted(rows)
+        self.answer_ids = array('q', (row[0] for row in rows))
+        self.question_ids = array('q', (row[1] for row in rows))
+        self.is_correct = bytes(bool(row[2]) for row in rows)
+        self.correct_total = sum(self.is_correct)
+
+    def __len__(self):
+        return len(self.answer_ids)
+
+    def index(self, answer_id):
+        """Возвращает позицию ответа в ключе или None"""
+        position = bisect_left(self.answer_ids, answer_id)
+        if position < len(self.answer_ids) \
+                and self.answer_ids[position] == answer_id:
+            return position
+        return None
+
+    def responses(self, answer_ids):
+        """
+        Сопоставляет выбранные ответы с ключом.
+        Повторы и ответы, не относящиеся к тесту, отбрасываются.
+        :arg
+        answer_ids -- id выбранных пользователем ответов
+        :return
+        список кортежей (id ответа, id вопроса, верный)
+        """
+        responses = []
+        for answer_id in sorted(set(answer_ids)):
+            position = self.index(answer_id)
+            if position is not None:
+                responses.append((answer_id, self.question_ids[position],
+                                  bool(self.is_correct[position])))
+        return responses
+
+    def grade(self, answer_ids):
+        """
+        Проверяет ответы пользователя.
+        Ответы, не относящиеся к тесту, игнорируются.
+        :arg
+        answer_ids -- id выбранных пользователем ответов
+        :return
+        percentage -- процент верных ответов
+            (кол-во выбранных верных ответов х 100 /
+            общее кол-во верных ответов в тесте)
+        """
+        if not self.correct_total:
+            return 0
+        user_correct_answers = sum(
+            is_correct for _, _, is_correct in self.responses(answer_ids))
+        return user_correct_answers * 100 / self.correct_total
+
+
+def compile_answer_key(test_id):
+    """Строит ключ ответов теста одним запросом к базе данных"""
+    return AnswerKey(Answer.objects.filter(
+        question__test_id=test_id
+    ).values_list('id', 'question_id', 'is_correct'))
+
+
+def get_answer_key(test):
+    """
+    Возвращает ключ ответов теста из кэша.
+    Ключ кэша включает версию теста, которая увеличивается
+    при любом изменении вопросов и ответов теста.
+    :arg
+    test -- экземпляр класса TestPaper
+    :return
+    экземпляр класса AnswerKey
+    """
+    cache_key = f'answer_key:{test.pk}:{test.key_version}'
+    answer_key = cache.get(cache_key)
+    if answer_key is None:
+        answer_key = compile_answer_key(test.pk)
+        cache.set(cache_key, answer_key, ANSWER_KEY_TIMEOUT)
+    return answer_key
+
+
+def parse_answer_ids(values):
+    """
+    Переводит id ответов из запроса в целые числа,
+    пропуская некорректные значения.
+    :arg
+    values -- список строк
+    :return
+    список id ответов
+    """
+    answer_ids = []
+    for value in values:
+        try:
+            answer_ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return answer_ids
@@ -0,0 +1,185 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from comments.models import Comment
+from materials.models import Subject, Theme, Lesson, TestPaper, Result
+from users.models import User
+
+# индексы, добавленные для основных выборок сайта
+BENCHMARK_INDEXES = (
+    'theme_published_subject_idx',
+    'lesson_published_theme_idx',
+    'test_published_theme_idx',
+    'comment_target_date_idx',
+    'result_user_date_idx',
+)
+
+
+class Rollback(Exception):
+    """Отменяет транзакцию с тестовыми данными"""
+
+
+class Command(BaseCommand):
+    """
+    Заполняет базу данных тестовыми данными и сравнивает планы
+    и время выполнения основных запросов сайта без индексов
+    (до) и с индексами (после). Все изменения, включая удаление
+    индексов, выполняются в одной транзакции и отменяются по завершении.
+    """
+    help = 'Сравнивает выполнение основных запросов без индексов и с ними'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale', type=int, default=1,
+            help='множитель объёма тестовых данных')
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='количество повторов каждого запроса')
+        parser.add_argument(
+            '--plans', action='store_true',
+            help='выводить планы выполнения запросов')
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                sample = self.seed(options['scale'])
+                try:
+                    with transaction.atomic():
+                        self.drop_indexes()
+                        self.analyze()
+                        before = self.run_cases(sample, options)
+                        raise Rollback
+                except Rollback:
+                    pass
+                self.analyze()
+                after = self.run_cases(sample, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+        self.stdout.write(f'{"запрос":<20}{"до, мс":>12}{"после, мс":>12}')
+        for name in after:
+            self.stdout.write(
+                f'{name:<20}{before[name]["time"]:>12.3f}'
+                f'{after[name]["time"]:>12.3f}')
+            if options['plans']:
+                self.stdout.write(f'-- до:\n{before[name]["plan"]}')
+                self.stdout.write(f'-- после:\n{after[name]["plan"]}')
+        self.stdout.write(self.style.SUCCESS(
+            'Тестовые данные удалены, индексы сохранены'))
+
+    def seed(self, scale):
+        """
+        Создаёт тестовые данные.
+        :return
+        sample -- словарь объектов, по которым выполняются запросы
+        """
+        now = timezone.now()
+        users = User.objects.bulk_create(
+            User(email=f'benchmark_{number}@example.com',
+                 verified_password=f'benchmark_{number}')
+            for number in range(200 * scale))
+        subjects = Subject.objects.bulk_create(
+            Subject(name=f'benchmark_{number}')
+            for number in range(10 * scale))
+        themes = Theme.objects.bulk_create(
+            (Theme(title=f'theme {number}', subject=subject,
+                   owner=random.choice(users),
+                   is_published=random.random() < 0.8)
+             for subject in subjects for number in range(20)),
+            batch_size=1000)
+        lessons = Lesson.objects.bulk_create(
+            (Lesson(title=f'lesson {number}', theme=theme,
+                    owner=random.choice(users),
+                    is_published=random.random() < 0.8)
+             for theme in themes for number in range(10)),
+            batch_size=1000)
+        tests = TestPaper.objects.bulk_create(
+            (TestPaper(title=f'test {number}', theme=theme,
+                       owner=random.choice(users),
+                       is_published=random.random() < 0.8)
+             for theme in themes for number in range(5)),
+            batch_size=1000)
+        targets = [lessons, themes, tests]
+        Comment.objects.bulk_create(
+            (Comment(text='benchmark', user=random.choice(users),
+                     date=now - timedelta(minutes=number),
+                     target=random.choice(random.choice(targets)))
+             for number in range(50000 * scale)),
+            batch_size=1000)
+        Result.objects.bulk_create(
+            (Result(test=random.choice(tests), user=random.choice(users),
+                    percentage=random.randint(0, 100),
+                    date=now - timedelta(minutes=number))
+             for number in range(50000 * scale)),
+            batch_size=1000)
+        return {'user': users[0], 'subject': subjects[0],
+                'theme': themes[0], 'lesson': lessons[0], 'test': tests[0]}
+
+    def get_cases(self, sample):
+        """Запросы представлений сайта: {название: queryset}"""
+        return {
+            'subject_detail': Theme.objects.filter(
+                subject=sample['subject'], is_published=True),
+            'theme_detail': Lesson.objects.filter(
+                theme=sample['theme'], is_published=True),
+            'test_list': TestPaper.objects.filter(
+                theme=sample['theme'], is_published=True),
+            'lesson_comments': Comment.objects.filter(
+                target_type='lesson', target_id=sample['lesson'].pk).order_by(
+                '-date', '-id')[:20],
+            'theme_comments': Comment.objects.filter(
+                target_type='theme', target_id=sample['theme'].pk).order_by(
+                '-date', '-id')[:20],
+            'test_comments': Comment.objects.filter(
+                target_type='test', target_id=sample['test'].pk).order_by(
+                '-date', '-id')[:20],
+            'my_results': Result.objects.filter(
+                user=sample['user']).order_by('-date', '-id')[:20],
+            'test_results': Result.objects.filter(test=sample['test']),
+            'my_lessons': Lesson.objects.filter(owner=sample['user']),
+            'verify': User.objects.filter(
+                verified_password=sample['user'].verified_password),
+        }
+
+    def run_cases(self, sample, options):
+        """Возвращает медианное время (мс) и план каждого запроса"""
+        report = {}
+        for name, queryset in self.get_cases(sample).items():
+            timings = []
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - start) * 1000)
+            report[name] = {'time': statistics.median(timings),
+                            'plan': queryset.explain()}
+        return report
+
+    def drop_indexes(self):
+        """
+        Удаляет проверяемые индексы и индекс поля
+        User.verified_password (внутри транзакции)
+        """
+        names = set(BENCHMARK_INDEXES)
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, User._meta.db_table)
+            names.update(
+                name for name, constraint in constraints.items()
+                if constraint['index'] and not constraint['unique']
+                and constraint['columns'] == ['verified_password'])
+            for name in names:
+                cursor.execute(
+                    f'DROP INDEX {connection.ops.quote_name(name)}')
+
+    def analyze(self):
+        """Обновляет статистику планировщика"""
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management import BaseCommand
+from django.db import connections
+
+from config.settings import LESSON_PAGE_SIZE
+from materials.converters import convert_docx
+from materials.docx_cache import lesson_file_path
+from materials.models import Lesson
+from materials.services import save_rendition
+
+
+class Command(BaseCommand):
+    """
+    Подготавливает html и текстовые представления для уже загруженных
+    файлов уроков. Разбор файлов выполняется параллельно в пуле процессов,
+    сохранение результатов - в основном процессе.
+    """
+    help = 'Конвертирует файлы уроков из media/lessons/ в html и текст'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='количество процессов для конвертации')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='конвертировать заново уже подготовленные файлы')
+
+    def handle(self, *args, **options):
+        lessons = Lesson.objects.exclude(file='').exclude(
+            file__isnull=True).select_related('rendition')
+        pending = {}
+        for lesson in lessons:
+            rendition = getattr(lesson, 'rendition', None)
+            if (not options['force'] and rendition
+                    and rendition.source == lesson.file.name):
+                continue
+            path = lesson_file_path(lesson.file)
+            if not os.path.exists(path):
+                self.stderr.write(f'Файл урока {lesson.pk} не найден: {path}')
+                continue
+            pending[path] = lesson
+
+        if not pending:
+            self.stdout.write('Нет файлов для конвертации')
+            return
+
+        connections.close_all()
+        converted = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {pool.submit(convert_docx, path, LESSON_PAGE_SIZE): path
+                       for path in pending}
+            for future in as_completed(futures):
+                lesson = pending[futures[future]]
+                try:
+                    save_rendition(lesson, future.result())
+                except Exception as error:
+                    self.stderr.write(
+                        f'Не удалось конвертировать урок {lesson.pk}: {error}')
+                    continue
+                converted += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Конвертировано файлов: {converted} из {len(pending)}'))
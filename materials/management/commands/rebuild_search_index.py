@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from materials.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    """
+    Перестраивает поисковый индекс по всем материалам сайта.
+    Индекс обновляется при сохранении материалов, команда нужна
+    для первоначального заполнения и исправления расхождений.
+    """
+    help = 'Перестраивает поисковый индекс материалов'
+
+    def handle(self, *args, **options):
+        count = rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в поисковом индексе: {count}'))
@@ -0,0 +1,16 @@
+from django.core.management import BaseCommand
+
+from materials.services import rebuild_test_aggregates
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает накопленную статистику тестов (TestAggregate)
+    по таблице результатов для исправления расхождений.
+    """
+    help = 'Пересчитывает статистику результатов тестов'
+
+    def handle(self, *args, **options):
+        count = rebuild_test_aggregates()
+        self.stdout.write(self.style.SUCCESS(
+            f'Статистика пересчитана для тестов: {count}'))
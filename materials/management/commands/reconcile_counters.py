@@ -0,0 +1,18 @@
+from django.core.management import BaseCommand
+
+from materials.services import reconcile_catalogue_counters
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает счётчики каталога для домашней страницы
+    по данным таблиц. Предназначена для периодического запуска
+    (например, по cron) для исправления расхождений.
+    """
+    help = 'Пересчитывает счётчики каталога'
+
+    def handle(self, *args, **options):
+        counters = reconcile_catalogue_counters()
+        self.stdout.write(self.style.SUCCESS(
+            f'Предметов: {counters.subjects}, тем: {counters.themes}, '
+            f'уроков: {counters.lessons}, тестов: {counters.tests}'))
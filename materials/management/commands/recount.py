@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from materials.counters import recount
+
+
+class Command(BaseCommand):
+    """
+    Пересчитывает счётчики тем, уроков, тестов и комментариев
+    у предметов, тем, уроков и тестов по данным таблиц.
+    Предназначена для запуска после загрузки данных в обход
+    сигналов и для периодического исправления расхождений.
+    """
+    help = 'Пересчитывает счётчики материалов и комментариев'
+
+    def handle(self, *args, **options):
+        updated = recount()
+        self.stdout.write(self.style.SUCCESS(', '.join(
+            f'{model._meta.verbose_name_plural}: {count}'
+            for model, count in updated.items())))
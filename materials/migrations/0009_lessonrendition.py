@@ -0,0 +1,29 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0008_question_answer_testpaper_result_question_test'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LessonRendition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=100, verbose_name='исходный файл')),
+                ('html', models.TextField(verbose_name='html представление')),
+                ('text', models.TextField(verbose_name='текстовое представление')),
+                ('converted_at', models.DateTimeField(auto_now=True, verbose_name='дата и время конвертации')),
+                ('lesson', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='rendition', to='materials.lesson', verbose_name='урок')),
+            ],
+            options={
+                'verbose_name': 'представление урока',
+                'verbose_name_plural': 'представления уроков',
+            },
+        ),
+    ]
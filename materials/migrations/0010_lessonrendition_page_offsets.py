@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0009_lessonrendition'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lessonrendition',
+            name='page_offsets',
+            field=models.JSONField(default=list, verbose_name='смещения страниц в html'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0010_lessonrendition_page_offsets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testpaper',
+            name='key_version',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='версия ключа ответов'),
+        ),
+    ]
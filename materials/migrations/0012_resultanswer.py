@@ -0,0 +1,28 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0011_testpaper_key_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultAnswer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('is_correct', models.BooleanField(verbose_name='верный')),
+                ('answer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='materials.answer', verbose_name='ответ')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='materials.question', verbose_name='вопрос')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='materials.result', verbose_name='результат')),
+            ],
+            options={
+                'verbose_name': 'ответ пользователя',
+                'verbose_name_plural': 'ответы пользователей',
+            },
+        ),
+    ]
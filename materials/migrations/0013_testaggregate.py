@@ -0,0 +1,38 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0012_resultanswer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestAggregate',
+            fields=[
+                ('test', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='aggregate', serialize=False, to='materials.testpaper', verbose_name='тест')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='количество попыток')),
+                ('score_sum', models.BigIntegerField(default=0, verbose_name='сумма результатов')),
+                ('score_sq_sum', models.BigIntegerField(default=0, verbose_name='сумма квадратов результатов')),
+                ('best_score', models.PositiveIntegerField(default=0, verbose_name='лучший результат')),
+                ('bucket_0', models.PositiveIntegerField(default=0)),
+                ('bucket_1', models.PositiveIntegerField(default=0)),
+                ('bucket_2', models.PositiveIntegerField(default=0)),
+                ('bucket_3', models.PositiveIntegerField(default=0)),
+                ('bucket_4', models.PositiveIntegerField(default=0)),
+                ('bucket_5', models.PositiveIntegerField(default=0)),
+                ('bucket_6', models.PositiveIntegerField(default=0)),
+                ('bucket_7', models.PositiveIntegerField(default=0)),
+                ('bucket_8', models.PositiveIntegerField(default=0)),
+                ('bucket_9', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'статистика теста',
+                'verbose_name_plural': 'статистика тестов',
+            },
+        ),
+    ]
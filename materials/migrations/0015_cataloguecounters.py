@@ -0,0 +1,40 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+def fill_counters(apps, schema_editor):
+    models_by_field = {'subjects': 'Subject', 'themes': 'Theme',
+                       'lessons': 'Lesson', 'tests': 'TestPaper'}
+    counts = {field: apps.get_model('materials', model).objects.count()
+              for field, model in models_by_field.items()}
+    top_subjects = list(apps.get_model('materials', 'Subject').objects.order_by(
+        'pk').values_list('name', flat=True)[:5])
+    apps.get_model('materials', 'CatalogueCounters').objects.update_or_create(
+        pk=1, defaults={**counts, 'top_subjects': top_subjects})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0014_result_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueCounters',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subjects', models.IntegerField(default=0, verbose_name='количество предметов')),
+                ('themes', models.IntegerField(default=0, verbose_name='количество тем')),
+                ('lessons', models.IntegerField(default=0, verbose_name='количество уроков')),
+                ('tests', models.IntegerField(default=0, verbose_name='количество тестов')),
+                ('top_subjects', models.JSONField(default=list, verbose_name='названия первых предметов')),
+            ],
+            options={
+                'verbose_name': 'счётчики каталога',
+                'verbose_name_plural': 'счётчики каталога',
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
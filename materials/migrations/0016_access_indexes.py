@@ -0,0 +1,27 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0015_cataloguecounters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['theme'], name='lesson_published_theme_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='testpaper',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['theme'], name='test_published_theme_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='theme',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['subject'], name='theme_published_subject_idx'),
+        ),
+    ]
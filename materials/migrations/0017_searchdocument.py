@@ -0,0 +1,63 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+SEARCH_SQL = [
+    'ALTER TABLE materials_searchdocument ADD COLUMN search_vector tsvector '
+    'GENERATED ALWAYS AS ('
+    "setweight(to_tsvector('russian', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce(body, '')), 'B')) STORED",
+    'CREATE INDEX search_document_vector_idx '
+    'ON materials_searchdocument USING GIN (search_vector)',
+]
+
+REVERSE_SQL = [
+    'ALTER TABLE materials_searchdocument '
+    'DROP COLUMN IF EXISTS search_vector',
+]
+
+
+def run_postgres_sql(statements):
+    """Выполняет SQL только в PostgreSQL (в других СУБД поиск
+    выполняется без полнотекстового индекса)"""
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0016_access_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('subject', 'предмет'), ('theme', 'тема'), ('lesson', 'урок'), ('test', 'тест')], max_length=10, verbose_name='вид материала')),
+                ('object_id', models.PositiveIntegerField(verbose_name='id материала')),
+                ('title', models.CharField(max_length=250, verbose_name='название')),
+                ('body', models.TextField(blank=True, verbose_name='текст')),
+                ('is_published', models.BooleanField(default=False, verbose_name='признак публикации')),
+                ('owner', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='владелец')),
+            ],
+            options={
+                'verbose_name': 'запись поискового индекса',
+                'verbose_name_plural': 'поисковый индекс',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='searchdocument',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='search_document_object_unique'),
+        ),
+        migrations.RunPython(run_postgres_sql(SEARCH_SQL),
+                             run_postgres_sql(REVERSE_SQL)),
+    ]
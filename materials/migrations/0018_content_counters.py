@@ -0,0 +1,83 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field, **condition):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}, **condition)
+        .order_by().values(field).annotate(count=Count('pk'))
+        .values('count')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Subject = apps.get_model('materials', 'Subject')
+    Theme = apps.get_model('materials', 'Theme')
+    Lesson = apps.get_model('materials', 'Lesson')
+    TestPaper = apps.get_model('materials', 'TestPaper')
+    Comment = apps.get_model('comments', 'Comment')
+    published = {'is_published': True, 'theme__is_published': True}
+    Subject.objects.update(
+        theme_count=count_of(Theme, 'subject', is_published=True),
+        lesson_count=count_of(Lesson, 'theme__subject', **published),
+        test_count=count_of(TestPaper, 'theme__subject', **published))
+    Theme.objects.update(
+        lesson_count=count_of(Lesson, 'theme', is_published=True),
+        test_count=count_of(TestPaper, 'theme', is_published=True),
+        comment_count=count_of(Comment, 'theme'))
+    Lesson.objects.update(comment_count=count_of(Comment, 'lesson'))
+    TestPaper.objects.update(comment_count=count_of(Comment, 'test'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('materials', '0017_searchdocument'),
+        ('comments', '0004_comment_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество комментариев'),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='lesson_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество уроков'),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='test_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество тестов'),
+        ),
+        migrations.AddField(
+            model_name='subject',
+            name='theme_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество тем'),
+        ),
+        migrations.AddField(
+            model_name='testpaper',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество комментариев'),
+        ),
+        migrations.AddField(
+            model_name='theme',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество комментариев'),
+        ),
+        migrations.AddField(
+            model_name='theme',
+            name='lesson_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество уроков'),
+        ),
+        migrations.AddField(
+            model_name='theme',
+            name='test_count',
+            field=models.IntegerField(default=0, editable=False, verbose_name='количество тестов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,49 @@
-from django.db import models
+from math import sqrt
+
+from django.db import models, transaction
+from django.urls import reverse
 
 from constants import nullable
 from users.models import User
 
 
-class Subject(models.Model):
-    """Предмет"""
+class CounterFieldsMixin:
+    """Модель с денормализованными счётчиками (counter_fields).
+    Счётчики изменяются только запросами UPDATE с F() (см. materials.counters),
+    поэтому при сохранении существующего объекта они не перезаписываются
+    значениями, загруженными ранее. Сохранение вместе с обработчиками
+    сигналов, обновляющими счётчики, выполняется в одной транзакции."""
+    counter_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and self.pk is not None \
+                and kwargs.get('update_fields') is None:
+            skipped = set(self.counter_fields) | self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname not in skipped]
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+
+def counter(verbose_name):
+    return models.IntegerField(
+        default=0, editable=False, verbose_name=verbose_name)
+
+
+class Subject(CounterFieldsMixin, models.Model):
+    """Предмет.
+    Счётчики учитывают опубликованные темы, а также опубликованные
+    уроки и тесты опубликованных тем предмета."""
     name = models.CharField(
         max_length=50, unique=True, verbose_name='название')
     description = models.TextField(
         max_length=250, **nullable, verbose_name='описание')
+    theme_count = counter('количество тем')
+    lesson_count = counter('количество уроков')
+    test_count = counter('количество тестов')
+
+    counter_fields = ('theme_count', 'lesson_count', 'test_count')
 
     def __str__(self):
         return self.name
@@ -19,8 +53,10 @@ class Subject(models.Model):
         verbose_name_plural = 'предметы'
 
 
-class Theme(models.Model):
-    """Тема урока"""
+class Theme(CounterFieldsMixin, models.Model):
+    """Тема урока.
+    Счётчики учитывают опубликованные уроки и тесты темы
+    и комментарии к теме."""
     title = models.CharField(max_length=250, verbose_name='название')
     subject = models.ForeignKey(
         Subject, on_delete=models.CASCADE, verbose_name='предмет')
@@ -30,6 +66,11 @@ class Theme(models.Model):
         User, on_delete=models.CASCADE, **nullable, verbose_name='владелец')
     is_published = models.BooleanField(
         default=False, verbose_name='признак публикации')
+    lesson_count = counter('количество уроков')
+    test_count = counter('количество тестов')
+    comment_count = counter('количество комментариев')
+
+    counter_fields = ('lesson_count', 'test_count', 'comment_count')
 
     def __str__(self):
         return f'Тема по предмету "{self.subject}": {self.title}'
@@ -37,13 +78,18 @@ class Theme(models.Model):
     class Meta:
         verbose_name = 'тема'
         verbose_name_plural = 'темы'
+        indexes = [
+            models.Index(fields=['subject'],
+                         condition=models.Q(is_published=True),
+                         name='theme_published_subject_idx'),
+        ]
         permissions = [
             ('set_published',
              'Can publish theme')
         ]
 
 
-class Lesson(models.Model):
+class Lesson(CounterFieldsMixin, models.Model):
     """Урок"""
     title = models.CharField(max_length=250, verbose_name='название')
     theme = models.ForeignKey(
@@ -60,6 +106,9 @@ class Lesson(models.Model):
         upload_to='lessons/', **nullable, verbose_name='файл с уроком')
     is_published = models.BooleanField(
         default=False, verbose_name='признак публикации')
+    comment_count = counter('количество комментариев')
+
+    counter_fields = ('comment_count',)
 
     def __str__(self):
         return f'Урок по теме {self.theme}: {self.title}'
@@ -67,13 +116,41 @@ class Lesson(models.Model):
     class Meta:
         verbose_name = 'урок'
         verbose_name_plural = 'уроки'
+        indexes = [
+            models.Index(fields=['theme'],
+                         condition=models.Q(is_published=True),
+                         name='lesson_published_theme_idx'),
+        ]
         permissions = [
             ('set_published',
              'Can publish lesson')
         ]
 
 
-class TestPaper(models.Model):
+class LessonRendition(models.Model):
+    """Html и текстовое представление файла урока,
+    подготовленные при загрузке файла"""
+    lesson = models.OneToOneField(
+        Lesson, on_delete=models.CASCADE, related_name='rendition',
+        verbose_name='урок')
+    source = models.CharField(
+        max_length=100, verbose_name='исходный файл')
+    html = models.TextField(verbose_name='html представление')
+    text = models.TextField(verbose_name='текстовое представление')
+    page_offsets = models.JSONField(
+        default=list, verbose_name='смещения страниц в html')
+    converted_at = models.DateTimeField(
+        auto_now=True, verbose_name='дата и время конвертации')
+
+    def __str__(self):
+        return f'Представление урока {self.lesson_id}'
+
+    class Meta:
+        verbose_name = 'представление урока'
+        verbose_name_plural = 'представления уроков'
+
+
+class TestPaper(CounterFieldsMixin, models.Model):
     """Тест"""
     title = models.CharField(max_length=100, verbose_name='название')
     theme = models.ForeignKey(
@@ -84,6 +161,11 @@ class TestPaper(models.Model):
         verbose_name='владелец')
     is_published = models.BooleanField(
         default=False, verbose_name='признак публикации')
+    key_version = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='версия ключа ответов')
+    comment_count = counter('количество комментариев')
+
+    counter_fields = ('key_version', 'comment_count')
 
     def __str__(self):
         return f'Тест "{self.title}"'
@@ -91,6 +173,11 @@ class TestPaper(models.Model):
     class Meta:
         verbose_name = 'тест'
         verbose_name_plural = 'тесты'
+        indexes = [
+            models.Index(fields=['theme'],
+                         condition=models.Q(is_published=True),
+                         name='test_published_theme_idx'),
+        ]
 
 
 class Question(models.Model):
@@ -140,3 +227,159 @@ class Result(models.Model):
     class Meta:
         verbose_name = 'результат'
         verbose_name_plural = 'результаты'
+        indexes = [
+            models.Index(fields=['user', 'date', 'id'],
+                         name='result_user_date_idx'),
+        ]
+
+
+class TestAggregate(models.Model):
+    """Накопленная статистика результатов теста.
+    Обновляется при создании каждого результата,
+    bucket_N - количество результатов в диапазоне [N*10, N*10+9]%
+    (в bucket_9 также попадают результаты 100%)."""
+    test = models.OneToOneField(
+        TestPaper, on_delete=models.CASCADE, primary_key=True,
+        related_name='aggregate', verbose_name='тест')
+    attempts = models.PositiveIntegerField(
+        default=0, verbose_name='количество попыток')
+    score_sum = models.BigIntegerField(
+        default=0, verbose_name='сумма результатов')
+    score_sq_sum = models.BigIntegerField(
+        default=0, verbose_name='сумма квадратов результатов')
+    best_score = models.PositiveIntegerField(
+        default=0, verbose_name='лучший результат')
+    bucket_0 = models.PositiveIntegerField(default=0)
+    bucket_1 = models.PositiveIntegerField(default=0)
+    bucket_2 = models.PositiveIntegerField(default=0)
+    bucket_3 = models.PositiveIntegerField(default=0)
+    bucket_4 = models.PositiveIntegerField(default=0)
+    bucket_5 = models.PositiveIntegerField(default=0)
+    bucket_6 = models.PositiveIntegerField(default=0)
+    bucket_7 = models.PositiveIntegerField(default=0)
+    bucket_8 = models.PositiveIntegerField(default=0)
+    bucket_9 = models.PositiveIntegerField(default=0)
+
+    BUCKETS = 10
+
+    @staticmethod
+    def bucket_field(percentage):
+        """Возвращает имя поля гистограммы для результата"""
+        return f'bucket_{min(int(percentage) // 10, 9)}'
+
+    @property
+    def mean(self):
+        if not self.attempts:
+            return None
+        return self.score_sum / self.attempts
+
+    @property
+    def std(self):
+        if not self.attempts:
+            return None
+        variance = self.score_sq_sum / self.attempts - self.mean ** 2
+        return sqrt(max(variance, 0))
+
+    @property
+    def histogram(self):
+        """Список кортежей (начало диапазона, количество результатов)"""
+        return [(number * 10, getattr(self, f'bucket_{number}'))
+                for number in range(self.BUCKETS)]
+
+    def __str__(self):
+        return f'Статистика теста {self.test_id}'
+
+    class Meta:
+        verbose_name = 'статистика теста'
+        verbose_name_plural = 'статистика тестов'
+
+
+class ResultAnswer(models.Model):
+    """Ответ, выбранный пользователем при прохождении теста"""
+    result = models.ForeignKey(
+        Result, on_delete=models.CASCADE, related_name='answers',
+        verbose_name='результат')
+    question = models.ForeignKey(
+        Question, on_delete=models.CASCADE, verbose_name='вопрос')
+    answer = models.ForeignKey(
+        Answer, on_delete=models.CASCADE, verbose_name='ответ')
+    is_correct = models.BooleanField(verbose_name='верный')
+
+    def __str__(self):
+        return f'Ответ пользователя "{self.answer_id}"'
+
+    class Meta:
+        verbose_name = 'ответ пользователя'
+        verbose_name_plural = 'ответы пользователей'
+
+
+class CatalogueCounters(models.Model):
+    """Счётчики каталога для домашней страницы.
+    Единственная строка таблицы (pk=1) обновляется сигналами
+    при создании и удалении предметов, тем, уроков и тестов."""
+    subjects = models.IntegerField(
+        default=0, verbose_name='количество предметов')
+    themes = models.IntegerField(default=0, verbose_name='количество тем')
+    lessons = models.IntegerField(
+        default=0, verbose_name='количество уроков')
+    tests = models.IntegerField(default=0, verbose_name='количество тестов')
+    top_subjects = models.JSONField(
+        default=list, verbose_name='названия первых предметов')
+
+    def __str__(self):
+        return 'Счётчики каталога'
+
+    class Meta:
+        verbose_name = 'счётчики каталога'
+        verbose_name_plural = 'счётчики каталога'
+
+
+class SearchDocument(models.Model):
+    """Запись поискового индекса по материалам сайта.
+    Хранит текст предмета, темы, урока (вместе с текстом файла урока)
+    или теста (вместе с текстом вопросов) и признаки, по которым
+    отбираются доступные пользователю материалы.
+    В PostgreSQL таблица также содержит вычисляемый столбец
+    search_vector для полнотекстового поиска (см. materials.search)."""
+    SUBJECT = 'subject'
+    THEME = 'theme'
+    LESSON = 'lesson'
+    TEST = 'test'
+    KINDS = [
+        (SUBJECT, 'предмет'),
+        (THEME, 'тема'),
+        (LESSON, 'урок'),
+        (TEST, 'тест'),
+    ]
+
+    kind = models.CharField(
+        max_length=10, choices=KINDS, verbose_name='вид материала')
+    object_id = models.PositiveIntegerField(verbose_name='id материала')
+    title = models.CharField(max_length=250, verbose_name='название')
+    body = models.TextField(blank=True, verbose_name='текст')
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, **nullable,
+        verbose_name='владелец')
+    is_published = models.BooleanField(
+        default=False, verbose_name='признак публикации')
+
+    URL_NAMES = {
+        SUBJECT: 'material:subject_detail',
+        THEME: 'material:theme_detail',
+        LESSON: 'material:lesson_detail',
+        TEST: 'material:test_detail',
+    }
+
+    def __str__(self):
+        return f'{self.get_kind_display()}: {self.title}'
+
+    def get_absolute_url(self):
+        return reverse(self.URL_NAMES[self.kind], args=[self.object_id])
+
+    class Meta:
+        verbose_name = 'запись поискового индекса'
+        verbose_name_plural = 'поисковый индекс'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'object_id'],
+                                    name='search_document_object_unique'),
+        ]
@@ -0,0 +1,128 @@
+from django.core import signing
+from django.core.exceptions import ValidationError, FieldDoesNotExist
+from django.db import connections
+from django.db.models import Q
+
+CURSOR_SALT = 'materials.pagination.cursor'
+
+
+class KeysetPaginationMixin:
+    """
+    Постраничный вывод для ListView по ключу (keyset pagination).
+    Записи упорядочиваются по полю keyset_field (если задано) и id,
+    следующая страница выбирается условием "строго после последней
+    записи текущей страницы", поэтому стоимость запроса не зависит
+    от номера страницы. Позиция передаётся в параметре cursor_param
+    в виде подписанного непрозрачного токена.
+    list_select_related и list_only задают проекцию выборки
+    для конкретного представления.
+    keyset_field может быть и аннотацией выборки (например, рангом
+    поиска) - тогда её значение передаётся в курсоре без преобразования,
+    поэтому тип аннотации должен точно передаваться в Python и обратно
+    (например, double precision, но не real).
+    """
+    paginate_by = 20
+    keyset_field = None
+    keyset_descending = True
+    cursor_param = 'cursor'
+    list_select_related = ()
+    list_only = ()
+
+    def get_keyset_field(self):
+        return self.keyset_field
+
+    def get_keyset_model_field(self):
+        """Возвращает поле модели для keyset_field или None для аннотации"""
+        try:
+            return self.model._meta.get_field(self.get_keyset_field())
+        except FieldDoesNotExist:
+            return None
+
+    def get_keyset_ordering(self):
+        prefix = '-' if self.keyset_descending else ''
+        field = self.get_keyset_field()
+        fields = [field] if field else []
+        return tuple(f'{prefix}{field}' for field in fields + ['pk'])
+
+    def apply_projection(self, queryset):
+        if self.list_select_related:
+            queryset = queryset.select_related(*self.list_select_related)
+        if self.list_only:
+            queryset = queryset.only(*self.list_only)
+        return queryset
+
+    def encode_cursor(self, obj):
+        value = None
+        field = self.get_keyset_field()
+        if field and getattr(obj, field) is not None:
+            model_field = self.get_keyset_model_field()
+            value = model_field.value_to_string(obj) if model_field \
+                else getattr(obj, field)
+        return signing.dumps([value, obj.pk], salt=CURSOR_SALT)
+
+    def decode_cursor(self, token):
+        """Возвращает (значение поля, id) или None для неверного токена"""
+        try:
+            value, pk = signing.loads(token, salt=CURSOR_SALT)
+            model_field = self.get_keyset_model_field()
+            if value is not None and model_field:
+                value = model_field.to_python(value)
+            return value, int(pk)
+        except (signing.BadSignature, ValidationError,
+                TypeError, ValueError):
+            return None
+
+    def filter_after_cursor(self, queryset, cursor):
+        """
+        Оставляет записи, идущие после курсора. Учитывает, где база
+        данных располагает NULL при сортировке (PostgreSQL считает NULL
+        наибольшим значением, SQLite - наименьшим).
+        """
+        value, pk = cursor
+        lookup = 'lt' if self.keyset_descending else 'gt'
+        after_pk = Q(**{f'pk__{lookup}': pk})
+        field = self.get_keyset_field()
+        if not field:
+            return queryset.filter(after_pk)
+        is_null = Q(**{f'{field}__isnull': True})
+        nulls_first = connections[
+            queryset.db].features.nulls_order_largest == self.keyset_descending
+        if value is None:
+            after = is_null & after_pk
+            return queryset.filter(after | ~is_null if nulls_first else after)
+        after = Q(**{f'{field}__{lookup}': value}) | (
+            Q(**{field: value}) & after_pk)
+        return queryset.filter(after if nulls_first else after | is_null)
+
+    def get_keyset_page(self, queryset, token, page_size):
+        """
+        Возвращает страницу записей, идущих после курсора token,
+        и курсор следующей страницы (None, если страница последняя).
+        Выбирается на одну запись больше размера страницы,
+        чтобы узнать, есть ли следующая.
+        """
+        queryset = self.apply_projection(
+            queryset.order_by(*self.get_keyset_ordering()))
+        cursor = self.decode_cursor(token or '')
+        if cursor:
+            queryset = self.filter_after_cursor(queryset, cursor)
+        object_list = list(queryset[:page_size + 1])
+        next_cursor = None
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            next_cursor = self.encode_cursor(object_list[-1])
+        return object_list, next_cursor
+
+    def paginate_queryset(self, queryset, page_size):
+        """Возвращает одну страницу записей по курсору из запроса"""
+        object_list, self.next_cursor = self.get_keyset_page(
+            queryset, self.request.GET.get(self.cursor_param), page_size)
+        return None, None, object_list, self.next_cursor is not None
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if getattr(self, 'next_cursor', None):
+            query = self.request.GET.copy()
+            query[self.cursor_param] = self.next_cursor
+            context['next_page_query'] = query.urlencode()
+        return context
@@ -0,0 +1,60 @@
+from django.contrib.auth.mixins import UserPassesTestMixin
+from django.shortcuts import get_object_or_404
+
+
+def is_owner(obj, user, owner_attr='owner_id'):
+    """
+    Проверяет, является ли пользователь владельцем объекта.
+    Сравниваются id, поэтому владелец из базы данных не загружается.
+    :arg
+    obj -- экземпляр модели
+    user -- экземпляр класса User
+    owner_attr -- атрибут объекта с id владельца
+    (через '__' - атрибут связанного объекта, например 'test__owner_id')
+    """
+    owner_id = obj
+    for name in owner_attr.split('__'):
+        owner_id = getattr(owner_id, name)
+    return user.is_authenticated and owner_id == user.pk
+
+
+def can_view(obj, user, owner_attr='owner_id'):
+    """
+    Проверяет, может ли пользователь просматривать материал
+    (урок/тему/тест): материал опубликован, либо пользователь
+    является модератором или владельцем материала.
+    """
+    return obj.is_published or user.is_staff or is_owner(
+        obj, user, owner_attr)
+
+
+class ObjectPermissionMixin(UserPassesTestMixin):
+    """
+    Проверка прав доступа к объекту представления.
+    Объект загружается один раз за запрос, проверяется в test_func
+    и тот же экземпляр возвращается из get_object().
+    permission -- 'owner' (доступно только владельцу)
+    или 'view' (доступно, если материал можно просматривать, см. can_view)
+    owner_attr -- атрибут объекта с id владельца
+    """
+    permission = 'owner'
+    owner_attr = 'owner_id'
+
+    def get_permission_queryset(self):
+        """Выборка, из которой загружается проверяемый объект"""
+        return self.get_queryset()
+
+    def get_permission_object(self):
+        if not hasattr(self, 'permission_object'):
+            self.permission_object = get_object_or_404(
+                self.get_permission_queryset(), pk=self.kwargs['pk'])
+        return self.permission_object
+
+    def test_func(self):
+        obj = self.get_permission_object()
+        if self.permission == 'view':
+            return can_view(obj, self.request.user, self.owner_attr)
+        return is_owner(obj, self.request.user, self.owner_attr)
+
+    def get_object(self, queryset=None):
+        return self.get_permission_object()
@@ -0,0 +1,176 @@
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, \
+    sync_to_async
+from django.db import connection
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+_SPACES = re.compile(r'\s+')
+# имя в query_stats для адресов, которым не соответствует ни один url
+UNRESOLVED_URL = '<unresolved>'
+
+
+def fingerprint(sql):
+    """
+    Приводит SQL запрос к виду, одинаковому для запросов,
+    отличающихся только параметрами.
+    """
+    return _IN_LIST.sub('IN (...)', _SPACES.sub(' ', sql)).strip()
+
+
+class QueryRecorder:
+    """
+    Обёртка для connection.execute_wrapper: считает запросы,
+    суммарное время их выполнения и повторы одинаковых запросов.
+    Может использоваться как контекстный менеджер.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = Counter()
+        self._wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.fingerprints[fingerprint(sql)] += 1
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._wrapper.__exit__(*exc_info)
+
+    def repeated(self, threshold):
+        """Возвращает запросы, повторившиеся больше threshold раз"""
+        return [(sql, count) for sql, count in self.fingerprints.items()
+                if count > threshold]
+
+
+class QueryStats:
+    """Накопленная по процессу статистика запросов по именам url"""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add(self, url_name, recorder):
+        with self._lock:
+            stats = self._stats.setdefault(url_name, {
+                'requests': 0, 'queries': 0, 'max_queries': 0,
+                'db_time': 0.0})
+            stats['requests'] += 1
+            stats['queries'] += recorder.count
+            stats['max_queries'] = max(stats['max_queries'], recorder.count)
+            stats['db_time'] += recorder.duration
+
+    def snapshot(self):
+        with self._lock:
+            return {url_name: dict(stats)
+                    for url_name, stats in self._stats.items()}
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+
+query_stats = QueryStats()
+
+
+class QueryBudgetMiddleware:
+    """
+    Учитывает SQL запросы каждого запроса к сайту: количество,
+    суммарное время и повторы одинаковых запросов. Результат
+    добавляется в query_stats под именем url. Если один и тот же
+    запрос повторился больше QUERY_N_PLUS_ONE_THRESHOLD раз,
+    в лог пишется предупреждение о вероятной проблеме N+1.
+    Работает и под WSGI, и под ASGI (без переключения между
+    синхронным и асинхронным кодом). Запросы асинхронных
+    представлений выполняются в потоке sync_to_async, поэтому
+    учёт подключается к соединению этого потока. Учитываются
+    запросы до возврата ответа: запросы, выполняемые при передаче
+    потокового ответа (например, ленты новых комментариев),
+    в статистику не попадают.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        self.record(request, recorder)
+        return response
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        await sync_to_async(recorder.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(recorder.__exit__)(None, None, None)
+        self.record(request, recorder)
+        return response
+
+    def record(self, request, recorder):
+        """Добавляет запросы recorder в query_stats и проверяет повторы"""
+        match = request.resolver_match
+        # запросы к несуществующим адресам учитываются вместе,
+        # чтобы произвольные пути не добавляли записей в query_stats
+        url_name = match.view_name if match else UNRESOLVED_URL
+        query_stats.add(url_name, recorder)
+        for sql, count in recorder.repeated(
+                settings.QUERY_N_PLUS_ONE_THRESHOLD):
+            logger.warning('Возможная проблема N+1 в %s: запрос выполнен '
+                           '%s раз: %s', url_name, count, sql)
+        logger.debug('%s: %s запросов, %.1f мс', url_name,
+                     recorder.count, recorder.duration * 1000)
+
+
+class QueryBudgetTestMixin:
+    """
+    Примесь для TestCase: проверяет, что запрос к url
+    укладывается в заданное количество SQL запросов.
+    Количество сравнивается только для ответа с ожидаемым кодом
+    (status или, если он не задан, любой код 2xx): ошибка
+    или отказ в доступе обычно выполняют меньше запросов.
+    """
+
+    def assertQueryBudget(self, budget, url, method='get', status=None,
+                          **kwargs):
+        with QueryRecorder() as recorder:
+            response = getattr(self.client, method)(url, **kwargs)
+        if status is None:
+            self.assertTrue(
+                200 <= response.status_code < 300,
+                f'{url}: код ответа {response.status_code}')
+        else:
+            self.assertEqual(response.status_code, status, url)
+        if recorder.count > budget:
+            queries = '\n'.join(
+                f'{count} x {sql}'
+                for sql, count in recorder.fingerprints.most_common())
+            self.fail(f'{url}: {recorder.count} запросов при бюджете '
+                      f'{budget}:\n{queries}')
+        return response
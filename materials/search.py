@@ -0,0 +1,206 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, \
+    SearchHeadline, SearchVectorField
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q, Value, FloatField
+from django.db.models.functions import Cast
+from django.db.models.expressions import RawSQL
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from materials.models import Subject, Theme, Lesson, TestPaper, \
+    LessonRendition, Question, SearchDocument
+
+SEARCH_CONFIG = 'russian'
+SNIPPET_LENGTH = 200
+# границы найденных слов во фрагменте текста
+# (заменяются тегами после экранирования html)
+START_SEL = '\x02'
+STOP_SEL = '\x03'
+
+
+def _join(*parts):
+    return '\n'.join(part for part in parts if part)
+
+
+def subject_document(subject):
+    return {'title': subject.name, 'body': subject.description or '',
+            'owner_id': None, 'is_published': True}
+
+
+def theme_document(theme):
+    return {'title': theme.title, 'body': theme.description or '',
+            'owner_id': theme.owner_id, 'is_published': theme.is_published}
+
+
+def lesson_document(lesson, file_text=None):
+    """
+    :arg
+    lesson -- экземпляр класса Lesson
+    file_text -- текст файла урока (если не передан,
+    берётся из подготовленного представления файла)
+    """
+    if file_text is None:
+        file_text = LessonRendition.objects.filter(
+            lesson_id=lesson.pk).values_list('text', flat=True).first()
+    return {'title': lesson.title,
+            'body': _join(lesson.description, lesson.material, file_text),
+            'owner_id': lesson.owner_id, 'is_published': lesson.is_published}
+
+
+def test_document(test, questions=None):
+    """
+    :arg
+    test -- экземпляр класса TestPaper
+    questions -- тексты вопросов теста (если не переданы,
+    загружаются из базы данных)
+    """
+    if questions is None:
+        questions = Question.objects.filter(test_id=test.pk).order_by(
+            'id').values_list('question_text', flat=True)
+    return {'title': test.title,
+            'body': _join(test.description, *questions),
+            'owner_id': test.owner_id, 'is_published': test.is_published}
+
+
+DOCUMENTS = {
+    Subject: (SearchDocument.SUBJECT, subject_document),
+    Theme: (SearchDocument.THEME, theme_document),
+    Lesson: (SearchDocument.LESSON, lesson_document),
+    TestPaper: (SearchDocument.TEST, test_document),
+}
+
+
+def index_object(obj):
+    """
+    Обновляет запись поискового индекса для материала
+    (предмета, темы, урока или теста)
+    """
+    kind, build = DOCUMENTS[type(obj)]
+    fields = build(obj)
+    documents = SearchDocument.objects.filter(kind=kind, object_id=obj.pk)
+    if documents.update(**fields):
+        return
+    try:
+        with transaction.atomic():
+            SearchDocument.objects.create(
+                kind=kind, object_id=obj.pk, **fields)
+    except IntegrityError:
+        documents.update(**fields)
+
+
+def remove_object(obj):
+    """Удаляет материал из поискового индекса"""
+    kind, _ = DOCUMENTS[type(obj)]
+    SearchDocument.objects.filter(kind=kind, object_id=obj.pk).delete()
+
+
+def index_by_id(model, pk):
+    """Обновляет запись индекса для материала с указанным id"""
+    obj = model.objects.filter(pk=pk).first()
+    if obj is not None:
+        index_object(obj)
+
+
+def rebuild_search_index():
+    """
+    Полностью перестраивает поисковый индекс.
+    :return
+    количество записей индекса
+    """
+    documents = []
+    for subject in Subject.objects.all():
+        documents.append(SearchDocument(
+            kind=SearchDocument.SUBJECT, object_id=subject.pk,
+            **subject_document(subject)))
+    for theme in Theme.objects.all():
+        documents.append(SearchDocument(
+            kind=SearchDocument.THEME, object_id=theme.pk,
+            **theme_document(theme)))
+    for lesson in Lesson.objects.select_related('rendition').defer(
+            'rendition__html'):
+        rendition = getattr(lesson, 'rendition', None)
+        documents.append(SearchDocument(
+            kind=SearchDocument.LESSON, object_id=lesson.pk,
+            **lesson_document(lesson, rendition.text if rendition else '')))
+    for test in TestPaper.objects.prefetch_related('question_set'):
+        documents.append(SearchDocument(
+            kind=SearchDocument.TEST, object_id=test.pk,
+            **test_document(test, [question.question_text for question
+                                   in test.question_set.all()])))
+    with transaction.atomic():
+        SearchDocument.objects.all().delete()
+        SearchDocument.objects.bulk_create(documents, batch_size=500)
+    return len(documents)
+
+
+def visible_documents(user):
+    """
+    Записи индекса, доступные пользователю: опубликованные материалы
+    и материалы пользователя, для персонала - все материалы.
+    Отбор выполняется в базе данных.
+    """
+    documents = SearchDocument.objects.all()
+    if not user.is_staff:
+        documents = documents.filter(
+            Q(is_published=True) | Q(owner_id=user.pk))
+    return documents
+
+
+def search_documents(query, user):
+    """
+    Ищет материалы, доступные пользователю.
+    В PostgreSQL используется полнотекстовый поиск с учётом морфологии
+    русского языка (совпадения в названии весят больше, чем в тексте),
+    найденные записи получают аннотации rank и headline (фрагмент
+    текста с найденными словами). В остальных СУБД выполняется
+    поиск подстроки с одинаковым рангом.
+    :arg
+    query -- строка запроса
+    user -- экземпляр класса User
+    :return
+    queryset записей SearchDocument с аннотацией rank
+    """
+    documents = visible_documents(user)
+    if connection.vendor != 'postgresql':
+        return documents.filter(
+            Q(title__icontains=query) | Q(body__icontains=query)
+        ).annotate(rank=Value(0.0, output_field=FloatField()))
+    search_query = SearchQuery(
+        query, config=SEARCH_CONFIG, search_type='websearch')
+    vector = RawSQL('"materials_searchdocument"."search_vector"', [],
+                    output_field=SearchVectorField())
+    return documents.alias(vector=vector).filter(
+        vector=search_query
+    ).annotate(
+        # ts_rank возвращает real: в double precision значение ранга
+        # без потерь проходит через курсор страницы
+        rank=Cast(SearchRank(vector, search_query), FloatField()),
+        headline=SearchHeadline(
+            'body', search_query, config=SEARCH_CONFIG,
+            start_sel=START_SEL, stop_sel=STOP_SEL,
+            max_words=35, min_words=15),
+    ).defer('body')
+
+
+def snippet(document, query):
+    """
+    Возвращает html фрагмент текста найденной записи
+    с выделенными совпадениями.
+    :arg
+    document -- экземпляр класса SearchDocument из search_documents()
+    query -- строка запроса
+    """
+    headline = getattr(document, 'headline', None)
+    if headline is None:
+        text = document.body
+        position = text.lower().find(query.lower())
+        if position < 0:
+            headline = text[:SNIPPET_LENGTH]
+        else:
+            start = max(position - SNIPPET_LENGTH // 2, 0)
+            end = position + len(query)
+            headline = (text[start:position] + START_SEL
+                        + text[position:end] + STOP_SEL
+                        + text[end:start + SNIPPET_LENGTH])
+    return mark_safe(escape(headline).replace(
+        START_SEL, '<mark>').replace(STOP_SEL, '</mark>'))
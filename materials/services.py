@@ -2,9 +2,33 @@ from datetime import datetime
 
 import pytz
 from django.core import exceptions
+from django.core.paginator import Paginator
+from django.db import transaction, IntegrityError
+from django.db.models import F, Q, Count, Sum, Max, Subquery, OuterRef
+from django.db.models.functions import Substr, Greatest, Coalesce
 
-from config.settings import TIME_ZONE
-from materials.models import Result
+from config.settings import TIME_ZONE, LESSON_PAGE_SIZE
+from materials.converters import convert_docx
+from materials.docx_cache import lesson_file_path, lesson_text_cache
+from materials.grading import get_answer_key
+from materials.permissions import can_view
+from materials.statistics import reset_test_statistics
+from materials.models import Result, LessonRendition, Answer, \
+    ResultAnswer, TestAggregate, CatalogueCounters, Subject, Theme, \
+    Lesson, TestPaper
+
+HOME_SUBJECTS_COUNT = 5
+CATALOGUE_MODELS = {'subjects': Subject, 'themes': Theme,
+                    'lessons': Lesson, 'tests': TestPaper}
+# материалы, которые удаляются вместе с записью модели:
+# {модель: {счётчик каталога: путь от материала к удаляемой записи}}
+CATALOGUE_CASCADE = {
+    Subject: {'subjects': 'pk', 'themes': 'subject',
+              'lessons': 'theme__subject', 'tests': 'theme__subject'},
+    Theme: {'themes': 'pk', 'lessons': 'theme', 'tests': 'theme'},
+    Lesson: {'lessons': 'pk'},
+    TestPaper: {'tests': 'pk'},
+}
 
 
 def check_published(obj, user):
@@ -17,86 +41,303 @@ def check_published(obj, user):
     :arg
     obj -- экземпляр класса Lesson / Theme / TestPaper
     user -- экземпляр класса User"""
-    is_owner = obj.owner == user
-    if not obj.is_published and not user.is_staff and not is_owner:
+    if not can_view(obj, user):
         raise exceptions.PermissionDenied
     return obj
 
 
-def create_dict(response):
+def save_rendition(lesson, rendition):
+    """
+    Сохраняет подготовленное представление файла урока.
+    :arg
+    lesson -- экземпляр класса Lesson
+    rendition -- словарь с ключами 'html' и 'text'
+    :return
+    экземпляр класса LessonRendition
+    """
+    obj, _ = LessonRendition.objects.update_or_create(
+        lesson=lesson,
+        defaults={'source': lesson.file.name, **rendition})
+    return obj
+
+
+def convert_lesson_file(lesson):
+    """
+    Переводит файл урока в html и текст и сохраняет результат.
+    Если у урока нет файла, удаляет устаревшее представление.
+    :arg
+    lesson -- экземпляр класса Lesson
+    :return
+    экземпляр класса LessonRendition или None
+    """
+    if not lesson.file:
+        LessonRendition.objects.filter(lesson=lesson).delete()
+        return None
+    rendition = convert_docx(lesson_file_path(lesson.file), LESSON_PAGE_SIZE)
+    return save_rendition(lesson, rendition)
+
+
+def get_rendition_page(rendition, number):
+    """
+    Возвращает html одной страницы представления урока.
+    Из базы данных выбирается только нужный фрагмент html,
+    границы которого берутся из индекса страниц.
+    :arg
+    rendition -- экземпляр класса LessonRendition
+        (поле html может быть отложено)
+    number -- номер страницы, начиная с 1
+    :return
+    html страницы
+    """
+    start = rendition.page_offsets[number - 1]
+    end = rendition.page_offsets[number]
+    return LessonRendition.objects.filter(pk=rendition.pk).annotate(
+        page=Substr('html', start + 1, end - start)
+    ).values_list('page', flat=True).get()
+
+
+def get_lesson_file_page(lesson, number):
     """
-    Меняет тип ключей в словаре с str на int
-    и тип значений с str на bool.
+    Возвращает одну страницу материала из файла урока.
+    Если файл уже конвертирован, страница берётся из сохранённого
+    html по индексу страниц, иначе - из кэша текста абзацев файла.
     :arg
-    response -- словарь типа {'int': 'bool'}
+    lesson -- экземпляр класса Lesson с подгруженным rendition
+    number -- номер страницы (строка из запроса или None)
     :return
-    user_dict -- словарь типа {int: bool}
+    словарь с ключами 'page' (страница пагинатора) и 'html'
+        либо 'paragraphs'; пустой словарь, если у урока нет файла
     """
-    user_dict = {}
-    for key, val in response.items():
-        key = int(key)
-        if val == 'True':
-            val = True
-        else:
-            val = False
-        user_dict[key] = val
-    return user_dict
+    if not lesson.file:
+        return {}
+    rendition = getattr(lesson, 'rendition', None)
+    if rendition and rendition.source == lesson.file.name \
+            and rendition.page_offsets:
+        page = Paginator(
+            range(len(rendition.page_offsets) - 1), 1).get_page(number)
+        html = ''
+        if page.object_list:
+            html = get_rendition_page(rendition, page.number)
+        return {'page': page, 'html': html}
+    paragraphs = lesson_text_cache.get_paragraphs(
+        lesson_file_path(lesson.file))
+    page = Paginator(paragraphs, LESSON_PAGE_SIZE).get_page(number)
+    return {'page': page, 'paragraphs': page.object_list}
 
 
-def create_result(test, user_results, user):
+def create_result(test, answer_ids, user):
     """
     Создаёт экземпляр класса Result
-    для передаваемых пользователя и результатов
+    для передаваемых пользователя и выбранных им ответов
+    и одним запросом сохраняет выбранные ответы (ResultAnswer).
+    Проверка выполняется по скомпилированному ключу ответов теста.
     :arg
     test -- экземпляр класса TestPaper
-    user_results -- словарь с ответами пользователя типа {int: bool}
+    answer_ids -- список id выбранных пользователем ответов
     user -- экземпляр класса User
     :return
     result -- экземпляр класса Result
     """
-    all_answers = []
-    for question in test.question_set.all():
-        all_answers += list(question.answer_set.all())
-    correct_answers = 0
-    user_correct_answers = 0
-    for answer in all_answers:
-        if answer.is_correct:
-            correct_answers += 1
-    for val in create_dict(user_results).values():
-        if val:
-            user_correct_answers += 1
-    percentage = user_correct_answers * 100 / correct_answers
+    answer_key = get_answer_key(test)
+    percentage = int(answer_key.grade(answer_ids))
     result = Result(test=test, user=user,
                     percentage=percentage,
                     date=datetime.now(pytz.timezone(TIME_ZONE)))
-    result.save()
+    with transaction.atomic():
+        result.save()
+        ResultAnswer.objects.bulk_create(
+            ResultAnswer(result=result, answer_id=answer_id,
+                         question_id=question_id, is_correct=is_correct)
+            for answer_id, question_id, is_correct
+            in answer_key.responses(answer_ids))
+        add_to_test_aggregate(test.pk, percentage)
     return result
 
 
-def get_user_answer_dict(test, user_answer):
+def add_to_test_aggregate(test_id, percentage):
+    """
+    Учитывает новый результат в накопленной статистике теста.
+    Обновление выполняется одним UPDATE с F() выражениями,
+    поэтому одновременные попытки не теряют друг друга.
+    :arg
+    test_id -- id экземпляра класса TestPaper
+    percentage -- результат попытки в процентах
+    """
+    changes = {
+        'attempts': F('attempts') + 1,
+        'score_sum': F('score_sum') + percentage,
+        'score_sq_sum': F('score_sq_sum') + percentage ** 2,
+        'best_score': Greatest('best_score', percentage),
+        TestAggregate.bucket_field(percentage):
+            F(TestAggregate.bucket_field(percentage)) + 1,
+    }
+    if TestAggregate.objects.filter(test_id=test_id).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            TestAggregate.objects.create(
+                test_id=test_id, attempts=1, score_sum=percentage,
+                score_sq_sum=percentage ** 2, best_score=percentage,
+                **{TestAggregate.bucket_field(percentage): 1})
+    except IntegrityError:
+        TestAggregate.objects.filter(test_id=test_id).update(**changes)
+
+
+def _aggregate_totals():
+    """
+    Агрегаты результатов для полей TestAggregate
+    (кроме лучшего результата)
+    """
+    totals = {'attempts': Count('id'),
+              'score_sum': Sum('percentage'),
+              'score_sq_sum': Sum(F('percentage') * F('percentage'))}
+    for number in range(TestAggregate.BUCKETS):
+        condition = Q(percentage__gte=number * 10)
+        if number < TestAggregate.BUCKETS - 1:
+            condition &= Q(percentage__lt=(number + 1) * 10)
+        totals[f'bucket_{number}'] = Count('id', filter=condition)
+    return totals
+
+
+def remove_from_test_aggregates(results):
+    """
+    Исключает результаты из накопленной статистики их тестов
+    (перед удалением результатов) одним запросом UPDATE.
+    Лучший результат не пересчитывается до перестроения статистики
+    командой rebuild_test_aggregates.
+    :arg
+    results -- queryset удаляемых результатов
+    """
+    test_ids = list(results.order_by().values_list(
+        'test_id', flat=True).distinct())
+    if not test_ids:
+        return
+    by_test = results.filter(test_id=OuterRef('test_id')).order_by().values(
+        'test_id')
+    TestAggregate.objects.filter(test_id__in=test_ids).update(**{
+        field: F(field) - Coalesce(Subquery(
+            by_test.annotate(total=total).values('total')), 0)
+        for field, total in _aggregate_totals().items()})
+    for test_id in test_ids:
+        reset_test_statistics(test_id)
+
+
+def delete_results(results):
+    """
+    Удаляет результаты вместе с выбранными ответами и исключает
+    их из накопленной статистики тестов. Результаты, удалённые
+    вместе с пользователем, исключаются сигналом (materials.signals),
+    вместе с тестом - удаляются с его статистикой; после удаления
+    в обход этих путей статистика пересчитывается командой
+    rebuild_test_aggregates.
+    :arg
+    results -- queryset результатов
+    """
+    with transaction.atomic():
+        remove_from_test_aggregates(results)
+        return results.delete()
+
+
+def rebuild_test_aggregates():
+    """
+    Пересчитывает накопленную статистику всех тестов
+    по таблице результатов одним агрегатным запросом.
+    :return
+    количество тестов с результатами
+    """
+    rows = Result.objects.order_by().values('test_id').annotate(
+        best_score=Max('percentage'), **_aggregate_totals())
+    with transaction.atomic():
+        TestAggregate.objects.all().delete()
+        aggregates = TestAggregate.objects.bulk_create(
+            TestAggregate(**row) for row in rows)
+    return len(aggregates)
+
+
+def get_answer_sheet(test, answer_ids):
     """
-    Создаёт список всех экземпляров класса Answer,
-    относящихся к передаваемому экземпляру класса TestPaper.
-    Добавляет к словарю экземпляра ключ 'user_answer'
+    Создаёт список вопросов теста с вариантами ответов.
+    Каждый вариант ответа дополняется ключом 'user_answer'
     с Bool значением (True - если пользователь выбирал этот ответ,
     False - если не выбирал).
     :arg
     test -- экземпляр класса TestPaper
-    user_answer -- словарь с ответами пользователя типа {'int': 'bool'}
+    answer_ids -- список id выбранных пользователем ответов
+    :return
+    questions -- список словарей вопросов с ключом 'answers'
+    """
+    answer_ids = set(answer_ids)
+    questions = {question['id']: {**question, 'answers': []}
+                 for question in test.question_set.order_by(
+                     'id').values('id', 'question_text')}
+    for answer in Answer.objects.filter(question__test=test).order_by(
+            'id').values('id', 'answer_text', 'is_correct', 'question_id'):
+        answer['user_answer'] = answer['id'] in answer_ids
+        questions[answer['question_id']]['answers'].append(answer)
+    return list(questions.values())
+
+
+def reconcile_catalogue_counters():
+    """
+    Пересчитывает счётчики каталога по данным таблиц
+    и исправляет возможное расхождение.
     :return
-    all_answers -- список словарей с экземплярами класса Answer
-        и дополнительным ключом
-    """
-    all_questions = test.question_set.all()
-    user_answer = create_dict(user_answer)
-    all_answers = []
-    for question in all_questions:
-        answers = question.answer_set.all()
-        for answer in answers:
-            answer_dict = answer.__dict__
-            if answer_dict['id'] in user_answer.keys():
-                answer_dict['user_answer'] = True
-            else:
-                answer_dict['user_answer'] = False
-            all_answers.append(answer_dict)
-    return all_answers
+    counters -- экземпляр класса CatalogueCounters
+    """
+    counts = {field: model.objects.count()
+              for field, model in CATALOGUE_MODELS.items()}
+    top_subjects = list(Subject.objects.order_by('pk').values_list(
+        'name', flat=True)[:HOME_SUBJECTS_COUNT])
+    counters, _ = CatalogueCounters.objects.update_or_create(
+        pk=1, defaults={**counts, 'top_subjects': top_subjects})
+    return counters
+
+
+def get_catalogue_counters():
+    """Возвращает счётчики каталога одним запросом"""
+    counters = CatalogueCounters.objects.filter(pk=1).first()
+    if counters is None:
+        counters = reconcile_catalogue_counters()
+    return counters
+
+
+def change_catalogue_counter(field, delta):
+    """
+    Изменяет счётчик каталога на delta.
+    :arg
+    field -- имя счётчика ('subjects', 'themes', 'lessons', 'tests')
+    delta -- изменение (1 при создании, -1 при удалении)
+    """
+    updated = CatalogueCounters.objects.filter(pk=1).update(
+        **{field: F(field) + delta})
+    if not updated:
+        reconcile_catalogue_counters()
+
+
+def remove_from_catalogue_counters(model, pk):
+    """
+    Уменьшает счётчики каталога перед удалением материала на количество
+    материалов, удаляемых вместе с ним (предмет - с темами, уроками
+    и тестами, тема - с уроками и тестами), одним запросом UPDATE.
+    :arg
+    model -- модель материала (Subject, Theme, Lesson или TestPaper)
+    pk -- id удаляемого материала
+    """
+    changes = {}
+    for field, path in CATALOGUE_CASCADE[model].items():
+        if path == 'pk':
+            changes[field] = F(field) - 1
+            continue
+        changes[field] = F(field) - Coalesce(Subquery(
+            CATALOGUE_MODELS[field].objects.filter(**{path: pk}).order_by()
+            .values(path).annotate(count=Count('pk')).values('count')), 0)
+    CatalogueCounters.objects.filter(pk=1).update(**changes)
+
+
+def refresh_top_subjects():
+    """Обновляет список предметов, показываемых на домашней странице"""
+    top_subjects = list(Subject.objects.order_by('pk').values_list(
+        'name', flat=True)[:HOME_SUBJECTS_COUNT])
+    if not CatalogueCounters.objects.filter(pk=1).update(
+            top_subjects=top_subjects):
+        reconcile_catalogue_counters()
@@ -0,0 +1,212 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_save, pre_delete, post_delete, \
+    post_save
+from django.dispatch import receiver
+
+from comments.models import Comment, COMMENT_TARGET_TYPES
+from materials.catalogue import bump_catalogue_version
+from materials.counters import counted_state, load_counted_state, \
+    move_counted
+from materials.docx_cache import lesson_text_cache, lesson_file_path
+from materials.models import Lesson, Question, Answer, TestPaper, Result, \
+    Subject, Theme, LessonRendition
+from materials.search import index_object, remove_object, index_by_id
+from materials.services import remove_from_test_aggregates, \
+    change_catalogue_counter, refresh_top_subjects, CATALOGUE_MODELS, \
+    remove_from_catalogue_counters, reconcile_catalogue_counters, \
+    CATALOGUE_CASCADE
+from users.models import User
+
+
+@receiver(pre_save, sender=Lesson)
+def invalidate_replaced_lesson_file(sender, instance, **kwargs):
+    """Сбрасывает кэш текста урока, если файл урока был заменён"""
+    if not instance.pk:
+        return
+    old_file = Lesson.objects.filter(
+        pk=instance.pk).values_list('file', flat=True).first()
+    if old_file and old_file != instance.file.name:
+        lesson_text_cache.invalidate(lesson_file_path(old_file))
+
+
+@receiver(post_delete, sender=Lesson)
+def invalidate_deleted_lesson_file(sender, instance, **kwargs):
+    """Сбрасывает кэш текста удалённого урока"""
+    if instance.file:
+        lesson_text_cache.invalidate(lesson_file_path(instance.file))
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def bump_key_version_on_question(sender, instance, **kwargs):
+    """Обновляет версию ключа ответов теста при изменении вопроса"""
+    if instance.test_id:
+        TestPaper.objects.filter(pk=instance.test_id).update(
+            key_version=F('key_version') + 1)
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def bump_key_version_on_answer(sender, instance, **kwargs):
+    """Обновляет версию ключа ответов теста при изменении ответа"""
+    TestPaper.objects.filter(question=instance.question_id).update(
+        key_version=F('key_version') + 1)
+
+
+@receiver(pre_delete, sender=User)
+def remove_user_results(sender, instance, **kwargs):
+    """
+    Исключает результаты удаляемого пользователя из накопленной
+    статистики тестов. У самих результатов обработчиков удаления нет:
+    они удаляются каскадом без загрузки каждого результата.
+    """
+    remove_from_test_aggregates(Result.objects.filter(user=instance))
+
+
+def _counter_field(sender):
+    for field, model in CATALOGUE_MODELS.items():
+        if model is sender:
+            return field
+    return None
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Theme)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=TestPaper)
+def count_created_material(sender, instance, created, raw=False, **kwargs):
+    """Увеличивает счётчик каталога при создании материала"""
+    if raw:
+        return
+    if created:
+        change_catalogue_counter(_counter_field(sender), 1)
+    if sender is Subject:
+        refresh_top_subjects()
+
+
+@receiver(pre_delete, sender=Subject)
+@receiver(pre_delete, sender=Theme)
+@receiver(pre_delete, sender=Lesson)
+@receiver(pre_delete, sender=TestPaper)
+def count_deleted_material(sender, instance, origin=None, **kwargs):
+    """
+    Уменьшает счётчики каталога один раз для всего удаления:
+    при удалении материала - одним запросом вместе с каскадно
+    удаляемыми материалами (для них этот обработчик ничего
+    не делает), при любом другом удалении (queryset, пользователь
+    вместе с его материалами) - пересчётом счётчиков после фиксации
+    транзакции. Пересчёт отмечается в origin, чтобы выполнить его
+    один раз.
+    """
+    if origin is None or origin is instance:
+        remove_from_catalogue_counters(sender, instance.pk)
+    elif isinstance(origin, tuple(CATALOGUE_CASCADE)):
+        return
+    elif not getattr(origin, '_catalogue_recounted', False):
+        origin._catalogue_recounted = True
+        transaction.on_commit(reconcile_catalogue_counters)
+
+
+@receiver(post_delete, sender=Subject)
+def refresh_top_subjects_on_delete(sender, instance, origin=None, **kwargs):
+    """Обновляет список предметов домашней страницы"""
+    if origin is None or origin is instance:
+        refresh_top_subjects()
+
+
+@receiver(pre_save, sender=Theme)
+@receiver(pre_save, sender=Lesson)
+@receiver(pre_save, sender=TestPaper)
+@receiver(pre_save, sender=Comment)
+def remember_counted_state(sender, instance, raw=False, **kwargs):
+    """Запоминает, как сохранённый объект учтён в счётчиках материалов"""
+    if raw or instance._state.adding or instance.pk is None:
+        instance._counted_state = None
+    else:
+        instance._counted_state = load_counted_state(sender, instance.pk)
+
+
+@receiver(post_save, sender=Theme)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=TestPaper)
+@receiver(post_save, sender=Comment)
+def count_saved_object(sender, instance, raw=False, **kwargs):
+    """
+    Обновляет счётчики уроков, тестов и комментариев при создании,
+    публикации, снятии с публикации и переносе объекта
+    """
+    if not raw:
+        move_counted(instance, getattr(instance, '_counted_state', None),
+                     counted_state(instance))
+
+
+@receiver(post_delete, sender=Theme)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=TestPaper)
+@receiver(post_delete, sender=Comment)
+def count_deleted_object(sender, instance, **kwargs):
+    """Обновляет счётчики уроков, тестов и комментариев при удалении"""
+    move_counted(instance, counted_state(instance), None, deleted=True)
+
+
+@receiver(post_delete, sender=Theme)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=TestPaper)
+def delete_target_comments(sender, instance, **kwargs):
+    """Удаляет комментарии к удалённому материалу"""
+    Comment.objects.filter(target_type=COMMENT_TARGET_TYPES[sender],
+                           target_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Theme)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=TestPaper)
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Theme)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=TestPaper)
+def invalidate_catalogue(sender, instance, **kwargs):
+    """
+    Делает устаревшим снимок каталога при изменении материалов:
+    сразу и ещё раз после фиксации транзакции (запрос, прочитавший
+    материалы до фиксации, мог сохранить снимок под новой версией)
+    """
+    bump_catalogue_version()
+    transaction.on_commit(bump_catalogue_version)
+
+
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=Theme)
+@receiver(post_save, sender=Lesson)
+@receiver(post_save, sender=TestPaper)
+def index_material(sender, instance, raw=False, **kwargs):
+    """Обновляет запись поискового индекса при сохранении материала"""
+    if not raw:
+        index_object(instance)
+
+
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=Theme)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_delete, sender=TestPaper)
+def unindex_material(sender, instance, **kwargs):
+    """Удаляет материал из поискового индекса"""
+    remove_object(instance)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def index_test_questions(sender, instance, raw=False, **kwargs):
+    """Обновляет запись индекса теста при изменении вопроса"""
+    if not raw and instance.test_id:
+        index_by_id(TestPaper, instance.test_id)
+
+
+@receiver(post_save, sender=LessonRendition)
+@receiver(post_delete, sender=LessonRendition)
+def index_lesson_file(sender, instance, raw=False, **kwargs):
+    """Обновляет текст файла урока в поисковом индексе"""
+    if not raw:
+        index_by_id(Lesson, instance.lesson_id)
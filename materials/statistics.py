@@ -0,0 +1,127 @@
+from math import sqrt
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+
+from materials.models import ResultAnswer, Answer, TestAggregate
+
+STATISTICS_TIMEOUT = 60 * 60 * 24
+
+
+def _statistics_cache_key(test_id):
+    return f'test_statistics:{test_id}'
+
+
+def _test_totals(test_id):
+    """
+    Суммы по попыткам прохождения теста из накопленной статистики
+    (TestAggregate обновляется в одной транзакции с результатом)
+    """
+    totals = TestAggregate.objects.filter(test_id=test_id).values(
+        'attempts', 'score_sum', 'score_sq_sum').first()
+    return totals or {'attempts': 0, 'score_sum': 0, 'score_sq_sum': 0}
+
+
+def _answer_totals(test_id):
+    """
+    Суммы по вариантам ответа теста одним агрегатным запросом.
+    :return
+    словарь {id ответа: [кол-во выборов,
+    сумма результатов выбравших его пользователей]}
+    """
+    return {row['answer_id']: [row['selected'], row['score_sum']]
+            for row in ResultAnswer.objects.filter(
+                result__test_id=test_id
+            ).order_by().values('answer_id').annotate(
+                selected=Count('id'), score_sum=Sum('result__percentage'))}
+
+
+def _point_biserial(selected, selected_score_sum, state):
+    """
+    Точечно-бисериальная корреляция выбора ответа
+    с итоговым результатом попытки.
+    """
+    attempts = state['attempts']
+    if not selected or selected == attempts:
+        return None
+    mean = state['score_sum'] / attempts
+    variance = state['score_sq_sum'] / attempts - mean ** 2
+    if variance <= 0:
+        return None
+    share = selected / attempts
+    selected_mean = selected_score_sum / selected
+    return (selected_mean - mean) / sqrt(variance) * sqrt(
+        share / (1 - share))
+
+
+def get_test_statistics(test):
+    """
+    Возвращает анализ вопросов теста по всем попыткам его прохождения:
+    - difficulty - доля выбранных верных вариантов ответа
+    (кол-во выборов верных вариантов / (кол-во попыток х
+    кол-во верных вариантов в вопросе));
+    - discrimination - средняя точечно-бисериальная корреляция
+    выбора верных вариантов с итоговым результатом попытки;
+    - для каждого варианта ответа - частота его выбора
+    (для неверных вариантов - частота выбора дистрактора).
+    Суммы по попыткам берутся из накопленной статистики теста,
+    суммы по вариантам ответа пересчитываются одним агрегатным
+    запросом и хранятся в кэше вместе с суммами по попыткам, для
+    которых они посчитаны: пока новых попыток нет, запрос
+    не повторяется. Запись кэша только заменяется целиком,
+    поэтому одновременные запросы не теряют попыток.
+    :arg
+    test -- экземпляр класса TestPaper
+    :return
+    attempts -- количество попыток
+    questions -- список словарей со статистикой по вопросам
+    """
+    cache_key = _statistics_cache_key(test.pk)
+    state = _test_totals(test.pk)
+    cached = cache.get(cache_key)
+    if cached and cached['totals'] == state:
+        answer_totals = cached['answers']
+    else:
+        answer_totals = _answer_totals(test.pk)
+        cache.set(cache_key, {'totals': state, 'answers': answer_totals},
+                  STATISTICS_TIMEOUT)
+
+    attempts = state['attempts']
+    questions = {}
+    for answer in Answer.objects.filter(question__test=test).order_by(
+            'question_id', 'id').values(
+            'id', 'answer_text', 'is_correct',
+            'question_id', 'question__question_text'):
+        question = questions.setdefault(answer['question_id'], {
+            'id': answer['question_id'],
+            'question_text': answer['question__question_text'],
+            'answers': [], 'correct_selected': 0, 'correct_options': 0,
+            'correlations': []})
+        selected, score_sum = answer_totals.get(answer['id'], (0, 0))
+        question['answers'].append({
+            'id': answer['id'],
+            'answer_text': answer['answer_text'],
+            'is_correct': answer['is_correct'],
+            'frequency': selected / attempts if attempts else None})
+        if answer['is_correct']:
+            question['correct_options'] += 1
+            question['correct_selected'] += selected
+            correlation = _point_biserial(selected, score_sum, state)
+            if correlation is not None:
+                question['correlations'].append(correlation)
+
+    for question in questions.values():
+        correct_options = question.pop('correct_options')
+        correct_selected = question.pop('correct_selected')
+        correlations = question.pop('correlations')
+        question['difficulty'] = (
+            correct_selected / (attempts * correct_options)
+            if attempts and correct_options else None)
+        question['discrimination'] = (
+            sum(correlations) / len(correlations) if correlations else None)
+    return attempts, list(questions.values())
+
+
+def reset_test_statistics(test_id):
+    """Сбрасывает накопленную статистику теста"""
+    cache.delete(_statistics_cache_key(test_id))
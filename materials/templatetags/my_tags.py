@@ -3,12 +3,21 @@ import os.path
 from django import template
 
 from config.settings import MEDIA_URL
+from users.thumbnails import avatar_name
 
 register = template.Library()
 
 
 @register.simple_tag()
-def mediapath(val):
+def mediapath(val, size=None, extension='jpg'):
+    """
+    Адрес медиафайла. Для аватара с размером size (см.
+    users.thumbnails.AVATAR_SIZES) возвращается адрес уменьшенной
+    копии в формате extension ('jpg' или 'webp'), пока копия
+    не готова - адрес исходного файла.
+    """
     if val:
+        if size:
+            val = avatar_name(val, size, extension)
         return os.path.join(MEDIA_URL, str(val))
     return os.path.join(MEDIA_URL, 'barbrady.jpg')
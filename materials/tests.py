@@ -1,13 +1,44 @@
-from django.test import TestCase
+import os
+import tempfile
+
+import docx
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db.models import ExpressionWrapper, F, FloatField
+from django.db.models.functions import Cast
+from django.http import QueryDict
+from django.test import TestCase, override_settings
+from django.urls import reverse
 
 from comments.models import Comment
-from materials.models import Subject, Theme, Lesson, TestPaper
+from materials.catalogue import get_catalogue, get_catalogue_version
+from materials.converters import convert_docx
+from materials.counters import recount
+from materials.docx_cache import DocxTextCache
+from materials.pagination import KeysetPaginationMixin
+from materials.query_budget import QueryBudgetTestMixin, query_stats, \
+    UNRESOLVED_URL, QueryRecorder
+from materials.services import save_rendition, create_result, \
+    rebuild_test_aggregates, reconcile_catalogue_counters, \
+    add_to_test_aggregate, remove_from_test_aggregates, delete_results, \
+    get_catalogue_counters
+from materials.search import rebuild_search_index
+from materials.statistics import get_test_statistics
+from comments import urls as comments_urls
+from materials import urls as materials_urls
+from materials.grading import get_answer_key
+from materials.models import Subject, Theme, Lesson, TestPaper, \
+    LessonRendition, Question, Answer, Result, ResultAnswer, TestAggregate, \
+    CatalogueCounters, SearchDocument
+from users import urls as users_urls
 from users.models import User
+from users.services import make_verification_token
 
 
 class SubjectTestCase(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create(
             email='test@mail.ru', is_active=True)
         self.super_user = User.objects.create(
@@ -39,6 +70,36 @@ class SubjectTestCase(TestCase):
         self.assertQuerySetEqual(response.context_data.get('object_list'),
                                  Subject.objects.all())
 
+    def test_subject_list_pages(self):
+        for number in range(25):
+            Subject.objects.create(name=f'subject_{number:02}')
+        response = self.client.get('/subjects/')
+        first_page = response.context_data.get('object_list')
+        self.assertEqual(len(first_page), 20)
+        self.assertEqual(first_page[0].name, 'subject_00')
+
+        # пользователь уже в кэше после первого запроса
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f'/subjects/?{response.context_data["next_page_query"]}')
+        self.assertEqual(
+            [subject.name for subject in
+             response.context_data.get('object_list')],
+            ['subject_20', 'subject_21', 'subject_22', 'subject_23',
+             'subject_24', 'test_subject'])
+
+    def test_home_counters(self):
+        Subject.objects.create(name='test_subject2')
+        Subject.objects.create(name='test_subject3').delete()
+        with self.assertNumQueries(3):
+            response = self.client.get('/')
+        self.assertEqual(response.context.get('subjects_count'), 2)
+        self.assertEqual(response.context.get('subjects'),
+                         ['test_subject', 'test_subject2'])
+
+        CatalogueCounters.objects.filter(pk=1).update(subjects=10)
+        self.assertEqual(reconcile_catalogue_counters().subjects, 2)
+
     def test_subject_detail(self):
         response = self.client.get(f'/subjects/{self.subject.pk}')
         self.assertEqual(response.status_code, 200)
@@ -75,6 +136,7 @@ class SubjectTestCase(TestCase):
 class ThemeTestCase(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create(
             email='test@mail.ru', is_active=True)
         self.super_user = User.objects.create(
@@ -141,6 +203,65 @@ class ThemeTestCase(TestCase):
         self.assertEqual(response.context_data.get('object'),
                          Theme.objects.get(pk=self.theme.pk))
 
+    def test_catalogue(self):
+        cache.clear()
+        self.lesson.is_published = False
+        self.lesson.save()
+        response = self.client.get('/catalogue/')
+        self.assertEqual(response.status_code, 200)
+        theme = response.json()['subjects'][0]['themes'][0]
+        self.assertEqual([lesson['title'] for lesson in theme['lessons']],
+                         ['another_test_lesson'])
+        self.assertEqual([test['title'] for test in theme['tests']],
+                         ['test_test', 'another_test_test'])
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/themes/{self.theme.pk}')
+        self.assertEqual(
+            [lesson['id'] for lesson in response.context_data['lesson_set']],
+            [self.another_lesson.pk])
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/test/list/{self.theme.pk}')
+        self.assertEqual(len(response.context_data['object_list']), 2)
+
+        self.lesson.is_published = True
+        self.lesson.save()
+        response = self.client.get(f'/themes/{self.theme.pk}')
+        self.assertEqual(len(response.context_data['lesson_set']), 2)
+
+        self.client.force_login(user=self.super_user)
+        Lesson.objects.create(title='draft', theme=self.theme)
+        response = self.client.get(f'/subjects/{self.subject.pk}')
+        self.assertEqual(len(response.context_data['theme_set']), 2)
+        response = self.client.get(f'/themes/{self.theme.pk}')
+        self.assertEqual(len(response.context_data['lesson_set']), 3)
+        # запрос несуществующей темы не сбрасывает снимок каталога
+        version = get_catalogue_version()
+        self.assertEqual(
+            self.client.get(f'/test/list/{self.test.pk + 10}').status_code,
+            404)
+        self.assertEqual(get_catalogue_version(), version)
+        # после фиксации транзакции снимок сбрасывается ещё раз
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lesson.save()
+        self.assertEqual(get_catalogue_version(), version + 2)
+
+    def test_object_permissions(self):
+        response = self.client.get(f'/themes/update/{self.another_theme.pk}')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.get(f'/themes/update/{self.theme.pk + 10}')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(f'/questions/create/{self.another_test.pk}')
+        self.assertEqual(response.status_code, 403)
+
+        self.another_test.is_published = False
+        self.another_test.save()
+        response = self.client.get(f'/test/pass/{self.another_test.pk}')
+        self.assertEqual(response.status_code, 403)
+        self.client.force_login(user=self.super_user)
+        response = self.client.get(f'/test/pass/{self.another_test.pk}')
+        self.assertEqual(response.status_code, 200)
+
     def test_theme_update(self):
         data = {'title': 'updated_test_theme',
                 'subject': self.subject.pk}
@@ -265,3 +386,644 @@ class ThemeTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
         self.assertRedirects(response, '/my-tests/')
         self.assertEqual(TestPaper.objects.count(), 1)
+
+
+class DocxTextCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'lesson.docx')
+        document = docx.Document()
+        document.add_paragraph('first paragraph')
+        document.add_paragraph('second paragraph')
+        document.save(self.path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_hits_and_misses(self):
+        cache = DocxTextCache(max_bytes=1024)
+        self.assertEqual(cache.get_paragraphs(self.path),
+                         ['first paragraph', 'second paragraph'])
+        cache.get_paragraphs(self.path)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_modified_file_is_reparsed(self):
+        cache = DocxTextCache(max_bytes=1024)
+        cache.get_paragraphs(self.path)
+        document = docx.Document()
+        document.add_paragraph('new text')
+        document.save(self.path)
+        os.utime(self.path, ns=(0, 0))
+        self.assertEqual(cache.get_paragraphs(self.path), ['new text'])
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_eviction_by_bytes(self):
+        cache = DocxTextCache(max_bytes=40)
+        other_path = os.path.join(self.tmp_dir.name, 'other.docx')
+        document = docx.Document()
+        document.add_paragraph('other lesson text')
+        document.save(other_path)
+        cache.get_paragraphs(self.path)
+        cache.get_paragraphs(other_path)
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertLessEqual(cache.stats()['bytes'], 40)
+
+
+class LessonConversionTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'lesson.docx')
+        document = docx.Document()
+        document.add_heading('Conditionals', level=1)
+        paragraph = document.add_paragraph('Use ')
+        paragraph.add_run('if').bold = True
+        paragraph.add_run(' clauses').italic = True
+        document.add_paragraph('first', style='List Bullet')
+        document.add_paragraph('second', style='List Bullet')
+        table = document.add_table(rows=1, cols=2)
+        table.cell(0, 0).text = 'a < b'
+        table.cell(0, 1).text = 'c'
+        document.save(self.path)
+
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.client.force_login(user=self.user)
+        self.theme = Theme.objects.create(
+            title='test_theme',
+            subject=Subject.objects.create(name='test_subject'),
+            owner=self.user,
+            is_published=True)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_convert_docx(self):
+        rendition = convert_docx(self.path, page_size=50)
+        self.assertIn('<h1>Conditionals</h1>', rendition['html'])
+        self.assertIn('<strong>if</strong><em> clauses</em>',
+                      rendition['html'])
+        self.assertIn('<ul><li>first</li><li>second</li></ul>',
+                      rendition['html'])
+        self.assertIn('<td>a &lt; b</td>', rendition['html'])
+        self.assertIn('Use if clauses', rendition['text'])
+
+    def test_lesson_file_converted_on_upload(self):
+        with open(self.path, 'rb') as file, \
+                override_settings(MEDIA_ROOT=self.tmp_dir.name):
+            data = {'title': 'lesson_with_file',
+                    'theme': self.theme.pk,
+                    'file': SimpleUploadedFile('lesson.docx', file.read())}
+            response = self.client.post('/lessons/create/', data=data)
+            self.assertEqual(response.status_code, 302)
+            lesson = Lesson.objects.get(title='lesson_with_file')
+            self.assertEqual(LessonRendition.objects.get(
+                lesson=lesson).source, lesson.file.name)
+
+            response = self.client.get(f'/lessons/{lesson.pk}')
+            self.assertIn('<h1>Conditionals</h1>',
+                          response.context_data.get('file_html'))
+
+    def test_broken_lesson_file(self):
+        lessons = Lesson.objects.count()
+        with override_settings(MEDIA_ROOT=self.tmp_dir.name):
+            data = {'title': 'broken_lesson', 'theme': self.theme.pk,
+                    'file': SimpleUploadedFile('lesson.docx', b'not docx')}
+            response = self.client.post('/lessons/create/', data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('file', response.context_data['form'].errors)
+        self.assertEqual(Lesson.objects.count(), lessons)
+        self.assertFalse(os.listdir(os.path.join(
+            self.tmp_dir.name, 'lessons')))
+
+    def test_lesson_file_pages(self):
+        lesson = Lesson.objects.create(
+            title='paged_lesson', theme=self.theme, owner=self.user,
+            file='lessons/lesson.docx', is_published=True)
+        save_rendition(lesson, convert_docx(self.path, page_size=2))
+
+        response = self.client.get(f'/lessons/{lesson.pk}?page=2')
+        self.assertEqual(response.context_data.get('file_page').number, 2)
+        self.assertIn('<ul><li>first</li><li>second</li></ul>',
+                      response.context_data.get('file_html'))
+        self.assertNotIn('Conditionals',
+                         response.context_data.get('file_html'))
+
+        response = self.client.get(f'/lessons/{lesson.pk}/page?page=1')
+        self.assertEqual(response.json()['num_pages'], 2)
+        self.assertEqual(response.json()['next_page'], 2)
+        self.assertIn('<h1>Conditionals</h1>', response.json()['html'])
+
+
+class GradingTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.client.force_login(user=self.user)
+        theme = Theme.objects.create(
+            title='test_theme',
+            subject=Subject.objects.create(name='test_subject'),
+            owner=self.user,
+            is_published=True)
+        self.test = TestPaper.objects.create(
+            title='test_test', theme=theme, owner=self.user,
+            is_published=True)
+        self.correct = []
+        self.wrong = []
+        for number in range(2):
+            question = Question.objects.create(
+                question_text=f'question {number}', test=self.test)
+            self.correct.append(Answer.objects.create(
+                answer_text='yes', is_correct=True, question=question))
+            self.wrong.append(Answer.objects.create(
+                answer_text='no', is_correct=False, question=question))
+        self.test.refresh_from_db()
+
+    def test_grade_from_answer_ids(self):
+        answer_key = get_answer_key(self.test)
+        self.assertEqual(answer_key.correct_total, 2)
+        self.assertEqual(answer_key.grade(
+            [self.correct[0].pk, self.wrong[1].pk]), 50)
+        self.assertEqual(answer_key.grade([self.correct[0].pk] * 2), 50)
+        self.assertEqual(answer_key.grade([0, 10 ** 9]), 0)
+
+    def test_answer_key_invalidated_on_change(self):
+        get_answer_key(self.test)
+        self.wrong[1].is_correct = True
+        self.wrong[1].save()
+        self.test.refresh_from_db()
+        self.assertEqual(get_answer_key(self.test).correct_total, 3)
+
+    def test_result_create(self):
+        url = (f'/result/{self.test.pk}?answer={self.correct[0].pk}'
+               f'&answer={self.correct[1].pk}&answer={self.wrong[0].pk}')
+        get_answer_key(self.test)
+        TestAggregate.objects.create(test=self.test)
+        with self.assertNumQueries(10):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Result.objects.get().percentage, 100)
+        self.assertEqual(ResultAnswer.objects.count(), 3)
+        answers = response.context_data['questions'][0]['answers']
+        self.assertTrue(all(answer['user_answer'] for answer in answers))
+
+    def test_statistics(self):
+        create_result(self.test, [self.correct[0].pk, self.correct[1].pk],
+                      self.user)
+        create_result(self.test, [self.wrong[0].pk, self.correct[1].pk],
+                      self.user)
+        attempts, statistics = get_test_statistics(self.test)
+        self.assertEqual(attempts, 2)
+        self.assertEqual(statistics[0]['difficulty'], 0.5)
+        self.assertEqual(statistics[0]['answers'][1]['frequency'], 0.5)
+        self.assertGreater(statistics[0]['discrimination'], 0)
+        self.assertEqual(statistics[1]['difficulty'], 1)
+
+        create_result(self.test, [self.wrong[1].pk], self.user)
+        attempts, statistics = get_test_statistics(self.test)
+        self.assertEqual(attempts, 3)
+        self.assertAlmostEqual(statistics[1]['difficulty'], 2 / 3)
+
+    def test_statistics_out_of_id_order(self):
+        # результат с меньшим id становится виден позже результата
+        # с большим id (транзакция зафиксирована позже)
+        hidden = TestPaper.objects.create(
+            title='hidden', theme=self.test.theme, owner=self.user)
+        late = create_result(self.test, [self.correct[0].pk], self.user)
+        remove_from_test_aggregates(Result.objects.filter(pk=late.pk))
+        Result.objects.filter(pk=late.pk).update(test=hidden)
+        create_result(self.test, [self.wrong[0].pk], self.user)
+        attempts, statistics = get_test_statistics(self.test)
+        self.assertEqual(attempts, 1)
+        self.assertEqual(statistics[0]['difficulty'], 0)
+
+        Result.objects.filter(pk=late.pk).update(test=self.test)
+        add_to_test_aggregate(self.test.pk, late.percentage)
+        attempts, statistics = get_test_statistics(self.test)
+        self.assertEqual(attempts, 2)
+        self.assertEqual(statistics[0]['difficulty'], 0.5)
+
+    def test_aggregate(self):
+        create_result(self.test, [self.correct[0].pk, self.correct[1].pk],
+                      self.user)
+        result = create_result(self.test, [self.correct[1].pk], self.user)
+        aggregate = TestAggregate.objects.get(test=self.test)
+        self.assertEqual(aggregate.attempts, 2)
+        self.assertEqual(aggregate.mean, 75)
+        self.assertEqual(aggregate.best_score, 100)
+        self.assertEqual(aggregate.bucket_5, 1)
+        self.assertEqual(aggregate.bucket_9, 1)
+
+        delete_results(Result.objects.filter(pk=result.pk))
+        aggregate.refresh_from_db()
+        self.assertEqual(aggregate.attempts, 1)
+        self.assertEqual(aggregate.bucket_5, 0)
+        self.assertEqual(aggregate.score_sq_sum, 100 ** 2)
+
+        # результаты удаляемого пользователя исключаются одним запросом
+        # UPDATE и удаляются каскадом без обработчиков каждого результата
+        other = User.objects.create(email='other@mail.ru', is_active=True)
+        for _ in range(3):
+            create_result(self.test, [self.correct[1].pk], other)
+        with QueryRecorder() as recorder:
+            other.delete()
+        self.assertEqual(sum(
+            count for sql, count in recorder.fingerprints.items()
+            if sql.startswith('UPDATE "materials_testaggregate"')), 1)
+        aggregate.refresh_from_db()
+        self.assertEqual((aggregate.attempts, aggregate.score_sum), (1, 100))
+
+        TestAggregate.objects.filter(test=self.test).update(attempts=10)
+        self.assertEqual(rebuild_test_aggregates(), 1)
+        self.assertEqual(
+            TestAggregate.objects.get(test=self.test).attempts, 1)
+
+    def test_result_list_pages(self):
+        for _ in range(25):
+            create_result(self.test, [self.correct[0].pk], self.user)
+        with self.assertNumQueries(3):
+            response = self.client.get('/result/')
+        first_page = response.context_data['object_list']
+        self.assertEqual(len(first_page), 20)
+        self.assertEqual(first_page[0], Result.objects.order_by('id').last())
+
+        response = self.client.get(
+            f'/result/?{response.context_data["next_page_query"]}')
+        second_page = response.context_data['object_list']
+        self.assertEqual(len(second_page), 5)
+        self.assertNotIn('next_page_query', response.context_data)
+        self.assertFalse(set(first_page) & set(second_page))
+
+        response = self.client.get(f'/result/?theme={self.test.theme_id + 1}')
+        self.assertEqual(len(response.context_data['object_list']), 0)
+
+
+class SearchTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.another_user = User.objects.create(
+            email='another@mail.ru', is_active=True)
+        self.client.force_login(user=self.user)
+        self.subject = Subject.objects.create(
+            name='Биология', description='Наука о живой природе')
+        self.theme = Theme.objects.create(
+            title='Растения', subject=self.subject, owner=self.user,
+            is_published=True)
+        self.lesson = Lesson.objects.create(
+            title='Фотосинтез', theme=self.theme, owner=self.user,
+            material='Хлоропласты поглощают свет', is_published=True)
+        self.draft = Lesson.objects.create(
+            title='Черновик', theme=self.theme, owner=self.another_user,
+            material='Хлоропласты и митохондрии')
+        self.test = TestPaper.objects.create(
+            title='Проверка', theme=self.theme, owner=self.user,
+            is_published=True)
+
+    def search(self, query):
+        response = self.client.get('/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return response.context_data['object_list']
+
+    def test_search_visibility(self):
+        hits = self.search('Хлоропласты')
+        self.assertEqual([hit.title for hit in hits], ['Фотосинтез'])
+        self.assertIn('<mark>Хлоропласты</mark>', hits[0].snippet)
+
+        self.client.force_login(user=self.another_user)
+        self.assertEqual(len(self.search('Хлоропласты')), 2)
+        self.assertEqual(self.search(''), [])
+
+    def test_index_updates(self):
+        Question.objects.create(
+            question_text='Где происходит фотосинтез?', test=self.test)
+        self.assertEqual([hit.get_absolute_url() for hit in
+                          self.search('происходит')],
+                         [f'/test/{self.test.pk}'])
+
+        self.lesson.file.name = 'lessons/lesson.docx'
+        save_rendition(self.lesson, {'html': '', 'text': 'Текст из файла'})
+        self.assertEqual(len(self.search('из файла')), 1)
+
+        self.lesson.delete()
+        self.assertEqual(self.search('из файла'), [])
+        self.assertEqual(self.search('Наука')[0].kind, 'subject')
+
+        SearchDocument.objects.all().delete()
+        self.assertEqual(rebuild_search_index(), 4)
+        self.assertEqual(len(self.search('происходит')), 1)
+
+    def test_search_pages(self):
+        for number in range(25):
+            Lesson.objects.create(
+                title=f'Хлоропласты {number}', theme=self.theme,
+                owner=self.user, is_published=True)
+        found, query = [], {'q': 'Хлоропласты'}
+        while query:
+            response = self.client.get('/search/', query)
+            found += response.context_data['object_list']
+            query = response.context_data.get('next_page_query')
+            query = QueryDict(query) if query else None
+        self.assertEqual(len(found), 26)
+        self.assertEqual(len(set(found)), 26)
+
+    def test_rank_cursor_with_ties(self):
+        class RankPaginator(KeysetPaginationMixin):
+            model = SearchDocument
+            keyset_field = 'rank'
+
+        for number in range(25):
+            Lesson.objects.create(title=f'lesson {number}', theme=self.theme)
+        # ранги с совпадающими значениями, которые не представимы
+        # конечной десятичной дробью
+        documents = SearchDocument.objects.annotate(rank=ExpressionWrapper(
+            Cast(F('pk') % 3, FloatField()) / 7, output_field=FloatField()))
+        paginator, found, cursor = RankPaginator(), [], None
+        while True:
+            page, cursor = paginator.get_keyset_page(documents, cursor, 4)
+            found += page
+            if cursor is None:
+                break
+        self.assertEqual(found, list(documents.order_by('-rank', '-pk')))
+        self.assertEqual(len(found), documents.count())
+
+
+class CounterTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.subject = Subject.objects.create(name='test_subject')
+        self.theme = Theme.objects.create(
+            title='test_theme', subject=self.subject, owner=self.user,
+            is_published=True)
+        self.lesson = Lesson.objects.create(
+            title='test_lesson', theme=self.theme, owner=self.user,
+            is_published=True)
+        Lesson.objects.create(
+            title='draft', theme=self.theme, owner=self.user)
+        self.test = TestPaper.objects.create(
+            title='test_test', theme=self.theme, owner=self.user,
+            is_published=True)
+        for _ in range(3):
+            Comment.objects.create(
+                text='comment', user=self.user, target=self.lesson)
+        Comment.objects.create(
+            text='comment', user=self.user, target=self.test)
+
+    def counts(self, obj, *fields):
+        obj.refresh_from_db()
+        return [getattr(obj, field) for field in fields]
+
+    def test_counters(self):
+        self.assertEqual(
+            self.counts(self.subject, 'theme_count', 'lesson_count',
+                        'test_count'), [1, 1, 1])
+        self.assertEqual(
+            self.counts(self.theme, 'lesson_count', 'test_count',
+                        'comment_count'), [1, 1, 0])
+        self.assertEqual(self.counts(self.lesson, 'comment_count'), [3])
+        self.assertEqual(self.counts(self.test, 'comment_count'), [1])
+
+        # сохранение объекта, загруженного до изменения счётчиков,
+        # не перезаписывает их
+        theme = Theme.objects.get(pk=self.theme.pk)
+        Comment.objects.create(text='comment', user=self.user, target=theme)
+        theme.title = 'renamed'
+        theme.save()
+        self.assertEqual(self.counts(self.theme, 'comment_count'), [1])
+
+        # снятие темы с публикации убирает из предмета её уроки и тесты
+        self.theme.is_published = False
+        self.theme.save()
+        self.assertEqual(
+            self.counts(self.subject, 'theme_count', 'lesson_count',
+                        'test_count'), [0, 0, 0])
+        self.theme.is_published = True
+        self.theme.save()
+        self.assertEqual(
+            self.counts(self.subject, 'theme_count', 'lesson_count'), [1, 1])
+
+        self.lesson.is_published = False
+        self.lesson.save()
+        self.assertEqual(self.counts(self.subject, 'lesson_count'), [0])
+        self.lesson.delete()
+        self.test.delete()
+        self.assertEqual(
+            self.counts(self.theme, 'lesson_count', 'test_count'), [0, 0])
+        self.theme.delete()
+        self.assertEqual(
+            self.counts(self.subject, 'theme_count', 'lesson_count',
+                        'test_count'), [0, 0, 0])
+
+    def test_catalogue_counters_on_delete(self):
+        def catalogue():
+            counters = get_catalogue_counters()
+            return [counters.subjects, counters.themes, counters.lessons,
+                    counters.tests]
+
+        other = Subject.objects.create(name='other_subject')
+        Lesson.objects.create(title='other_lesson', theme=Theme.objects.create(
+            title='other_theme', subject=other))
+        self.assertEqual(catalogue(), [2, 2, 3, 1])
+        # предмет удаляется вместе с темой, уроками и тестом:
+        # счётчики каталога уменьшаются одним запросом
+        with QueryRecorder() as recorder:
+            self.subject.delete()
+        self.assertEqual(sum(
+            count for sql, count in recorder.fingerprints.items()
+            if sql.startswith('UPDATE "materials_cataloguecounters"')), 2)
+        self.assertEqual(catalogue(), [1, 1, 1, 0])
+
+        # удаление queryset пересчитывает счётчики после фиксации
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Subject.objects.filter(pk=other.pk).delete()
+        self.assertEqual(callbacks.count(reconcile_catalogue_counters), 1)
+        self.assertEqual(catalogue(), [0, 0, 0, 0])
+
+    def test_recount(self):
+        Theme.objects.update(lesson_count=10, comment_count=10)
+        Subject.objects.update(test_count=5)
+        recount()
+        self.assertEqual(
+            self.counts(self.theme, 'lesson_count', 'comment_count'), [1, 0])
+        self.assertEqual(self.counts(self.subject, 'test_count'), [1])
+
+    def test_list_counts(self):
+        self.client.force_login(user=self.user)
+        response = self.client.get(f'/subjects/{self.subject.pk}')
+        self.assertContains(response, 'Тем: 1 · Уроков: 1 · Тестов: 1')
+        self.assertEqual(response.context_data['theme_set'][0]['lesson_count'],
+                         1)
+
+
+class QueryBudgetTestCase(QueryBudgetTestMixin, TestCase):
+    """
+    Бюджет SQL запросов для каждого url приложений:
+    {имя url: (бюджет, объект для параметра pk)}
+    """
+    routes = {
+        'material:home': (3, None),
+        'material:catalogue': (2, None),
+        'material:search': (2, None),
+        'material:subjects': (3, None),
+        'material:subject_detail': (3, 'subject'),
+        'material:subject_create': (2, None),
+        'material:subject_update': (3, 'subject'),
+        'material:subject_delete': (3, 'subject'),
+        'material:set_published_theme': (7, 'theme'),
+        'material:my_themes': (3, None),
+        'material:themes_create': (3, None),
+        'material:theme_detail': (3, 'theme'),
+        'material:theme_update': (4, 'theme'),
+        'material:theme_delete': (3, 'theme'),
+        'material:lesson_detail': (4, 'lesson'),
+        'material:lesson_page': (4, 'paged_lesson'),
+        'material:set_published_lesson': (10, 'lesson'),
+        'material:lesson_cache_stats': (2, None),
+        'material:lesson_create': (4, None),
+        'material:my_lessons': (3, None),
+        'material:lesson_update': (5, 'lesson'),
+        'material:lesson_delete': (3, 'lesson'),
+        'material:test_create': (4, None),
+        'material:my_tests': (3, None),
+        'material:test_list': (2, 'theme'),
+        'material:test_detail': (12, 'test'),
+        'material:test_update': (5, 'test'),
+        'material:test_delete': (3, 'test'),
+        'material:test_set_published': (9, 'test'),
+        'material:test_passing': (5, 'test'),
+        'material:question_create': (3, 'test'),
+        'material:question_update': (4, 'question'),
+        'material:question_delete': (3, 'question'),
+        'material:result_new': (9, 'test'),
+        'material:my_result': (3, None),
+        'material:result_delete': (3, 'result'),
+        'comments:theme_comments': (4, 'theme'),
+        'comments:test_comments': (4, 'test'),
+        'comments:lesson_comment_page': (4, 'lesson'),
+        'comments:theme_comment_page': (4, 'theme'),
+        'comments:test_comment_page': (4, 'test'),
+        # тестовый клиент работает как WSGI сервер: лента отвечает 204
+        'comments:lesson_comment_stream': (3, 'lesson'),
+        'comments:theme_comment_stream': (3, 'theme'),
+        'comments:test_comment_stream': (3, 'test'),
+        'comments:my_comments': (6, None),
+        'comments:comments_update': (3, 'comment'),
+        'comments:comments_delete': (4, 'comment'),
+        'users:login': (2, None),
+        'users:logout': (4, None),
+        'users:profile': (2, None),
+        'users:profile_edit': (2, None),
+        'users:register': (2, None),
+        'users:verifying': (4, None),
+        'users:confirm_mail': (2, None),
+        'users:reset_done': (2, None),
+        'users:recover_password': (2, None),
+        'users:wrong_mail': (2, None),
+        'users:change_password': (2, None),
+        'users:password_changed': (2, None),
+        'users:login_fail': (2, None),
+    }
+    # url, которые отвечают перенаправлением
+    redirect_routes = {'material:set_published_theme',
+                       'material:set_published_lesson',
+                       'material:test_set_published', 'users:logout'}
+    # url, которые принимают только POST запросы
+    post_routes = {'users:logout'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email='super_user@mail.ru', is_active=True,
+            is_superuser=True, is_staff=True)
+        self.client.force_login(user=self.user)
+        self.subject = Subject.objects.create(name='test_subject')
+        self.theme = Theme.objects.create(
+            title='test_theme', subject=self.subject, owner=self.user,
+            is_published=True)
+        self.lesson = Lesson.objects.create(
+            title='test_lesson', theme=self.theme, owner=self.user,
+            is_published=True)
+        self.paged_lesson = Lesson.objects.create(
+            title='paged_lesson', theme=self.theme, owner=self.user,
+            file='lessons/lesson.docx', is_published=True)
+        save_rendition(self.paged_lesson, {
+            'html': '<p>page</p>', 'text': 'page', 'page_offsets': [0, 11]})
+        self.test = TestPaper.objects.create(
+            title='test_test', theme=self.theme, owner=self.user,
+            is_published=True)
+        answer_ids = []
+        for number in range(5):
+            self.question = Question.objects.create(
+                question_text=f'question {number}', test=self.test)
+            for is_correct in (True, False):
+                answer_ids.append(Answer.objects.create(
+                    answer_text='answer', is_correct=is_correct,
+                    question=self.question).pk)
+        self.test.refresh_from_db()
+        for _ in range(5):
+            self.result = create_result(self.test, answer_ids, self.user)
+            self.comment = Comment.objects.create(
+                text='comment', user=self.user, target=self.lesson)
+            Comment.objects.create(
+                text='comment', user=self.user, target=self.theme)
+            Comment.objects.create(
+                text='comment', user=self.user, target=self.test)
+
+    def get_url(self, name, target):
+        kwargs = {'pk': getattr(self, target).pk} if target else None
+        url = reverse(name, kwargs=kwargs)
+        if name == 'users:verifying':
+            url += '?token=' + make_verification_token(User.objects.create(
+                email='new_user@mail.ru', is_active=False))
+        return url
+
+    def test_every_route_has_budget(self):
+        for namespace, module in (('material', materials_urls),
+                                  ('comments', comments_urls),
+                                  ('users', users_urls)):
+            for pattern in module.urlpatterns:
+                self.assertIn(f'{namespace}:{pattern.name}', self.routes)
+
+    def test_query_budgets(self):
+        for name, (budget, target) in self.routes.items():
+            with self.subTest(name=name):
+                # бюджеты задаются для уже построенного снимка каталога
+                # и вошедшего пользователя (выход его разлогинивает)
+                get_catalogue()
+                self.client.force_login(user=self.user)
+                self.assertQueryBudget(
+                    budget, self.get_url(name, target),
+                    method='post' if name in self.post_routes else 'get',
+                    status=302 if name in self.redirect_routes else None)
+
+    def test_query_stats_by_url_name(self):
+        query_stats.clear()
+        self.client.get(f'/test/{self.test.pk}')
+        stats = query_stats.snapshot()['material:test_detail']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries'], 0)
+        self.client.get('/no-such-page/')
+        self.client.get('/no-such-page/either/')
+        self.assertEqual(
+            query_stats.snapshot()[UNRESOLVED_URL]['requests'], 2)
+
+    async def test_query_stats_async(self):
+        # асинхронный клиент проходит цепочку middleware как ASGI сервер
+        query_stats.clear()
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(
+            f'/comments/lesson/{self.lesson.pk}/stream')
+        await response.streaming_content.aclose()
+        stats = query_stats.snapshot()['comments:lesson_comment_stream']
+        self.assertEqual(stats['requests'], 1)
+        self.assertGreater(stats['queries'], 0)
+        await self.async_client.get(f'/test/{self.test.pk}')
+        stats = query_stats.snapshot()['material:test_detail']
+        self.assertGreater(stats['queries'], 0)
@@ -9,12 +9,15 @@ from materials.views import home, SubjectListView, SubjectDetailView, \
     TestingCreateView, MyTestsView, TestListView, TestDetailView, \
     TestUpdateView, TestDeleteView, set_published_test, TestPassView, \
     QuestionCreateView, QuestionUpdateView, ResultDeleteView, \
-    ResultCreateView, ResultListView, QuestionDeleteView
+    ResultCreateView, ResultListView, QuestionDeleteView, lesson_cache_stats, \
+    lesson_page, catalogue, SearchView
 
 app_name = MaterialsConfig.name
 
 urlpatterns = [
     path('', home, name='home'),  # домашняя страница (корневой url)
+    path('catalogue/', catalogue, name='catalogue'),
+    path('search/', SearchView.as_view(), name='search'),
     # Subject urls
     path('subjects/', SubjectListView.as_view(), name='subjects'),
     path('subjects/<int:pk>', SubjectDetailView.as_view(),
@@ -37,8 +40,11 @@ urlpatterns = [
          name='theme_delete'),
     # Lesson urls
     path('lessons/<int:pk>', LessonDetailView.as_view(), name='lesson_detail'),
+    path('lessons/<int:pk>/page', lesson_page, name='lesson_page'),
     path('lessons/set-published/<int:pk>', set_published_lesson,
          name='set_published_lesson'),
+    path('lessons/cache-stats/', lesson_cache_stats,
+         name='lesson_cache_stats'),
     path('lessons/create/', LessonCreateView.as_view(), name='lesson_create'),
     path('my-lessons/', MyLessonListView.as_view(), name='my_lessons'),
     path('lessons/update/<int:pk>', LessonUpdateView.as_view(),
@@ -1,38 +1,91 @@
-import os
-from datetime import datetime
-
-import docx
-import pytz
 from django.contrib.auth.mixins import LoginRequiredMixin, \
-    PermissionRequiredMixin, UserPassesTestMixin
+    PermissionRequiredMixin
 from django.core import exceptions
+from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Value, FloatField
 from django.forms import inlineformset_factory
+from django.http import JsonResponse, Http404, HttpResponseRedirect
+from django.utils.html import format_html_join
 from django.shortcuts import render, get_object_or_404, redirect
 from django.urls import reverse_lazy, reverse
 from django.views.generic import CreateView, ListView, DetailView, \
     DeleteView, UpdateView, TemplateView
 
+from comments.events import comment_stream_available
 from comments.forms import CommentForm
 from comments.models import Comment
-from config.settings import MEDIA_ROOT, TIME_ZONE
+from comments.services import get_comment_thread, create_comment
+from materials.converters import ConversionError
+from materials.catalogue import get_catalogue_node, visible_children, \
+    catalogue_tree
+from materials.docx_cache import lesson_text_cache
 from materials.forms import SubjectForm, ThemeForm, LessonForm, \
     TestPaperForm, QuestionForm, AnswerForm
 from materials.models import Subject, Theme, Lesson, Question, Answer, \
-    Result, TestPaper
+    Result, TestPaper, SearchDocument
+from materials.grading import parse_answer_ids
+from materials.pagination import KeysetPaginationMixin
+from materials.permissions import ObjectPermissionMixin, is_owner
+from materials.search import search_documents, snippet
+from materials.statistics import get_test_statistics
 from materials.services import check_published, create_result, \
-    get_user_answer_dict
+    get_answer_sheet, convert_lesson_file, get_lesson_file_page, \
+    get_catalogue_counters, delete_results
 
 
 def home(request):
-    """Домашняя страница"""
-    context = {'lessons': Lesson.objects.all().count(),
-               'themes': Theme.objects.all().count(),
-               'subjects': Subject.objects.all()[:5],
-               'subjects_count': Subject.objects.all().count(),
-               'tests_count': TestPaper.objects.all().count()}
+    """
+    Домашняя страница.
+    Количество материалов берётся из счётчиков каталога,
+    поддерживаемых сигналами (один запрос к базе данных).
+    """
+    counters = get_catalogue_counters()
+    context = {'lessons': counters.lessons,
+               'themes': counters.themes,
+               'subjects': counters.top_subjects,
+               'subjects_count': counters.subjects,
+               'tests_count': counters.tests}
     return render(request, 'materials/home.html', context)
 
 
+@login_required
+def catalogue(request):
+    """
+    Возвращает дерево каталога (предметы, темы, уроки и тесты),
+    видимое пользователю, в формате JSON
+    """
+    return JsonResponse({'subjects': catalogue_tree(request.user)})
+
+
+class SearchView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
+    """
+    Поиск по предметам, темам, урокам (включая текст файлов уроков)
+    и тестам (включая вопросы). Возвращает доступные пользователю
+    материалы по убыванию релевантности с фрагментами текста
+    """
+    model = SearchDocument
+    template_name = 'materials/search.html'
+    keyset_field = 'rank'
+
+    def get_search_query(self):
+        return self.request.GET.get('q', '').strip()
+
+    def get_queryset(self):
+        query = self.get_search_query()
+        if not query:
+            return SearchDocument.objects.annotate(
+                rank=Value(0.0, output_field=FloatField())).none()
+        return search_documents(query, self.request.user)
+
+    def get_context_data(self, *args, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['query'] = self.get_search_query()
+        for document in context['object_list']:
+            document.snippet = snippet(document, context['query'])
+        return context
+
+
 # SUBJECT VIEWS ########################################################
 
 class SubjectCreateView(LoginRequiredMixin, PermissionRequiredMixin,
@@ -52,12 +105,15 @@ class SubjectCreateView(LoginRequiredMixin, PermissionRequiredMixin,
         return context
 
 
-class SubjectListView(ListView):
+class SubjectListView(KeysetPaginationMixin, ListView):
     """
     Возвращает список предметов.
     Для персонала есть ссылка на добавление предмета
     """
     model = Subject
+    keyset_field = 'name'
+    keyset_descending = False
+    list_only = ('name', 'theme_count', 'lesson_count', 'test_count')
 
 
 class SubjectDetailView(LoginRequiredMixin, DetailView):
@@ -72,11 +128,11 @@ class SubjectDetailView(LoginRequiredMixin, DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        if self.request.user.is_staff:
-            context['theme_set'] = Theme.objects.filter(subject=self.object)
-        else:
-            context['theme_set'] = Theme.objects.filter(
-                subject=self.object, is_published=True)
+        catalogue, subject = get_catalogue_node('subjects', self.object.pk)
+        if subject is None:
+            raise Http404
+        context['theme_set'] = visible_children(
+            catalogue, subject, 'themes', self.request.user)
         return context
 
 
@@ -154,23 +210,24 @@ def set_published_theme(request, pk):
         else:
             theme.is_published = True
         theme.save()
-        return redirect('material:subject_detail', theme.subject.id)
+        return redirect('material:subject_detail', theme.subject_id)
     raise exceptions.PermissionDenied
 
 
-class MyThemeListView(LoginRequiredMixin, ListView):
+class MyThemeListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """
     Список тем, созданных текущим пользователем
     """
     model = Theme
+    list_select_related = ('subject',)
+    list_only = ('title', 'is_published', 'lesson_count', 'test_count',
+                 'comment_count', 'subject', 'subject__name')
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['object_list'] = Theme.objects.filter(owner=self.request.user)
-        return context
+    def get_queryset(self):
+        return Theme.objects.filter(owner=self.request.user)
 
 
-class ThemeDetailView(LoginRequiredMixin, DetailView):
+class ThemeDetailView(LoginRequiredMixin, ObjectPermissionMixin, DetailView):
     """
     Возвращает заголовок и описание темы,
     а также список всех уроков по этой теме
@@ -179,22 +236,20 @@ class ThemeDetailView(LoginRequiredMixin, DetailView):
     и ссылки на тесты и комментарии по теме
     """
     model = Theme
-
-    def get_object(self, *args, **kwargs):
-        obj = super().get_object(**kwargs)
-        return check_published(obj, self.request.user)
+    permission = 'view'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        if self.request.user.is_staff:
-            context['lesson_set'] = Lesson.objects.filter(theme=self.object)
-        else:
-            context['lesson_set'] = Lesson.objects.filter(
-                theme=self.object, is_published=True)
+        catalogue, theme = get_catalogue_node('themes', self.object.pk)
+        if theme is None:
+            raise Http404
+        context['lesson_set'] = visible_children(
+            catalogue, theme, 'lessons', self.request.user)
         return context
 
 
-class ThemeUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class ThemeUpdateView(LoginRequiredMixin, ObjectPermissionMixin,
+                      UpdateView):
     """
     Редактирование темы
     (доступно только владельцу темы)
@@ -204,11 +259,6 @@ class ThemeUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     template_name = 'materials/subject_form.html'
     success_url = reverse_lazy('material:my_themes')
 
-    def test_func(self):
-        is_owner = Theme.objects.filter(
-            pk=self.kwargs['pk']).last().owner == self.request.user
-        return is_owner
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = 'Тема'
@@ -222,7 +272,8 @@ class ThemeUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return super().form_valid(form)
 
 
-class ThemeDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class ThemeDeleteView(LoginRequiredMixin, ObjectPermissionMixin,
+                      DeleteView):
     """
     Удаление темы
     (доступно только владельцу темы)
@@ -231,11 +282,6 @@ class ThemeDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     success_url = reverse_lazy('material:my_themes')
     template_name = 'materials/confirm_delete.html'
 
-    def test_func(self):
-        is_owner = Theme.objects.filter(
-            pk=self.kwargs['pk']).last().owner == self.request.user
-        return is_owner
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['text'] = f'Хотите удалить тему "{self.object.title}" ' \
@@ -259,77 +305,125 @@ def set_published_lesson(request, pk):
         else:
             lesson.is_published = True
         lesson.save()
-        return redirect('material:theme_detail', lesson.theme.id)
+        return redirect('material:theme_detail', lesson.theme_id)
+    raise exceptions.PermissionDenied
+
+
+def lesson_cache_stats(request):
+    """
+    Возвращает счётчики кэша текста уроков текущего процесса
+    (доступно только персоналу)
+    """
+    if request.user.is_staff:
+        return JsonResponse(lesson_text_cache.stats())
     raise exceptions.PermissionDenied
 
 
-class LessonCreateView(LoginRequiredMixin, CreateView):
+@login_required
+def lesson_page(request, pk):
+    """
+    Возвращает одну страницу материала урока в формате JSON
+    для последовательной подгрузки больших уроков
+    """
+    lesson = get_object_or_404(
+        Lesson.objects.select_related('rendition').defer(
+            'rendition__html', 'rendition__text'), pk=pk)
+    check_published(lesson, request.user)
+    file_page = get_lesson_file_page(lesson, request.GET.get('page'))
+    if not file_page:
+        raise Http404
+    page = file_page['page']
+    html = file_page.get('html')
+    if html is None:
+        html = format_html_join(
+            '\n', '<p class="lead">{}</p>',
+            ((paragraph,) for paragraph in file_page['paragraphs']))
+    return JsonResponse({
+        'page': page.number,
+        'num_pages': page.paginator.num_pages,
+        'next_page': page.next_page_number() if page.has_next() else None,
+        'html': html,
+    })
+
+
+class LessonFormMixin:
+    """
+    Сохраняет урок вместе с представлением его файла в одной
+    транзакции: если файл не удалось конвертировать, урок
+    не сохраняется, а ошибка показывается в форме
+    """
+
+    def form_valid(self, form):
+        try:
+            with transaction.atomic():
+                lesson = form.save()
+                lesson.owner = self.request.user
+                lesson.is_published = False
+                lesson.save()
+                if 'file' in form.changed_data:
+                    convert_lesson_file(lesson)
+        except ConversionError:
+            # загруженный файл не нужен ни одному уроку
+            form.instance.file.delete(save=False)
+            form.add_error('file', 'Не удалось прочитать файл урока: '
+                                   'загрузите документ .docx')
+            return self.form_invalid(form)
+        return super().form_valid(form)
+
+
+class LessonCreateView(LoginRequiredMixin, LessonFormMixin, CreateView):
     """Создание Урока"""
     model = Lesson
     form_class = LessonForm
     template_name = 'materials/subject_form.html'
     success_url = reverse_lazy('material:my_lessons')
 
-    def form_valid(self, form):
-        if form.is_valid():
-            lesson = form.save()
-            lesson.owner = self.request.user
-            lesson.is_published = False
-            lesson.save()
-        return super().form_valid(form)
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = 'Урок'
         return context
 
 
-class MyLessonListView(LoginRequiredMixin, ListView):
+class MyLessonListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """
     Возвращает список уроков, созданных пользователем
     """
     model = Lesson
+    list_select_related = ('theme',)
+    list_only = ('title', 'is_published', 'comment_count', 'theme',
+                 'theme__title')
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['object_list'] = Lesson.objects.filter(owner=self.request.user)
-        return context
+    def get_queryset(self):
+        return Lesson.objects.filter(owner=self.request.user)
 
 
-class LessonDetailView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
+class LessonDetailView(LoginRequiredMixin, ObjectPermissionMixin,
+                       CreateView):
     """
-    Отображает материал урока, все комментарии по нему,
+    Отображает материал урока, первую страницу комментариев к нему,
     форму для создания комментария по уроку
     """
     model = Comment
     form_class = CommentForm
     template_name = 'materials/lesson_detail.html'
+    permission = 'view'
 
-    def test_func(self):
-        if self.request.user == get_object_or_404(
-                Lesson, pk=self.kwargs['pk']).owner\
-                or self.request.user.is_staff:
-            return True
-        else:
-            return get_object_or_404(Lesson, pk=self.kwargs['pk']).is_published
-
-    def get_object(self, *args, **kwargs):
-        obj = super().get_object(**kwargs)
-        if self.request.user == obj.owner:
-            return obj
-        else:
-            return check_published(obj, self.request.user)
+    def get_permission_queryset(self):
+        return Lesson.objects.select_related('rendition').defer(
+            'rendition__html', 'rendition__text')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        lesson = get_object_or_404(Lesson, pk=self.kwargs['pk'])
-        if lesson.file:
-            path = os.path.join(MEDIA_ROOT, str(lesson.file))
-            doc = docx.Document(path)
-            text = []
-            [text.append(paragraph.text) for paragraph in doc.paragraphs]
-            context['file'] = text
-        context['object_list'] = Comment.objects.filter(lesson=lesson)
+        lesson = self.get_permission_object()
+        file_page = get_lesson_file_page(
+            lesson, self.request.GET.get('page'))
+        if file_page:
+            context['file_page'] = file_page['page']
+            context['file_html'] = file_page.get('html')
+            context['file'] = file_page.get('paragraphs')
+        context.update(get_comment_thread(
+            Comment.LESSON, lesson.pk, self.request.GET.get('cursor'),
+            stream=comment_stream_available(self.request)))
         context['lesson'] = lesson
         if lesson.link_video:
             video_str = lesson.link_video.split("/")[3]
@@ -342,20 +436,16 @@ class LessonDetailView(LoginRequiredMixin, UserPassesTestMixin, CreateView):
         return context
 
     def form_valid(self, form):
-        if form.is_valid():
-            comment = form.save()
-            comment.user = self.request.user
-            comment.lesson = Lesson.objects.filter(
-                pk=self.kwargs['pk']).first()
-            comment.date = datetime.now(pytz.timezone(TIME_ZONE))
-            comment.save()
-        return super().form_valid(form)
+        self.object = create_comment(
+            form, self.request.user, Comment.LESSON, self.kwargs['pk'])
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse('material:lesson_detail', args=[self.kwargs.get('pk')])
 
 
-class LessonUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class LessonUpdateView(LoginRequiredMixin, ObjectPermissionMixin,
+                       LessonFormMixin, UpdateView):
     """
     Редактирование урока
     (доступно только владельцу)
@@ -365,26 +455,14 @@ class LessonUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     template_name = 'materials/subject_form.html'
     success_url = reverse_lazy('material:my_lessons')
 
-    def test_func(self):
-        is_owner = Lesson.objects.filter(
-            pk=self.kwargs['pk']).last().owner == self.request.user
-        return is_owner
-
-    def form_valid(self, form):
-        if form.is_valid():
-            lesson = form.save()
-            lesson.owner = self.request.user
-            lesson.is_published = False
-            lesson.save()
-        return super().form_valid(form)
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['title'] = 'Урок'
         return context
 
 
-class LessonDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class LessonDeleteView(LoginRequiredMixin, ObjectPermissionMixin,
+                       DeleteView):
     """
     Удаление урока
     (доступно только владельцу)
@@ -393,11 +471,6 @@ class LessonDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     success_url = reverse_lazy('material:my_lessons')
     template_name = 'materials/confirm_delete.html'
 
-    def test_func(self):
-        is_owner = Lesson.objects.filter(
-            pk=self.kwargs['pk']).last().owner == self.request.user
-        return is_owner
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['text'] = f'Хотите удалить урок "{self.object.title}"?'
@@ -427,16 +500,16 @@ class TestingCreateView(LoginRequiredMixin, CreateView):
         return reverse('material:question_create', args=[self.object.id])
 
 
-class MyTestsView(LoginRequiredMixin, ListView):
+class MyTestsView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """Список тестов, созданных пользователем"""
     model = TestPaper
     template_name = 'testing/my_test_list.html'
+    list_select_related = ('theme__subject',)
+    list_only = ('title', 'is_published', 'comment_count', 'theme',
+                 'theme__title', 'theme__subject', 'theme__subject__name')
 
-    def get_context_data(self, *args, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['object_list'] = TestPaper.objects.filter(
-            owner=self.request.user)
-        return context
+    def get_queryset(self):
+        return TestPaper.objects.filter(owner=self.request.user)
 
 
 class TestListView(LoginRequiredMixin, ListView):
@@ -450,19 +523,21 @@ class TestListView(LoginRequiredMixin, ListView):
     model = TestPaper
     template_name = 'testing/testpaper_list.html'
 
+    def get_queryset(self):
+        catalogue, self.theme = get_catalogue_node(
+            'themes', self.kwargs['pk'])
+        if self.theme is None:
+            raise Http404
+        return visible_children(
+            catalogue, self.theme, 'tests', self.request.user)
+
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['theme'] = Theme.objects.filter(pk=self.kwargs['pk']).first()
-        if self.request.user.is_staff:
-            context['object_list'] = TestPaper.objects.filter(
-                theme=context['theme'])
-        else:
-            context['object_list'] = TestPaper.objects.filter(
-                theme=context['theme'], is_published=True)
+        context['theme'] = self.theme
         return context
 
 
-class TestDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
+class TestDetailView(LoginRequiredMixin, ObjectPermissionMixin, DetailView):
     """
     Возвращает заголовок и описание темы,
     а также список всех уроков по этой теме
@@ -470,25 +545,22 @@ class TestDetailView(LoginRequiredMixin, UserPassesTestMixin, DetailView):
     всех - для персонала)
     и ссылки на тесты и комментарии по теме
     """
-    model = TestPaper
+    queryset = TestPaper.objects.select_related('aggregate')
     template_name = 'testing/testpaper_detail.html'
-
-    def test_func(self):
-        if self.request.user == get_object_or_404(
-                TestPaper, pk=self.kwargs['pk']).owner\
-                or self.request.user.is_staff:
-            return True
-        else:
-            return get_object_or_404(
-                TestPaper, pk=self.kwargs['pk']).is_published
+    permission = 'view'
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['is_owner'] = self.object.owner == self.request.user
+        context['is_owner'] = is_owner(self.object, self.request.user)
+        context['aggregate'] = getattr(self.object, 'aggregate', None)
+        if context['is_owner']:
+            context['attempts'], context['statistics'] = \
+                get_test_statistics(self.object)
         return context
 
 
-class TestUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class TestUpdateView(LoginRequiredMixin, ObjectPermissionMixin,
+                     UpdateView):
     """
     Редактирование теста
     (доступно только владельцу)
@@ -498,11 +570,6 @@ class TestUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     success_url = reverse_lazy('material:my_tests')
     template_name = 'testing/testpaper_form.html'
 
-    def test_func(self):
-        is_owner = TestPaper.objects.filter(
-            pk=self.kwargs['pk']).last().owner == self.request.user
-        return is_owner
-
     def form_valid(self, form):
         if form.is_valid():
             test = form.save()
@@ -512,7 +579,8 @@ class TestUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return super().form_valid(form)
 
 
-class TestDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class TestDeleteView(LoginRequiredMixin, ObjectPermissionMixin,
+                     DeleteView):
     """
     Удаление теста
     (доступно только владельцу)
@@ -521,11 +589,6 @@ class TestDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     success_url = reverse_lazy('material:my_tests')
     template_name = 'testing/testpaper_confirm_delete.html'
 
-    def test_func(self):
-        is_owner = TestPaper.objects.filter(
-            pk=self.kwargs['pk']).last().owner == self.request.user
-        return is_owner
-
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['text'] = f'Хотите удалить тест "{self.object.title}"?'
@@ -546,18 +609,25 @@ def set_published_test(request, pk):
         else:
             test.is_published = True
         test.save()
-        return redirect('material:test_list', test.theme.id)
+        return redirect('material:test_list', test.theme_id)
     raise exceptions.PermissionDenied
 
 
 # QUESTION VIEWS ########################################################
 
-class QuestionCreateView(LoginRequiredMixin, CreateView):
-    """Создание вопроса и ответов к нему"""
+class QuestionCreateView(LoginRequiredMixin, ObjectPermissionMixin,
+                         CreateView):
+    """
+    Создание вопроса и ответов к нему
+    (доступно только владельцу теста)
+    """
     model = Question
     form_class = QuestionForm
     template_name = 'testing/question_form.html'
 
+    def get_permission_queryset(self):
+        return TestPaper.objects.only('id', 'owner', 'is_published')
+
     def get_context_data(self, *args, **kwargs):
         context_data = super().get_context_data(**kwargs)
         context_data['test_pk'] = self.kwargs['pk']
@@ -576,7 +646,7 @@ class QuestionCreateView(LoginRequiredMixin, CreateView):
         formset = self.get_context_data()['formset']
         if form.is_valid():
             question = form.save()
-            question.test = TestPaper.objects.get(pk=self.kwargs.get('pk'))
+            question.test = self.get_permission_object()
             question.save()
             if formset.is_valid():
                 formset.instance = question
@@ -587,7 +657,8 @@ class QuestionCreateView(LoginRequiredMixin, CreateView):
         return reverse('material:question_create', args=[self.kwargs['pk']])
 
 
-class QuestionUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class QuestionUpdateView(LoginRequiredMixin, ObjectPermissionMixin,
+                         UpdateView):
     """
     Редактирование вопроса и ответов
     (доступно только владельцу)
@@ -596,11 +667,10 @@ class QuestionUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
     form_class = QuestionForm
     template_name = 'testing/question_form.html'
 
-    def test_func(self):
-        is_owner = Question.objects.filter(
-            pk=self.kwargs['pk']
-        ).last().test.owner == self.request.user
-        return is_owner
+    owner_attr = 'test__owner_id'
+
+    def get_queryset(self):
+        return Question.objects.select_related('test')
 
     def get_context_data(self, *args, **kwargs):
         context_data = super().get_context_data(**kwargs)
@@ -630,18 +700,18 @@ class QuestionUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
         return reverse('material:test_detail', args=[self.object.test.id])
 
 
-class QuestionDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class QuestionDeleteView(LoginRequiredMixin, ObjectPermissionMixin,
+                         DeleteView):
     """
     Удаление вопроса
     """
     model = Question
     template_name = 'testing/question_confirm_delete.html'
 
-    def test_func(self):
-        is_owner = Question.objects.filter(
-            pk=self.kwargs['pk']
-        ).last().test.owner == self.request.user
-        return is_owner
+    owner_attr = 'test__owner_id'
+
+    def get_queryset(self):
+        return Question.objects.select_related('test')
 
     def get_success_url(self):
         return reverse('material:test_detail', args=[self.object.test.id])
@@ -649,12 +719,13 @@ class QuestionDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
 
 #  TEST PASSING VIEWS ####################################################
 
-class TestPassView(LoginRequiredMixin, DetailView):
+class TestPassView(LoginRequiredMixin, ObjectPermissionMixin, DetailView):
     """
     Страница прохождения теста
     """
-    model = TestPaper
+    queryset = TestPaper.objects.prefetch_related('question_set__answer_set')
     template_name = 'testing/test_passing.html'
+    permission = 'view'
 
 
 class ResultCreateView(LoginRequiredMixin, TemplateView):
@@ -667,30 +738,50 @@ class ResultCreateView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         test = get_object_or_404(TestPaper, pk=self.kwargs['pk'])
-        user_answers = self.request.GET
+        answer_ids = parse_answer_ids(self.request.GET.getlist('answer'))
         context['result'] = create_result(
-            test, user_answers, self.request.user)
-        context['answers'] = get_user_answer_dict(test, user_answers)
+            test, answer_ids, self.request.user)
+        context['questions'] = get_answer_sheet(test, answer_ids)
         context['test'] = test
         return context
 
 
 #  TEST RESULTS VIEWS ###################################################
 
-class ResultListView(LoginRequiredMixin, ListView):
+class ResultListView(LoginRequiredMixin, KeysetPaginationMixin, ListView):
     """
-    Возвращает список всех результатов пользователя
+    Возвращает список результатов пользователя постранично
+    (от новых к старым) с фильтрацией по предмету и теме
     """
     model = Result
     template_name = 'testing/result_list.html'
+    keyset_field = 'date'
+
+    def get_filter_id(self, name):
+        value = self.request.GET.get(name, '')
+        return int(value) if value.isdigit() else None
+
+    def get_queryset(self):
+        queryset = Result.objects.filter(
+            user=self.request.user
+        ).select_related('test__theme__subject')
+        theme_id = self.get_filter_id('theme')
+        if theme_id:
+            queryset = queryset.filter(test__theme_id=theme_id)
+        subject_id = self.get_filter_id('subject')
+        if subject_id:
+            queryset = queryset.filter(test__theme__subject_id=subject_id)
+        return queryset
 
     def get_context_data(self, *args, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['object_list'] = Result.objects.filter(user=self.request.user)
+        context['is_filtered'] = bool(
+            self.get_filter_id('theme') or self.get_filter_id('subject'))
         return context
 
 
-class ResultDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
+class ResultDeleteView(LoginRequiredMixin, ObjectPermissionMixin,
+                       DeleteView):
     """
     Удаление результата
     (доступно только владельцу)
@@ -699,7 +790,11 @@ class ResultDeleteView(LoginRequiredMixin, UserPassesTestMixin, DeleteView):
     success_url = reverse_lazy('material:my_result')
     template_name = 'testing/result_confirm_delete.html'
 
-    def test_func(self):
-        return Result.objects.filter(
-            pk=self.kwargs['pk']
-        ).last().user == self.request.user
+    owner_attr = 'user_id'
+
+    def get_queryset(self):
+        return Result.objects.select_related('test')
+
+    def form_valid(self, form):
+        delete_results(Result.objects.filter(pk=self.object.pk))
+        return HttpResponseRedirect(self.get_success_url())
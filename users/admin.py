@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from users.models import User
+from users.models import User, OutboxEmail
+from users.outbox import requeue
 
 
 @admin.register(User)
@@ -9,3 +10,18 @@ class UserAdmin(admin.ModelAdmin):
     list_display = ('id', 'email', 'is_staff',)
     list_filter = ('is_active', 'is_staff',)
     search_fields = ('email',)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    """Регистрация модели OutboxEmail в админке"""
+    list_display = ('id', 'to', 'subject', 'status', 'attempts',
+                    'next_attempt_at',)
+    list_filter = ('status',)
+    search_fields = ('to',)
+    actions = ('requeue_emails',)
+
+    @admin.action(description='Повторить отправку недоставленных писем')
+    def requeue_emails(self, request, queryset):
+        self.message_user(
+            request, f'Возвращено в очередь писем: {requeue(queryset)}')
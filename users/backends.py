@@ -0,0 +1,138 @@
+import time
+
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache, caches, DEFAULT_CACHE_ALIAS
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.fields.files import FieldFile
+
+from users.models import User
+
+PERMISSIONS_VERSION_KEY = 'users:permissions:version'
+PERMISSIONS_TIMEOUT = 60 * 60
+# кэши, которые не видны другим процессам сервера: сброс записи
+# в одном процессе не доходит до остальных (см. users/checks.py)
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+# поля пользователя, которые не сохраняются в кэше
+UNCACHED_FIELDS = ('password',)
+
+
+def cache_is_shared():
+    """Кэш по умолчанию (CACHES) общий для всех процессов сервера"""
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], PROCESS_LOCAL_CACHES)
+
+
+def _new_version():
+    # начальная версия зависит от времени, чтобы после потери ключа версии
+    # не были прочитаны записи, сохранённые под прежним номером
+    return time.time_ns()
+
+
+def get_permissions_version():
+    """Возвращает текущую версию кэша пользователей и их прав"""
+    version = cache.get(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        cache.add(PERMISSIONS_VERSION_KEY, _new_version(), None)
+        version = cache.get(PERMISSIONS_VERSION_KEY)
+    return version
+
+
+def bump_permissions_version():
+    """
+    Делает устаревшими сохранённых пользователей и права всех
+    пользователей (при изменении групп и прав)
+    """
+    try:
+        cache.incr(PERMISSIONS_VERSION_KEY)
+    except ValueError:
+        cache.add(PERMISSIONS_VERSION_KEY, _new_version(), None)
+
+
+def _user_key(version, user_id):
+    return f'users:user:{version}:{user_id}'
+
+
+def _permissions_key(version, user_id):
+    return f'users:permissions:{version}:{user_id}'
+
+
+def forget_user(user_id):
+    """Удаляет из кэша пользователя и его права"""
+    version = get_permissions_version()
+    cache.delete_many([_user_key(version, user_id),
+                       _permissions_key(version, user_id)])
+
+
+def _cached_fields():
+    return [field.attname for field in User._meta.concrete_fields
+            if field.attname not in UNCACHED_FIELDS]
+
+
+def dump_user(user):
+    """
+    Запись кэша о пользователе: значения полей без пароля
+    и хеш сессии, которым проверяется вход пользователя
+    """
+    fields = {}
+    for name in _cached_fields():
+        value = getattr(user, name)
+        # у файла сохраняется только имя (FieldFile ссылается
+        # на весь экземпляр пользователя)
+        fields[name] = value.name if isinstance(value, FieldFile) else value
+    return {'fields': fields,
+            'session_auth_hash': user.get_session_auth_hash()}
+
+
+def load_user(entry):
+    """
+    Пользователь из записи кэша. Пароль остаётся отложенным полем:
+    он загружается из базы данных при обращении, а save() без
+    update_fields не перезаписывает его.
+    """
+    names = list(entry['fields'])
+    user = User.from_db(DEFAULT_DB_ALIAS, names,
+                        [entry['fields'][name] for name in names])
+    user._cached_session_auth_hash = entry['session_auth_hash']
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend, который хранит пользователя (вместе с признаками
+    is_staff, is_superuser и is_active, но без пароля) и набор его
+    прав в общем для всех процессов кэше. Записи сбрасываются
+    сигналами (users/signals.py): при изменении пользователя, его
+    групп и прав - записи пользователя, при изменении групп и прав -
+    все записи сменой версии. Без изменений проверка прав
+    не выполняет запросов к базе данных.
+    Кэш по умолчанию (LocMemCache) годится только для одного процесса
+    сервера: сброс в одном процессе не виден остальным. Для нескольких
+    процессов нужен общий кэш, иначе проверка
+    manage.py check --deploy выдаёт предупреждение users.W001.
+    """
+
+    def get_user(self, user_id):
+        key = _user_key(get_permissions_version(), user_id)
+        entry = cache.get(key)
+        if entry is None:
+            user = User.objects.filter(pk=user_id).first()
+            if user is None:
+                return None
+            cache.set(key, dump_user(user), PERMISSIONS_TIMEOUT)
+        else:
+            user = load_user(entry)
+        return user if self.user_can_authenticate(user) else None
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or \
+                obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = _permissions_key(get_permissions_version(), user_obj.pk)
+            permissions = cache.get(key)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                cache.set(key, permissions, PERMISSIONS_TIMEOUT)
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
@@ -0,0 +1,27 @@
+from django.core.checks import Warning, register, Tags
+
+from config import settings
+from users.backends import cache_is_shared
+
+CACHED_BACKEND = 'users.backends.CachedModelBackend'
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Предупреждает, что CachedModelBackend и отметки использованных
+    ссылок подтверждения почты (users.services) работают с кэшем,
+    локальным для процесса: при нескольких процессах сервера
+    изменения видны не всем процессам
+    """
+    if CACHED_BACKEND not in settings.AUTHENTICATION_BACKENDS or \
+            cache_is_shared():
+        return []
+    return [Warning(
+        'Пользователи, их права и использованные ссылки подтверждения '
+        'почты хранятся в кэше, локальном для процесса: при нескольких '
+        'процессах сервера они видны не всем процессам.',
+        hint='Укажите общий кэш в CACHE_BACKEND и CACHE_LOCATION '
+             '(например, django.core.cache.backends.redis.RedisCache '
+             'и redis://127.0.0.1:6379).',
+        id='users.W001')]
@@ -1,8 +1,10 @@
 from django import forms
-from django.contrib.auth.forms import UserCreationForm
+from django.contrib.auth.forms import UserCreationForm, PasswordResetForm
+from django.template import loader
 
 from materials.forms import StyleFormMixin
 from users.models import User
+from users.outbox import queue_mail
 
 
 class UserRegisterForm(StyleFormMixin, UserCreationForm):
@@ -15,3 +17,15 @@ class UserProfileForm(StyleFormMixin, forms.ModelForm):
     class Meta:
         model = User
         fields = ('first_name', 'last_name', 'phone', 'avatar', 'city',)
+
+
+class OutboxPasswordResetForm(PasswordResetForm):
+    """Форма сброса пароля, которая ставит письмо в очередь на отправку"""
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        queue_mail(''.join(subject.splitlines()),
+                   loader.render_to_string(email_template_name, context),
+                   to_email, from_email)
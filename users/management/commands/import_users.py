@@ -0,0 +1,42 @@
+import os
+import time
+
+from django.core.management import BaseCommand
+
+from users.services import import_users, read_user_rows, IMPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Создаёт пользователей из файла CSV (с заголовком email,password,
+    first_name,last_name,phone,city) или JSON Lines с теми же ключами.
+    Пароли хешируются параллельно в пуле процессов, пользователи
+    записываются пакетами. По умолчанию пользователи создаются
+    неактивными, и им ставятся в очередь письма для подтверждения
+    почты (отправляет их команда send_outbox).
+    """
+    help = 'Загружает пользователей из файла CSV или JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='путь к файлу .csv или .jsonl')
+        parser.add_argument(
+            '--batch-size', type=int, default=IMPORT_BATCH_SIZE,
+            help='количество пользователей в одном запросе INSERT')
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='количество процессов для хеширования паролей')
+        parser.add_argument(
+            '--no-verify', action='store_true',
+            help='создать активных пользователей без писем '
+                 'для подтверждения почты')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        imported, skipped = import_users(
+            read_user_rows(options['path']), options['batch_size'],
+            options['workers'], verify=not options['no_verify'])
+        seconds = time.perf_counter() - start
+        rate = imported / seconds * 60 if seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено пользователей: {imported}, пропущено строк: '
+            f'{skipped}, время: {seconds:.1f} с ({rate:.0f} в минуту)'))
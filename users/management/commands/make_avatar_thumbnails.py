@@ -0,0 +1,64 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+
+from users.thumbnails import AVATAR_DIR, AVATAR_FORMATS, AVATAR_SIZES, \
+    make_thumbnails, thumbnail_name
+
+
+def is_ready(name):
+    """Все копии аватара существуют и не старше исходного файла"""
+    modified = os.path.getmtime(default_storage.path(name))
+    for size in AVATAR_SIZES:
+        for extension in AVATAR_FORMATS:
+            path = default_storage.path(
+                thumbnail_name(name, size, extension))
+            if not os.path.exists(path) or os.path.getmtime(path) < modified:
+                return False
+    return True
+
+
+class Command(BaseCommand):
+    """
+    Готовит уменьшенные копии уже загруженных аватаров
+    (файлы в media/users/). Изображения обрабатываются
+    параллельно в пуле процессов.
+    """
+    help = 'Готовит уменьшенные копии аватаров из media/users/'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count(),
+            help='количество процессов')
+        parser.add_argument(
+            '--force', action='store_true',
+            help='пересоздать уже подготовленные копии')
+
+    def handle(self, *args, **options):
+        if not default_storage.exists(AVATAR_DIR):
+            self.stdout.write('Нет файлов аватаров')
+            return
+        _, files = default_storage.listdir(AVATAR_DIR)
+        pending = [os.path.join(AVATAR_DIR, filename) for filename in files]
+        if not options['force']:
+            pending = [name for name in pending if not is_ready(name)]
+        if not pending:
+            self.stdout.write('Нет файлов аватаров')
+            return
+
+        done = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {pool.submit(make_thumbnails, name): name
+                       for name in pending}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as error:
+                    self.stderr.write(
+                        f'Не удалось обработать {futures[future]}: {error}')
+                    continue
+                done += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано аватаров: {done} из {len(pending)}'))
@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from users.models import User
+from users.outbox import queue_mails
+from users.services import greeting_email
+
+
+class Command(BaseCommand):
+    """
+    Переводит неподтверждённых пользователей со старыми кодами
+    подтверждения (User.verified_password) на подписанные токены:
+    ставит в очередь новое письмо со ссылкой и удаляет код,
+    после чего старая ссылка перестаёт действовать.
+    """
+    help = 'Заменяет коды подтверждения почты ссылками с токенами'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            users = list(User.objects.select_for_update().filter(
+                is_active=False, verified_password__isnull=False
+            ).only('email'))
+            queue_mails([greeting_email(user) for user in users])
+            User.objects.filter(pk__in=[user.pk for user in users]).update(
+                verified_password=None)
+        self.stdout.write(self.style.SUCCESS(
+            f'Отправлено новых ссылок: {len(users)}'))
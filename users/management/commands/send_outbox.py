@@ -0,0 +1,43 @@
+import time
+
+from django.core.management import BaseCommand
+
+from users.outbox import deliver_outbox, OUTBOX_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    """
+    Отправляет письма из очереди (users.models.OutboxEmail) через
+    одно соединение с почтовым сервером. С параметром --watch
+    работает постоянно, проверяя очередь каждые --interval секунд.
+    """
+    help = 'Отправляет письма из очереди исходящих писем'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=OUTBOX_BATCH_SIZE,
+            help='количество писем, выбираемых одним запросом')
+        parser.add_argument(
+            '--watch', action='store_true',
+            help='не завершать работу, когда очередь пуста')
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='пауза между проверками очереди (в секундах)')
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                sent, failed, dead = deliver_outbox(options['batch_size'])
+            except Exception as error:
+                # почтовый сервер недоступен: письма остаются в очереди
+                if not options['watch']:
+                    raise
+                self.stderr.write(f'Ошибка отправки: {error}')
+            else:
+                if sent or failed or not options['watch']:
+                    self.stdout.write(self.style.SUCCESS(
+                        f'Отправлено писем: {sent}, неудачных попыток: '
+                        f'{failed}, не доставлено: {dead}'))
+            if not options['watch']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_verified_password'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='verified_password',
+            field=models.CharField(blank=True, db_index=True, null=True, verbose_name='ключ для верификации'),
+        ),
+    ]
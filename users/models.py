@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 
 from constants import nullable
 
@@ -13,12 +14,67 @@ class User(AbstractUser):
     city = models.CharField(max_length=100, **nullable, verbose_name='город')
     avatar = models.ImageField(
         upload_to='users/', **nullable, verbose_name='аватар')
+    # код из ссылок подтверждения почты, отправленных до перехода
+    # на подписанные токены (см. команду replace_verification_codes)
     verified_password = models.CharField(
-        verbose_name='ключ для верификации', **nullable)
+        verbose_name='ключ для верификации', db_index=True, **nullable)
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = []
 
+    def get_session_auth_hash(self):
+        # пользователь из кэша (users.backends) загружается без пароля
+        # и с готовым хешем сессии; после set_password хеш вычисляется
+        # заново из нового пароля
+        cached = getattr(self, '_cached_session_auth_hash', None)
+        if cached and 'password' in self.get_deferred_fields():
+            return cached
+        return super().get_session_auth_hash()
+
     class Meta:
         verbose_name = 'пользователь'
         verbose_name_plural = 'пользователи'
+
+
+class OutboxEmail(models.Model):
+    """
+    Письмо, ожидающее отправки. Записывается в той же транзакции,
+    что и изменения, о которых сообщает письмо, и отправляется
+    командой send_outbox (см. users/outbox.py)
+    """
+    PENDING = 'pending'
+    SENT = 'sent'
+    DEAD = 'dead'
+    STATUSES = [
+        (PENDING, 'ожидает отправки'),
+        (SENT, 'отправлено'),
+        (DEAD, 'не доставлено'),
+    ]
+
+    subject = models.CharField(max_length=250, verbose_name='тема')
+    body = models.TextField(verbose_name='текст')
+    from_email = models.CharField(
+        max_length=250, **nullable, verbose_name='отправитель')
+    to = models.EmailField(max_length=250, verbose_name='получатель')
+    status = models.CharField(max_length=10, choices=STATUSES,
+                              default=PENDING, verbose_name='статус')
+    attempts = models.PositiveSmallIntegerField(
+        default=0, verbose_name='попыток отправки')
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now, verbose_name='следующая попытка')
+    last_error = models.TextField(
+        blank=True, default='', verbose_name='последняя ошибка')
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name='создано')
+    sent_at = models.DateTimeField(**nullable, verbose_name='отправлено')
+
+    def __str__(self):
+        return f'{self.to}: {self.subject}'
+
+    class Meta:
+        verbose_name = 'исходящее письмо'
+        verbose_name_plural = 'исходящие письма'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'],
+                         name='outbox_due_idx'),
+        ]
@@ -0,0 +1,165 @@
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from users.models import OutboxEmail
+
+OUTBOX_BATCH_SIZE = 50
+# после стольких неудачных попыток письмо больше не отправляется
+OUTBOX_MAX_ATTEMPTS = 5
+# задержка перед повторной попыткой (в секундах), удваивается
+# с каждой неудачной попыткой, но не превышает OUTBOX_MAX_DELAY
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_MAX_DELAY = 6 * 60 * 60
+UPDATED_FIELDS = ('status', 'attempts', 'next_attempt_at', 'last_error',
+                  'sent_at')
+
+
+def outbox_email(subject, message, recipient, from_email=None):
+    """
+    Создаёт (не сохраняя) письмо очереди.
+    :arg
+    subject -- тема письма
+    message -- текст письма
+    recipient -- адрес получателя
+    from_email -- адрес отправителя (None - DEFAULT_FROM_EMAIL)
+    :return
+    экземпляр класса OutboxEmail
+    """
+    return OutboxEmail(
+        subject=subject, body=message, to=recipient, from_email=from_email)
+
+
+def queue_mail(subject, message, recipient, from_email=None):
+    """
+    Добавляет письмо в очередь на отправку (аргументы - см.
+    outbox_email). Вызывается внутри транзакции запроса: если
+    транзакция откатится, письмо не будет отправлено.
+    :return
+    экземпляр класса OutboxEmail
+    """
+    email = outbox_email(subject, message, recipient, from_email)
+    email.save()
+    return email
+
+
+def queue_mails(emails, batch_size=1000):
+    """
+    Добавляет в очередь письма из outbox_email() запросами INSERT
+    по batch_size писем
+    """
+    return OutboxEmail.objects.bulk_create(emails, batch_size=batch_size)
+
+
+def retry_delay(attempts):
+    """Задержка перед следующей попыткой после attempts неудачных"""
+    return timedelta(seconds=min(
+        OUTBOX_RETRY_DELAY * 2 ** (attempts - 1), OUTBOX_MAX_DELAY))
+
+
+def _send(connection, email, now):
+    """
+    Отправляет одно письмо через открытое соединение и отмечает
+    результат в экземпляре OutboxEmail (без сохранения).
+    :return
+    True, если письмо отправлено
+    """
+    message = EmailMessage(email.subject, email.body, email.from_email,
+                           [email.to], connection=connection)
+    email.attempts += 1
+    try:
+        message.send()
+    except Exception as error:
+        email.last_error = f'{type(error).__name__}: {error}'
+        if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+            email.status = OutboxEmail.DEAD
+        else:
+            email.next_attempt_at = now + retry_delay(email.attempts)
+        return False
+    email.status = OutboxEmail.SENT
+    email.sent_at = now
+    email.last_error = ''
+    return True
+
+
+def _reconnect(connection):
+    """
+    Открывает соединение с почтовым сервером заново (после ошибки
+    отправки оно могло быть разорвано).
+    :return
+    False, если сервер недоступен
+    """
+    try:
+        connection.close()
+        connection.open()
+    except Exception:
+        return False
+    return True
+
+
+def deliver_outbox(batch_size=OUTBOX_BATCH_SIZE, connection=None):
+    """
+    Отправляет все письма очереди, время отправки которых наступило.
+    Письма выбираются пакетами по batch_size; пакет блокируется
+    до конца своей транзакции (в PostgreSQL уже заблокированные
+    другим обработчиком письма пропускаются), результаты пакета
+    записываются одним запросом. Все письма отправляются через
+    одно соединение с почтовым сервером. Неотправленное письмо
+    откладывается с растущей задержкой, а после OUTBOX_MAX_ATTEMPTS
+    попыток получает статус "не доставлено". Если после ошибки
+    не удаётся заново соединиться с сервером, результаты пакета
+    сохраняются, а остальные письма остаются в очереди до следующего
+    запуска.
+    :arg
+    batch_size -- количество писем в пакете
+    connection -- соединение с почтовым сервером
+    (по умолчанию - из настройки EMAIL_BACKEND)
+    :return
+    sent -- количество отправленных писем
+    failed -- количество неудачных попыток
+    dead -- количество писем, которые больше не будут отправляться
+    """
+    connection = connection or get_connection()
+    sent = failed = dead = 0
+    connection.open()
+    connected = True
+    try:
+        while connected:
+            with transaction.atomic():
+                now = timezone.now()
+                batch = list(OutboxEmail.objects.select_for_update(
+                    skip_locked=True
+                ).filter(
+                    status=OutboxEmail.PENDING, next_attempt_at__lte=now
+                ).order_by('next_attempt_at', 'id')[:batch_size])
+                if not batch:
+                    break
+                processed = []
+                for email in batch:
+                    processed.append(email)
+                    if _send(connection, email, now):
+                        sent += 1
+                        continue
+                    failed += 1
+                    dead += email.status == OutboxEmail.DEAD
+                    connected = _reconnect(connection)
+                    if not connected:
+                        break
+                OutboxEmail.objects.bulk_update(processed, UPDATED_FIELDS)
+    finally:
+        connection.close()
+    return sent, failed, dead
+
+
+def requeue(queryset):
+    """
+    Возвращает недоставленные письма в очередь
+    с обнулённым счётчиком попыток
+    :return
+    количество писем
+    """
+    return queryset.filter(status=OutboxEmail.DEAD).update(
+        status=OutboxEmail.PENDING, attempts=0,
+        next_attempt_at=timezone.now())
@@ -1,9 +1,28 @@
+import csv
+import hashlib
+import json
+import os
 import secrets
 import string
+from concurrent.futures import ProcessPoolExecutor
 
-from django.core.mail import send_mail
+from django.contrib.auth.hashers import make_password
+from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction, IntegrityError
 
 from config import settings
+from users.models import User
+from users.outbox import outbox_email, queue_mails
+
+VERIFICATION_SALT = 'users.verification'
+# срок действия ссылки для подтверждения почты (в секундах)
+VERIFICATION_MAX_AGE = 3 * 24 * 60 * 60
+IMPORT_BATCH_SIZE = 1000
+# поля пользователя, которые можно загрузить из файла (кроме пароля)
+IMPORT_FIELDS = ('email', 'first_name', 'last_name', 'phone', 'city')
 
 
 def get_password():
@@ -12,13 +31,240 @@ def get_password():
     return password
 
 
-def greeting_mail(verified_password, email):
-    send_mail(
+def make_verification_token(user):
+    """
+    Подписанный токен для ссылки подтверждения почты: содержит
+    id пользователя и время создания, хранить его не нужно
+    """
+    return signing.dumps(user.pk, salt=VERIFICATION_SALT)
+
+
+def _used_token_key(token):
+    return 'users:verification:' + hashlib.sha256(
+        token.encode()).hexdigest()
+
+
+def check_verification_token(token):
+    """
+    Проверяет токен подтверждения почты без обращения к базе данных:
+    подпись, срок действия и то, что токен ещё не использовался
+    (см. mark_verification_token_used). Повторный переход по ссылке
+    отклоняется здесь только при общем для процессов кэше (CACHES):
+    с локальным кэшем процесса отметка видна одному процессу,
+    и повтор отклоняет проверка пользователя в базе данных.
+    :return
+    id пользователя или None, если токен недействителен
+    """
+    try:
+        user_id = signing.loads(
+            token, salt=VERIFICATION_SALT, max_age=VERIFICATION_MAX_AGE)
+    except signing.BadSignature:
+        return None
+    if not isinstance(user_id, int):
+        return None
+    if cache.get(_used_token_key(token)):
+        return None
+    return user_id
+
+
+def mark_verification_token_used(token):
+    """
+    Запоминает использованный токен до истечения его срока действия.
+    Вызывается после того, как почта подтверждена, поэтому неудачная
+    попытка не делает ссылку недействительной. Отметка видна всем
+    процессам сервера только в общем кэше (CACHES, предупреждение
+    users.W001 в manage.py check --deploy).
+    :return
+    False, если токен уже был отмечен
+    """
+    return cache.add(_used_token_key(token), True, VERIFICATION_MAX_AGE)
+
+
+def greeting_email(user):
+    """Письмо со ссылкой для подтверждения почты (не сохраняется)"""
+    return outbox_email(
         subject='Поздравляем с регистрацией!',
         message=f'Чтобы завершить регистрацию, '
                 f'перейдите по ссылке: '
-                f'http://127.0.0.1:8000/users/verifying?code='
-                f'{verified_password}',
+                f'http://127.0.0.1:8000/users/verifying?token='
+                f'{make_verification_token(user)}',
         from_email=settings.EMAIL_HOST_USER,
-        recipient_list=[email]
+        recipient=user.email
     )
+
+
+def greeting_mail(user):
+    """Ставит в очередь письмо со ссылкой для подтверждения почты"""
+    greeting_email(user).save()
+
+
+def read_user_rows(path):
+    """
+    Читает строки файла пользователей: CSV с заголовком
+    (email,password,first_name,last_name,phone,city) или JSON Lines
+    с теми же ключами.
+    :return
+    генератор словарей (None - строка JSON с ошибкой)
+    """
+    with open(path, encoding='utf-8', newline='') as file:
+        if os.path.splitext(path)[1].lower() == '.csv':
+            yield from csv.DictReader(file)
+            return
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+
+
+def parse_user(row, known):
+    """
+    Проверяет строку файла пользователей.
+    :arg
+    row -- словарь из read_user_rows()
+    known -- {'email': множество, 'phone': множество} уже занятых
+    адресов и телефонов (дополняется данными строки)
+    :return
+    словарь полей пользователя и пароль (None - пароль не задан,
+    пользователь восстановит его по почте) или None, если строка
+    неверна либо почта или телефон заняты
+    """
+    if row is None:
+        return None
+    try:
+        fields = {field: str(row.get(field) or '').strip() or None
+                  for field in IMPORT_FIELDS}
+        password = str(row.get('password') or '') or None
+    except AttributeError:
+        return None
+    if fields['email'] is None:
+        return None
+    fields['email'] = User.objects.normalize_email(fields['email'])
+    try:
+        validate_email(fields['email'])
+    except ValidationError:
+        return None
+    if fields['email'].lower() in known['email'] or (
+            fields['phone'] and fields['phone'] in known['phone']):
+        return None
+    known['email'].add(fields['email'].lower())
+    if fields['phone']:
+        known['phone'].add(fields['phone'])
+    fields['first_name'] = fields['first_name'] or ''
+    fields['last_name'] = fields['last_name'] or ''
+    return fields, password
+
+
+def _insert_users(users, verify):
+    """
+    Сохраняет пользователей одним запросом INSERT и ставит
+    в очередь письма для подтверждения почты
+    """
+    User.objects.bulk_create(users)
+    if verify:
+        if users[0].pk is None:
+            # СУБД не возвращает id созданных записей
+            ids = dict(User.objects.filter(email__in=[
+                user.email for user in users]).values_list('email', 'pk'))
+            for user in users:
+                user.pk = ids[user.email]
+        queue_mails([greeting_email(user) for user in users])
+
+
+def _save_users(batch, hashed, verify):
+    """
+    Сохраняет пакет пользователей одним запросом INSERT в одной
+    транзакции с письмами для подтверждения почты. Если почта или
+    телефон заняты после начала загрузки (например, пользователь
+    зарегистрировался на сайте), пакет сохраняется по одному
+    пользователю, а занятые строки пропускаются.
+    :return
+    imported -- количество созданных пользователей
+    conflicts -- количество пропущенных строк
+    """
+    users = [User(password=password, is_active=not verify, **fields)
+             for (fields, _), password in zip(batch, hashed)]
+    try:
+        with transaction.atomic():
+            _insert_users(users, verify)
+        return len(users), 0
+    except IntegrityError:
+        pass
+    imported = conflicts = 0
+    for user in users:
+        user.pk = None
+        try:
+            with transaction.atomic():
+                _insert_users([user], verify)
+        except IntegrityError:
+            conflicts += 1
+        else:
+            imported += 1
+    return imported, conflicts
+
+
+def import_users(rows, batch_size=IMPORT_BATCH_SIZE, workers=None,
+                 verify=True):
+    """
+    Создаёт пользователей из строк файла (см. read_user_rows).
+    Пароли хешируются (PBKDF2 - основная часть работы) в пуле
+    процессов; пока сохраняется один пакет, пароли следующего уже
+    хешируются. Каждый пакет записывается через bulk_create в своей
+    транзакции вместе с письмами для подтверждения почты.
+    Пользователи с занятыми почтой или телефоном (в том числе
+    занятыми во время загрузки) пропускаются.
+    :arg
+    rows -- итерируемый объект со словарями полей
+    batch_size -- количество пользователей в одном запросе INSERT
+    workers -- количество процессов (None - по числу ядер)
+    verify -- создать неактивных пользователей и отправить им
+    письма для подтверждения почты
+    :return
+    imported -- количество созданных пользователей
+    skipped -- количество пропущенных строк
+    """
+    known = {'email': {email.lower() for email in User.objects.values_list(
+        'email', flat=True)},
+             'phone': set(User.objects.exclude(phone__isnull=True)
+                          .values_list('phone', flat=True))}
+    imported = skipped = 0
+    pending = None
+
+    def save(batch, hashed):
+        nonlocal imported, skipped
+        created, conflicts = _save_users(batch, hashed, verify)
+        imported += created
+        skipped += conflicts
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(batch_size // (workers or os.cpu_count() or 1), 1)
+
+        def start(batch):
+            return batch, pool.map(
+                make_password, [password for _, password in batch],
+                chunksize=chunksize)
+
+        batch = []
+        for row in rows:
+            parsed = parse_user(row, known)
+            if parsed is None:
+                skipped += 1
+                continue
+            batch.append(parsed)
+            if len(batch) >= batch_size:
+                started = start(batch)
+                if pending:
+                    save(*pending)
+                pending = started
+                batch = []
+        if batch:
+            started = start(batch)
+            if pending:
+                save(*pending)
+            pending = started
+        if pending:
+            save(*pending)
+    return imported, skipped
@@ -0,0 +1,72 @@
+from django.contrib.auth.models import Group, Permission
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete, \
+    m2m_changed
+from django.dispatch import receiver
+
+from users.backends import bump_permissions_version, forget_user
+from users.models import User
+from users.thumbnails import submit_thumbnails
+
+
+@receiver(pre_save, sender=User)
+def remember_avatar_upload(sender, instance, **kwargs):
+    """
+    Отмечает, что при сохранении будет записан новый файл аватара
+    (файл ещё не сохранён в хранилище)
+    """
+    instance._avatar_uploaded = bool(
+        instance.avatar) and not instance.avatar._committed
+
+
+@receiver(post_save, sender=User)
+def make_avatar_thumbnails(sender, instance, **kwargs):
+    """
+    Ставит подготовку уменьшенных копий нового аватара в очередь
+    пула потоков после фиксации транзакции
+    """
+    if getattr(instance, '_avatar_uploaded', False):
+        name = instance.avatar.name
+        transaction.on_commit(lambda: submit_thumbnails(name))
+
+
+def _invalidate(func, *args):
+    """
+    Сбрасывает кэш сразу и ещё раз после фиксации транзакции:
+    запрос, прочитавший старые данные до фиксации, мог успеть
+    снова сохранить их в кэш
+    """
+    func(*args)
+    transaction.on_commit(lambda: func(*args))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_changed_user(sender, instance, **kwargs):
+    """Сбрасывает кэш пользователя и его прав"""
+    _invalidate(forget_user, instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def bump_version_on_group(sender, **kwargs):
+    """Сбрасывает кэш прав всех пользователей"""
+    _invalidate(bump_permissions_version)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def forget_user_on_membership(sender, instance, action, **kwargs):
+    """
+    Сбрасывает кэш прав пользователя при изменении его групп и прав
+    (при изменении со стороны группы или права - кэш всех пользователей)
+    """
+    if not action.startswith('post_'):
+        return
+    if isinstance(instance, User):
+        _invalidate(forget_user, instance.pk)
+    else:
+        _invalidate(bump_permissions_version)
@@ -1,5 +1,65 @@
-from django.test import TestCase
-from users.models import User
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, Permission
+from django.core import mail, signing
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from materials.query_budget import QueryRecorder
+from users.models import User, OutboxEmail
+from users.outbox import deliver_outbox, OUTBOX_MAX_ATTEMPTS, queue_mail
+from users.backends import get_permissions_version
+from users.checks import check_shared_cache
+from users.services import make_verification_token, VERIFICATION_SALT, \
+    VERIFICATION_MAX_AGE, parse_user, _save_users
+from users.thumbnails import thumbnail_name, submit_thumbnails
+
+
+class StandInEmailBackend(locmem.EmailBackend):
+    """
+    Почтовый сервер для тестов: считает открытые соединения
+    и не принимает письма на адреса, начинающиеся с "fail"
+    """
+    opened = 0
+
+    def open(self):
+        StandInEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if message.to[0].startswith('fail'):
+                raise ConnectionError('recipient refused')
+        return super().send_messages(messages)
+
+
+class UnreachableEmailBackend(StandInEmailBackend):
+    """Почтовый сервер, который после первого соединения недоступен"""
+
+    def open(self):
+        if StandInEmailBackend.opened:
+            raise ConnectionRefusedError('server unavailable')
+        return super().open()
+
+
+class ExpiredSigner(signing.TimestampSigner):
+    """Подписывает данные временем, после которого срок токена истёк"""
+
+    def timestamp(self):
+        return signing.b62_encode(int(time.time()) - VERIFICATION_MAX_AGE - 1)
 
 
 class HabitTestCase(TestCase):
@@ -80,3 +140,379 @@ class HabitTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.context.get('title'),
                          'Пожалуйста, подтвердите почту.')
+
+
+@override_settings(EMAIL_BACKEND='users.tests.StandInEmailBackend')
+class OutboxTestCase(TestCase):
+
+    def setUp(self):
+        StandInEmailBackend.opened = 0
+
+    def test_register_queues_mail(self):
+        data = {'email': 'new_user@mail.ru',
+                'password1': 'fysq[eqdhjnntcnsnbkznmtfnm',
+                'password2': 'fysq[eqdhjnntcnsnbkznmtfnm'}
+        self.client.post('/users/register/', data=data)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to, 'new_user@mail.ru')
+        self.assertIn('/users/verifying?token=', email.body)
+
+        call_command('send_outbox', stdout=open(os.devnull, 'w'))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['new_user@mail.ru'])
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.SENT)
+
+    def test_reset_queues_mail(self):
+        user = User.objects.create(email='test@mail.ru', is_active=True)
+        user.set_password('test_password')
+        user.save()
+        self.client.post('/users/recover-password/',
+                         data={'email': user.email})
+        self.client.post('/users/recover-password/',
+                         data={'email': user.email})
+        bodies = OutboxEmail.objects.order_by('id').values_list(
+            'body', flat=True)
+        self.assertEqual(len(bodies), 2)
+        # у каждого запроса свой пароль
+        self.assertNotEqual(bodies[0], bodies[1])
+        user.refresh_from_db()
+        self.assertTrue(user.check_password(
+            bodies[1].rsplit(' ', 1)[1]))
+
+    def test_batches_share_connection(self):
+        for number in range(5):
+            queue_mail('subject', 'text', f'user{number}@mail.ru')
+        self.assertEqual(deliver_outbox(batch_size=2), (5, 0, 0))
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(StandInEmailBackend.opened, 1)
+
+    def test_retry_and_dead_letter(self):
+        failing = queue_mail('subject', 'text', 'fail@mail.ru')
+        queue_mail('subject', 'text', 'user@mail.ru')
+        self.assertEqual(deliver_outbox(), (1, 1, 0))
+        failing.refresh_from_db()
+        self.assertEqual((failing.status, failing.attempts),
+                         (OutboxEmail.PENDING, 1))
+        self.assertGreater(failing.next_attempt_at, timezone.now())
+        self.assertIn('recipient refused', failing.last_error)
+        # повтор откладывается до next_attempt_at
+        self.assertEqual(deliver_outbox(), (0, 0, 0))
+
+        OutboxEmail.objects.filter(pk=failing.pk).update(
+            attempts=OUTBOX_MAX_ATTEMPTS - 1,
+            next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(deliver_outbox(), (0, 1, 1))
+        failing.refresh_from_db()
+        self.assertEqual(failing.status, OutboxEmail.DEAD)
+        self.assertEqual(deliver_outbox(), (0, 0, 0))
+
+    def test_server_unavailable(self):
+        emails = [queue_mail('subject', 'text', recipient) for recipient in
+                  ('user0@mail.ru', 'fail@mail.ru', 'user1@mail.ru')]
+        self.assertEqual(deliver_outbox(
+            connection=UnreachableEmailBackend()), (1, 1, 0))
+        # результаты пакета сохранены, оставшееся письмо ждёт в очереди
+        statuses = [(email.status, email.attempts) for email in
+                    OutboxEmail.objects.order_by('id')]
+        self.assertEqual(statuses, [(OutboxEmail.SENT, 1),
+                                    (OutboxEmail.PENDING, 1),
+                                    (OutboxEmail.PENDING, 0)])
+        self.assertEqual(deliver_outbox(), (1, 0, 0))
+        self.assertEqual([message.to for message in mail.outbox],
+                         [[emails[0].to], [emails[2].to]])
+
+
+class VerificationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=False)
+
+    def test_token(self):
+        token = make_verification_token(self.user)
+        with QueryRecorder() as recorder:
+            response = self.client.get('/users/verifying/', {'token': token})
+        self.assertEqual(response.context['title'], 'Добро пожаловать!')
+        self.assertEqual(recorder.count, 2)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+
+        # повторный переход по ссылке
+        with QueryRecorder() as recorder:
+            response = self.client.get('/users/verifying/', {'token': token})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(recorder.count, 0)
+
+        # без отметки в кэше (локальный кэш другого процесса) повтор
+        # отклоняется по базе данных
+        cache.clear()
+        response = self.client.get('/users/verifying/', {'token': token})
+        self.assertEqual(response.status_code, 400)
+
+    def test_token_used_after_update(self):
+        token = make_verification_token(self.user)
+        with mock.patch.object(User, 'save', side_effect=DatabaseError), \
+                self.assertRaises(DatabaseError):
+            self.client.get('/users/verifying/', {'token': token})
+        # неудачная попытка не делает ссылку недействительной
+        response = self.client.get('/users/verifying/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_invalid_token(self):
+        token = make_verification_token(self.user)
+        expired = ExpiredSigner(salt=VERIFICATION_SALT).sign_object(
+            self.user.pk)
+        for response in (
+                self.client.get('/users/verifying/', {'token': expired}),
+                self.client.get('/users/verifying/', {'token': token + 'x'}),
+                self.client.get('/users/verifying/')):
+            self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+
+    def test_replace_codes(self):
+        self.user.verified_password = 'old_code'
+        self.user.save()
+        call_command('replace_verification_codes',
+                     stdout=open(os.devnull, 'w'))
+        email = OutboxEmail.objects.get()
+        self.assertIn('token=', email.body)
+        response = self.client.get('/users/verifying/', {'code': 'old_code'})
+        self.assertEqual(response.status_code, 400)
+        token = email.body.rsplit('token=', 1)[1]
+        response = self.client.get('/users/verifying/', {'token': token})
+        self.assertEqual(response.status_code, 200)
+
+    def test_legacy_code(self):
+        self.user.verified_password = 'old_code'
+        self.user.save()
+        response = self.client.get('/users/verifying/', {'code': 'old_code'})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_active)
+        self.assertIsNone(self.user.verified_password)
+
+
+class AvatarTestCase(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(MEDIA_ROOT=self.tmp_dir.name)
+        self.settings.enable()
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True)
+        self.client.force_login(user=self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.tmp_dir.cleanup()
+
+    def test_upload(self):
+        content = io.BytesIO()
+        Image.new('RGB', (2000, 1000), 'red').save(content, 'JPEG')
+        avatar = SimpleUploadedFile(
+            'photo.jpg', content.getvalue(), content_type='image/jpeg')
+        futures = []
+
+        def submit(name):
+            futures.append(submit_thumbnails(name))
+            return futures[-1]
+
+        with mock.patch('users.signals.submit_thumbnails',
+                        side_effect=submit) as submitted, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/users/profile_edit/', data={'avatar': avatar})
+        name = User.objects.get(pk=self.user.pk).avatar.name
+        submitted.assert_called_once_with(name)
+        self.assertEqual(len(futures[0].result()), 6)
+
+        webp = thumbnail_name(name, 512, 'webp')
+        with Image.open(os.path.join(self.tmp_dir.name, webp)) as image:
+            self.assertEqual((image.format, image.size), ('WEBP', (512, 256)))
+        with Image.open(os.path.join(
+                self.tmp_dir.name, thumbnail_name(name, 48))) as image:
+            self.assertEqual((image.format, image.size), ('JPEG', (48, 24)))
+        response = self.client.get('/users/profile/')
+        self.assertContains(response, thumbnail_name(name, 512, 'webp'))
+
+        # сохранение профиля без нового файла копии не создаёт
+        with mock.patch('users.signals.submit_thumbnails') as submitted, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/users/profile_edit/', data={'city': 'Омск'})
+        submitted.assert_not_called()
+
+    def test_backfill(self):
+        os.makedirs(os.path.join(self.tmp_dir.name, 'users'))
+        Image.new('RGBA', (100, 300)).save(
+            os.path.join(self.tmp_dir.name, 'users', 'old.png'))
+        output = io.StringIO()
+        call_command('make_avatar_thumbnails', '--workers=1', stdout=output)
+        self.assertIn('Обработано аватаров: 1 из 1', output.getvalue())
+        with Image.open(os.path.join(self.tmp_dir.name, thumbnail_name(
+                'users/old.png', 128))) as image:
+            self.assertEqual(image.size, (43, 128))
+
+        output = io.StringIO()
+        call_command('make_avatar_thumbnails', stdout=output)
+        self.assertIn('Нет файлов', output.getvalue())
+
+
+class PermissionCacheTestCase(TestCase):
+
+    def setUp(self):
+        # файловый кэш - общий для процессов, в отличие от LocMemCache
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': self.cache_dir.name}})
+        self.settings.enable()
+        self.group = Group.objects.create(name='moderators')
+        self.group.permissions.add(
+            Permission.objects.get(codename='add_subject'))
+        self.user = User.objects.create(
+            email='test@mail.ru', is_active=True, is_staff=True)
+        self.user.groups.add(self.group)
+        self.client.force_login(user=self.user)
+
+    def tearDown(self):
+        self.settings.disable()
+        self.cache_dir.cleanup()
+
+    def get_create_page(self):
+        with QueryRecorder() as recorder:
+            response = self.client.get('/subjects/create/')
+        auth_queries = [sql for sql in recorder.fingerprints
+                        if 'users_user' in sql or 'auth_' in sql]
+        return response.status_code, auth_queries
+
+    def test_cached_permissions(self):
+        status, auth_queries = self.get_create_page()
+        self.assertEqual(status, 200)
+        self.assertTrue(auth_queries)
+        status, auth_queries = self.get_create_page()
+        self.assertEqual(status, 200)
+        self.assertEqual(auth_queries, [])
+
+    def test_group_change(self):
+        self.get_create_page()
+        self.group.permissions.clear()
+        self.assertEqual(self.get_create_page()[0], 403)
+        self.group.permissions.add(
+            Permission.objects.get(codename='add_subject'))
+        self.assertEqual(self.get_create_page()[0], 200)
+
+    def test_user_change(self):
+        self.get_create_page()
+        self.user.groups.remove(self.group)
+        self.assertEqual(self.get_create_page()[0], 403)
+
+        self.user.is_staff = False
+        self.user.save()
+        response = self.client.get('/subjects/')
+        self.assertFalse(response.context['user'].is_staff)
+
+    def test_cached_user(self):
+        self.user.set_password('old_password')
+        self.user.save()
+        self.client.force_login(user=self.user)
+        self.get_create_page()
+        # пароль в кэш не попадает
+        entry = cache.get(f'users:user:{get_permissions_version()}:'
+                          f'{self.user.pk}')
+        self.assertNotIn('password', entry['fields'])
+        self.assertNotIn(self.user.password, str(entry))
+
+        # сохранение пользователя из кэша не затирает пароль
+        self.client.post('/users/profile_edit/', data={'city': 'Омск'})
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual(user.city, 'Омск')
+        self.assertTrue(user.check_password('old_password'))
+
+        # после смены пароля сессия остаётся действительной
+        response = self.client.post('/users/password/', data={
+            'old_password': 'old_password',
+            'new_password1': 'skdfjhlskdjfhlkjdhfkjhks',
+            'new_password2': 'skdfjhlskdjfhlkjdhfkjhks'})
+        self.assertRedirects(response, '/users/password_changed/')
+        self.assertEqual(self.get_create_page()[0], 200)
+
+    def test_process_local_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
+        self.settings.disable()
+        try:
+            warnings = check_shared_cache(None)
+        finally:
+            self.settings.enable()
+        self.assertEqual([warning.id for warning in warnings],
+                         ['users.W001'])
+
+
+class UserImportTestCase(TestCase):
+
+    def setUp(self):
+        User.objects.create(email='old@mail.ru', phone='111')
+
+    def import_file(self, suffix, content, *args):
+        with tempfile.NamedTemporaryFile(
+                'w', suffix=suffix, encoding='utf-8') as file:
+            file.write(content)
+            file.flush()
+            output = io.StringIO()
+            call_command('import_users', file.name, '--batch-size=2',
+                         '--workers=2', *args, stdout=output)
+        return output.getvalue()
+
+    def test_csv(self):
+        output = self.import_file('.csv', '\n'.join([
+            'email,password,first_name,last_name,phone,city',
+            'first@mail.ru,secret_1,Иван,Иванов,222,Омск',
+            'second@mail.ru,secret_2,,,,',
+            'third@mail.ru,,,,,',
+            'OLD@mail.ru,secret,,,,',
+            'other@mail.ru,secret,,,111,',
+            'first@mail.ru,secret,,,,',
+            'не почта,secret,,,,',
+        ]))
+        self.assertIn('Загружено пользователей: 3, пропущено строк: 4',
+                      output)
+        first = User.objects.get(email='first@mail.ru')
+        self.assertEqual((first.last_name, first.city), ('Иванов', 'Омск'))
+        self.assertTrue(first.check_password('secret_1'))
+        self.assertFalse(first.is_active)
+        self.assertFalse(User.objects.get(
+            email='third@mail.ru').has_usable_password())
+
+        emails = OutboxEmail.objects.order_by('to')
+        self.assertEqual([email.to for email in emails],
+                         ['first@mail.ru', 'second@mail.ru',
+                          'third@mail.ru'])
+        token = emails[0].body.rsplit('token=', 1)[1]
+        self.client.get('/users/verifying/', {'token': token})
+        first.refresh_from_db()
+        self.assertTrue(first.is_active)
+
+    def test_jsonl(self):
+        output = self.import_file('.jsonl', '\n'.join([
+            json.dumps({'email': 'first@mail.ru', 'password': 'secret_1'}),
+            'не json',
+            json.dumps(['first@mail.ru']),
+        ]), '--no-verify')
+        self.assertIn('Загружено пользователей: 1, пропущено строк: 2',
+                      output)
+        self.assertTrue(User.objects.get(email='first@mail.ru').is_active)
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_registered_during_import(self):
+        known = {'email': set(), 'phone': set()}
+        batch = [parse_user({'email': email}, known) for email in
+                 ('first@mail.ru', 'old@mail.ru', 'second@mail.ru')]
+        # почта old@mail.ru занята после проверки строк файла
+        hashed = [make_password(None)] * 3
+        self.assertEqual(_save_users(batch, hashed, verify=True), (2, 1))
+        self.assertEqual(
+            sorted(OutboxEmail.objects.values_list('to', flat=True)),
+            ['first@mail.ru', 'second@mail.ru'])
+        self.assertEqual(User.objects.count(), 3)
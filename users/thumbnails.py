@@ -0,0 +1,103 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# наибольшая сторона уменьшенных копий аватара (в пикселях)
+AVATAR_SIZES = (48, 128, 512)
+# {расширение файла: (формат Pillow, параметры сохранения)}
+AVATAR_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+AVATAR_DIR = 'users'
+THUMBNAIL_DIR = 'thumbs'
+# потоки, в которых готовятся копии загруженных аватаров
+# (Pillow освобождает GIL при декодировании, масштабировании и сжатии)
+AVATAR_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+
+def thumbnail_name(name, size, extension='jpg'):
+    """
+    Имя файла уменьшенной копии аватара в хранилище
+    (расширение исходного файла сохраняется, чтобы копии
+    photo.png и photo.jpg не совпадали):
+    users/photo.png -> users/thumbs/photo.png.128.webp
+    :arg
+    name -- имя исходного файла в хранилище
+    size -- размер из AVATAR_SIZES
+    extension -- расширение из AVATAR_FORMATS
+    """
+    directory, filename = os.path.split(str(name))
+    return os.path.join(directory, THUMBNAIL_DIR,
+                        f'{filename}.{size}.{extension}')
+
+
+def make_thumbnails(name):
+    """
+    Готовит уменьшенные копии аватара всех размеров и форматов.
+    Изображение поворачивается по данным EXIF и уменьшается
+    с сохранением пропорций (маленькие изображения не увеличиваются);
+    каждая следующая копия получается из предыдущей, большей.
+    Файлы записываются под временным именем и затем переименовываются,
+    поэтому страница никогда не получает недописанный файл.
+    Функция выполняется и в пуле потоков, и в пуле процессов.
+    :arg
+    name -- имя исходного файла в хранилище
+    :return
+    список имён созданных файлов
+    """
+    created = []
+    with Image.open(default_storage.path(name)) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft('RGB', (max(AVATAR_SIZES), max(AVATAR_SIZES)))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        for size in sorted(AVATAR_SIZES, reverse=True):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for extension, (image_format, params) in AVATAR_FORMATS.items():
+                thumbnail = thumbnail_name(name, size, extension)
+                path = default_storage.path(thumbnail)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temporary = f'{path}.{os.getpid()}.tmp'
+                image.save(temporary, image_format, **params)
+                os.replace(temporary, path)
+                created.append(thumbnail)
+    return created
+
+
+@lru_cache(maxsize=None)
+def thumbnail_pool():
+    """Пул потоков для подготовки копий загруженных аватаров"""
+    return ThreadPoolExecutor(max_workers=AVATAR_WORKERS,
+                              thread_name_prefix='avatar')
+
+
+def submit_thumbnails(name):
+    """
+    Ставит подготовку копий аватара в очередь пула потоков.
+    :return
+    объект Future со списком созданных файлов
+    """
+    future = thumbnail_pool().submit(make_thumbnails, name)
+    future.add_done_callback(lambda done: done.exception() and logger.error(
+        'Не удалось подготовить копии аватара %s: %s', name,
+        done.exception()))
+    return future
+
+
+def avatar_name(name, size, extension='jpg'):
+    """
+    Имя файла копии аватара нужного размера или, если копия ещё
+    не готова, имя исходного файла
+    """
+    thumbnail = thumbnail_name(name, size, extension)
+    if default_storage.exists(thumbnail):
+        return thumbnail
+    return str(name)
@@ -1,22 +1,51 @@
 from django.contrib.auth.views import PasswordResetView, \
     PasswordResetDoneView, PasswordChangeView
 from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.http import HttpResponseRedirect
 from django.shortcuts import render, redirect
 from django.urls import reverse_lazy, reverse
 from django.views.generic import CreateView, DetailView, UpdateView
 
 from config import settings
-from users.forms import UserRegisterForm, UserProfileForm
+from users.forms import UserRegisterForm, UserProfileForm, \
+    OutboxPasswordResetForm
 from users.models import User
-from users.services import get_password, greeting_mail
+from users.services import get_password, greeting_mail, \
+    check_verification_token, mark_verification_token_used
 
 
 def verify_view(request):
-    """Сообщает об успешном подтверждении почты"""
+    """
+    Подтверждает почту по ссылке из письма. Ссылка содержит
+    подписанный токен с id пользователя: недействительный,
+    просроченный или уже использованный токен отклоняется без
+    обращения к базе данных, пользователь ищется по id среди
+    ещё не подтвердивших почту. Токен отмечается использованным
+    после сохранения пользователя.
+    Ссылки с кодом (code), отправленные до перехода на токены,
+    действуют, пока коды не заменены командой
+    replace_verification_codes.
+    """
+    user = None
+    token = request.GET.get('token', '')
+    user_id = check_verification_token(token)
     code = request.GET.get('code')
-    user = User.objects.get(verified_password=code)
+    if user_id is not None:
+        user = User.objects.filter(pk=user_id, is_active=False).first()
+    elif code:
+        user = User.objects.filter(verified_password=code).first()
+    if user is None:
+        context = {'title': 'Ссылка недействительна',
+                   'text': 'Срок действия ссылки истёк, или она уже '
+                           'была использована.'}
+        return render(request, 'users/information.html', context,
+                      status=400)
     user.is_active = True
-    user.save()
+    user.verified_password = None
+    user.save(update_fields=['is_active', 'verified_password'])
+    if user_id is not None:
+        mark_verification_token_used(token)
     context = {'title': 'Добро пожаловать!',
                'text': 'Почта успешно подтверждена'}
     return render(request, 'users/information.html', context)
@@ -67,12 +96,14 @@ class RegisterView(CreateView):
     extra_context = {'title': 'Регистрация', 'button': 'Сохранить'}
     success_url = reverse_lazy('users:confirm_mail')
 
+    @transaction.atomic
     def form_valid(self, form):
-        new_user = form.save()
-        new_user.verified_password = get_password()
+        new_user = form.save(commit=False)
         new_user.is_active = False
-        greeting_mail(new_user.verified_password, new_user.email)
-        return super().form_valid(form)
+        new_user.save()
+        greeting_mail(new_user)
+        self.object = new_user
+        return HttpResponseRedirect(self.get_success_url())
 
 
 class UserProfileView(DetailView):
@@ -95,10 +126,9 @@ class EditProfileView(UpdateView):
 
 
 class UserPasswordResetView(PasswordResetView):
+    form_class = OutboxPasswordResetForm
     email_template_name = 'users/reset.html'
     from_email = settings.EMAIL_HOST_USER
-    new_password = get_password()
-    extra_email_context = {'password': new_password}
 
     template_name = 'users/login.html'
     extra_context = {'title': 'Сброс пароля',
@@ -106,12 +136,16 @@ class UserPasswordResetView(PasswordResetView):
                      'text': 'Введите свой e-mail, указанный в профиле.'}
     success_url = reverse_lazy('users:reset_done')
 
+    @transaction.atomic
     def form_valid(self, form):
         user_mail = form.cleaned_data.get('email')
 
         try:
             user = User.objects.get(email=user_mail)
-            user.set_password(self.new_password)
+            # новый пароль создаётся для каждого запроса
+            new_password = get_password()
+            self.extra_email_context = {'password': new_password}
+            user.set_password(new_password)
             user.save()
             return super().form_valid(form)
 